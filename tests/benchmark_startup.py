@@ -0,0 +1,78 @@
+''' benchmark of the application startup, guarding against regressions
+
+	start the headless mode and the GUI (offscreen) several times with `--profile-startup`, and compare the best times of each initialization step to their budget. The process exits with an error status when a step exceeds its budget.
+
+	usage:
+
+		python tests/benchmark_startup.py [repeat]
+'''
+import sys, os
+import re
+import subprocess
+import tempfile
+
+# maximum time (seconds) of each step, measured from the process start when they are marks
+budgets = {
+	'batch': {
+		'import uimadcad.batch': 0.1,
+		'total': 0.3,
+		},
+	'gui': {
+		'import madcad': 1.5,
+		'import uimadcad': 0.5,
+		'documents': 1.,
+		'event loop started': 3.,
+		},
+	}
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timeline(argv:list[str], timeout:float=30) -> dict[str, float]:
+	''' duration of the steps and imports, and date of the marks, printed by a startup with `--profile-startup` '''
+	env = {**os.environ, 'PYTHONPATH': root, 'QT_QPA_PLATFORM': os.environ.get('QT_QPA_PLATFORM', 'offscreen')}
+	process = subprocess.Popen([sys.executable, '-m', 'uimadcad', '--profile-startup', *argv],
+		stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env)
+	times = {}
+	try:
+		# the GUI keeps running after its report, so the report is read until its end
+		for line in process.stderr:
+			match = re.match(r'\s*([\d.]+)s\s+(?:([\d.]+)s)?\s+(?:(import|step|mark) )?(.+)$', line)
+			if match:
+				start, duration, kind, label = match.groups()
+				if kind == 'import':
+					label = 'import '+label
+				times.setdefault(label.strip(), float(duration) if duration else float(start))
+			if line.strip().endswith('total'):
+				break
+	finally:
+		process.kill()
+		process.wait(timeout)
+	return times
+
+def main(repeat:int=5):
+	status = 0
+	with tempfile.TemporaryDirectory() as directory:
+		script = os.path.join(directory, 'script.py')
+		open(script, 'w').write('a = 1\n')
+		runs = {
+			'batch': ['--batch', script, '-q'],
+			'gui': [script],
+			}
+		for name, argv in runs.items():
+			best = {}
+			for i in range(repeat):
+				for label, time in timeline(argv).items():
+					best[label] = min(time, best.get(label, time))
+			for label, budget in budgets[name].items():
+				time = best.get(label)
+				if time is None:
+					print('{:>10}  {:>8}  {} {}: not reached'.format('', '', name, label))
+					status = 1
+					continue
+				print('{:>9.3f}s  {:>7.3f}s  {} {}{}'.format(time, budget, name, label, '  OVER BUDGET' if time > budget else ''))
+				if time > budget:
+					status = 1
+	return status
+
+if __name__ == '__main__':
+	sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,72 @@
+''' micro-benchmark of the code transformations performed before each execution
+	
+	compare the transform time of large synthetic scripts when the passes share one `Analysis` of the code, and when each pass walks the nodes again (as before the analysis was shared)
+	
+	usage:
+	
+		python tests/benchmark_transform.py [functions] [statements]
+'''
+import sys
+from time import perf_counter
+
+from uimadcad import ast
+
+
+class Unshared(ast.Analysis):
+	''' analysis walking the nodes again at each query '''
+	def reads(self, node):
+		return frozenset(ast.dependencies(node))
+	def writes(self, node):
+		return frozenset(ast.results(node))
+	def calls(self, node):
+		return any(isinstance(node, ast.Call)  for node in ast.walk(node))
+
+def synthetic(functions:int, statements:int) -> str:
+	''' script with the given number of functions, each with the given number of statements, called from the module '''
+	lines = []
+	for f in range(functions):
+		lines.append('def function{}(a, b):'.format(f))
+		for s in range(statements):
+			if s % 10 == 9:
+				lines.append('\tfor i in range(b):')
+				lines.append('\t\tparts.append(transform(v{}, vec3(i, a, {})))'.format(s-1, s))
+			elif s % 10 == 5:
+				lines.append('\tif a > {}:'.format(s))
+				lines.append('\t\tv{} = union(v{}, brick(width=a+{}))'.format(s, s-1, s))
+				lines.append('\telse:')
+				lines.append('\t\tv{} = v{}'.format(s, s-1))
+			else:
+				lines.append('\tv{} = extrusion(v{} if {} else b, vec3(0, 0, a*{}) + vec3(b, {}, 0))'.format(s, s-1 if s else 'a', s, s, s))
+		lines.append('\treturn v{}'.format(statements-1))
+	lines.append('parts = []')
+	for f in range(functions):
+		lines.append('r{} = function{}({}, {})'.format(f, f, f, f+1))
+	return '\n'.join(lines)+'\n'
+
+def transform(source:str, shared:bool) -> float:
+	''' time spent in the analysis and transformation passes preceding an execution '''
+	start = perf_counter()
+	code = ast.parse(source).body
+	if shared:
+		analysis = ast.Analysis(code, '<bench>')
+		definitions, usages = analysis.definitions, analysis.usage()
+	else:
+		analysis = Unshared()
+		definitions, usages = ast.locate(code, '<bench>'), ast.usage(code, '<bench>')
+	code = list(ast.parcimonize({}, '<bench>', (), set(), code, {}, 
+		filter = analysis.calls,
+		split = True,
+		analysis = analysis,
+		))
+	return perf_counter() - start
+
+def main(functions:int=100, statements:int=100, repeat:int=3):
+	source = synthetic(functions, statements)
+	print('{} lines'.format(source.count('\n')))
+	unshared = min(transform(source, False)  for i in range(repeat))
+	shared = min(transform(source, True)  for i in range(repeat))
+	print('{:>10.3f}s  passes walking the nodes again'.format(unshared))
+	print('{:>10.3f}s  passes sharing one analysis ({:.0%})'.format(shared, shared/unshared))
+
+if __name__ == '__main__':
+	main(*map(int, sys.argv[1:]))
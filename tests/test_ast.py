@@ -283,3 +283,53 @@ def test_usage_scopes():
         'root.chose': Usage(ro={'muche'}, wo={'_return'}, rw=set()),
         'root': Usage(ro={'truc', 'machin', 'chose'}, wo={'m', 'c', 't'}, rw=set()),
         }
+
+def test_results_pure():
+	def provided(code):
+		return set(results(parse(code).body[0]))
+	# methods are assumed to modify their object
+	assert provided('for i in a.sort(): c = i') == {'i', 'c', 'a'}
+	# unless they are known to not do so
+	assert provided('for i in a.copy(): c = i') == {'i', 'c'}
+	assert provided('for i in m.islands(): c = i') == {'i', 'c'}
+	assert provided('for i in m.mergeclose(): c = i') == {'i', 'c', 'm'}
+
+def test_analysis():
+	code = parse(normalize_indent('''\
+		from math import sin
+		def truc(a, b=len(x), *, c):
+			parts.append(a)
+			return [sin(i) for i in range(b)]
+		class Machin:
+			size = truc(1, c=2)
+		if (n := len(parts)) > 2:
+			d = {k: v  for k, v in zip(a, b)}
+		else:
+			e[n], f.g = truc(n, c=n)
+		''')).body
+	analysis = Analysis(code, 'root')
+	for node in walk(Module(code, [])):
+		if isinstance(node, (stmt, expr)):
+			assert analysis.reads(node) == set(dependencies(node))
+			assert analysis.writes(node) == set(results(node))
+			assert analysis.calls(node) == any(isinstance(child, Call)  for child in walk(node))
+	assert analysis.writes(code) == set(results(code))
+	assert isinstance(analysis.definitions['root']['n'], NamedExpr)
+	assert analysis.usage() == usage(code, 'root')
+
+def test_structural_hash():
+	def hashes(code):
+		return [Analysis().hash(node)  for node in parse(normalize_indent(code)).body]
+	# locations are ignored
+	assert hashes('a = f(x)\nb = 1') == hashes('\n\na =  f( x )\n# comment\nb = 1')
+	# but every operation and name is significant
+	assert hashes('f(a=1)') != hashes('f(b=1)')
+	assert hashes('a = 1') != hashes('a = 1.0')
+	assert hashes('def f(x): pass') != hashes('def f(y): pass')
+	assert hashes('if a: b\nelse: pass') != hashes('if a: pass\nelse: b')
+	
+	# constants changed inplace are hashed again
+	code = parse('a = [1, 2]').body
+	analysis = Analysis(code)
+	code[0].value.elts[1].value = 3
+	assert analysis.rehash(code[0]) == hashes('a = [1, 3]')[0]
@@ -0,0 +1,84 @@
+import io
+from uimadcad.batch import run, exports_destinations
+
+def test_batch(tmp_path):
+	script = tmp_path/'script.py'
+	script.write_text('def square(x):\n\treturn x*x\na = square(3)\nb = square(a)\n')
+	
+	output = io.StringIO()
+	assert run(str(script), {}, file=output) == 0
+	report = output.getvalue()
+	assert 'line 3     a = square(3)' in report
+	assert 'line 4     b = square(a)' in report
+	assert 'total' in report
+	
+	# undefined variables cannot be exported
+	assert run(str(script), {'c': str(tmp_path/'c.stl')}, file=io.StringIO()) == 1
+	
+	# exceptions lead to an error status
+	script.write_text('a = 1/0\n')
+	assert run(str(script), {}, file=io.StringIO()) == 1
+
+def test_exports_destinations():
+	assert exports_destinations('/tmp/part.py', ['a', 'b=b.ply'], format='obj') == {
+		'a': '/tmp/part-a.obj',
+		'b': '/tmp/b.ply',
+		}
+	assert exports_destinations('/tmp/part.py', ['a'], directory='/out') == {'a': '/out/part-a.stl'}
+
+def test_sweep(tmp_path):
+	from uimadcad.sweep import override, load_table, sweep
+	
+	source = 'a = 1\nb = [a, 2]\na = 3\nc = len(str(b))\n'
+	assert override(source, {'a': 5}) == 'a = 5\nb = [a, 2]\na = 3\nc = len(str(b))\n'
+	assert override(source, {'a': 'x', 'b': 0.5}) == "a = 'x'\nb = 0.5\na = 3\nc = len(str(b))\n"
+	
+	table = tmp_path/'table.csv'
+	table.write_text('name,a,b\nfirst,1,text\n,"(1, 2)",3.5\n')
+	assert load_table(str(table)) == [('first', {'a': 1, 'b': 'text'}), ('1', {'a': (1, 2), 'b': 3.5})]
+	
+	script = tmp_path/'script.py'
+	script.write_text('size = 1\nd = len(str(list(range(10))))\ne = len(str([size]*10))\n')
+	base, variants = sweep(str(script), [('a', {'size': 2}), ('b', {'size': 30})], {}, jobs=2)
+	assert not base.error
+	assert [variant.name for variant in variants] == ['a', 'b']
+	for variant in variants:
+		assert not variant.error
+		# only the calls depending on the parameter are executed again, the 4 calls of d are reused
+		assert (variant.hits, variant.misses) == (4, 2)
+	
+	# scripts import their sibling modules, in the base execution and in the workers
+	(tmp_path/'sibling.py').write_text('def twice(x):\n\treturn 2*x\n')
+	script.write_text('from sibling import twice\nsize = 1\ne = twice(size)\n')
+	base, variants = sweep(str(script), [('a', {'size': 2})], {}, jobs=1)
+	assert not base.error
+	assert not variants[0].error
+
+def test_batch_startup(tmp_path):
+	import os, sys, subprocess
+	script = tmp_path/'script.py'
+	script.write_text('a = 1\n')
+	# the modules are listed after the batch run, whatever time their import took
+	wrapper = (
+		'import sys, runpy\n'
+		'sys.argv = ["uimadcad", "--profile-startup", "--batch", {!r}, "-q"]\n'
+		'try:\n'
+		'	runpy.run_module("uimadcad", run_name="__main__")\n'
+		'except SystemExit as exit:\n'
+		'	status = exit.code\n'
+		'print("modules:", *sorted(sys.modules))\n'
+		'sys.exit(status)\n'
+		).format(str(script))
+	result = subprocess.run(
+		[sys.executable, '-c', wrapper], 
+		capture_output=True, text=True,
+		env={**os.environ, 'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.abspath(__file__)))},
+		)
+	assert result.returncode == 0, result.stderr
+	assert 'import uimadcad.batch' in result.stderr
+	assert 'total' in result.stderr
+	modules = result.stdout[result.stdout.index('modules:'):].split()[1:]
+	assert 'uimadcad.batch' in modules
+	# the headless mode must not import the GUI stack, nor any of its submodules
+	for module in ('madcad', 'moderngl', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6', 'yaml'):
+		assert not [name for name in modules if name == module or name.startswith(module+'.')], module
@@ -0,0 +1,588 @@
+import os
+import pytest
+from uimadcad.interpreter import Interpreter, Summarized, exception_stack, format_stack
+from uimadcad.ast import normalize_indent
+
+
+def test_snapshot():
+	code = normalize_indent('''\
+		def fail(points):
+			# a lambda scope is not reported to the interpreter scopes, so only its frame retains its variables
+			(lambda big: error)([float(i) for i in points])
+		a = list(range(10000))
+		fail(a)
+		''')
+	
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None)
+	exception = interpreter.exception
+	assert isinstance(exception, NameError)
+	assert exception.__traceback__ is not None
+	
+	stack = exception_stack(exception)
+	assert stack[-1].name == '<lambda>'
+	assert len(stack[-1].locals['big']) == 10000
+	# the variables are only shown in the scope view
+	assert 'big = ' not in ''.join(format_stack(stack))
+	
+	released = interpreter.snapshot(exception)
+	assert exception.__traceback__ is None
+	# the big list was only referenced by the frame
+	assert released > 10000*8
+	stack = exception_stack(exception)
+	assert stack[-1].name == '<lambda>'
+	assert isinstance(stack[-1].locals['big'], Summarized)
+	assert repr(stack[-1].locals['big']) == 'list of 10000 items'
+	
+	# the frames are released at the next execution
+	interpreter = Interpreter('<test>', keep_frames=False)
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception.__traceback__ is None
+	assert interpreter.released
+	interpreter.execute('a = 1', lambda *args: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['a'] == 1
+
+def test_execution_queue():
+	from threading import Event
+	from processional import SlaveThread
+	from uimadcad.interpreter import ExecutionQueue
+	
+	queue = ExecutionQueue(SlaveThread())
+	started = Event()
+	release = Event()
+	runs = []
+	def blocking():
+		started.set()
+		release.wait()
+		runs.append('blocking')
+	def task(name):
+		return lambda: runs.append(name)
+	
+	queue.submit(blocking, release.set)
+	started.wait()
+	queue.submit(task('first'))
+	queue.submit(task('second'))
+	queue.submit(task('last'))
+	queue.thread.invoke(lambda: None)
+	while queue.depth:
+		queue.thread.invoke(lambda: None)
+	
+	assert runs == ['blocking', 'last']
+	stats = queue.statistics()
+	assert stats['requested'] == 4
+	assert stats['completed'] == 1
+	assert stats['superseded'] == 2
+	assert stats['interrupted'] == 1
+	assert stats['wasted'] == 3
+
+def test_interrupt_before_start():
+	from threading import Event
+	from processional import SlaveThread
+	from uimadcad.interpreter import ExecutionQueue, InterpreterInterrupt
+	
+	interpreter = Interpreter('<test>')
+	queue = ExecutionQueue(SlaveThread())
+	dequeued = Event()
+	proceed = Event()
+	def rearm():
+		interpreter.rearm()
+		dequeued.set()
+	def execution():
+		proceed.wait()
+		interpreter.execute('a = len([1])', lambda *args: None)
+	queue.submit(execution, interpreter.interrupt, rearm)
+	dequeued.wait()
+	# interrupted after being dequeued, but before executing
+	queue.cancel()
+	proceed.set()
+	queue.thread.invoke(lambda: None)
+	assert isinstance(interpreter.exception, InterpreterInterrupt)
+	
+	# the next execution is not affected
+	queue.submit(lambda: interpreter.execute('a = 2', lambda *args: None), interpreter.interrupt, interpreter.rearm)
+	queue.thread.invoke(lambda: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['a'] == 2
+
+def test_report_progress():
+	interpreter = Interpreter('<test>')
+	seen = []
+	def step(scope, current, total):
+		interpreter.report_progress()
+		seen.append(sorted(name  for name in interpreter.scopes.get('<test>', {})  if name in 'abc'))
+	interpreter.execute('a = abs(1)\nb = abs(a)\nc = abs(b)\n', step)
+	assert interpreter.exception is None
+	assert seen == [[], ['a'], ['a', 'b']]
+	assert interpreter.scopes['<test>']['c'] == 1
+
+def test_staged():
+	from uimadcad.interpreter import InterpreterInterrupt
+	interpreter = Interpreter('<test>')
+	interpreter.execute('a = abs(1)\nb = abs(a)\n', lambda *args: None)
+	locations = interpreter.locations
+	
+	# an interrupted staged execution leaves the previous one in place, even while it runs
+	running = []
+	def step(scope, current, total):
+		running.append((interpreter.source, interpreter.locations))
+		if current == 2:
+			interpreter.interrupt()
+	interpreter.execute('a = abs(2)\nb = abs(a)\nc = abs(b)\n', step, staged=True)
+	assert isinstance(interpreter.exception, InterpreterInterrupt)
+	assert interpreter.source == 'a = abs(1)\nb = abs(a)\n'
+	assert interpreter.locations is locations
+	assert running and all(source == 'a = abs(1)\nb = abs(a)\n' and located is locations  for source, located in running)
+	assert interpreter.scopes['<test>']['a'] == 1
+	assert 'c' not in interpreter.scopes['<test>']
+	
+	interpreter.rearm()
+	interpreter.execute('a = abs(2)\nb = abs(a)\nc = abs(b)\n', lambda *args: None, staged=True)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['c'] == 2
+	assert interpreter.name_at(interpreter.source.index('c')).name == 'c'
+
+@pytest.fixture
+def recorder():
+	''' tags recorded by the executed scripts calling `_test_record(tag, value)`, which returns the value '''
+	import builtins
+	calls = []
+	def record(tag, value=None):
+		calls.append(tag)
+		return value
+	builtins._test_record = record
+	yield calls
+	del builtins._test_record
+
+def test_scrub(recorder):
+	code = normalize_indent('''\
+		def slow(x, tag):
+			r = _test_record(tag)
+			return x
+		width = 3
+		a = slow(width*2, 'a')
+		b = slow(10, 'b')
+		def f(y):
+			z = slow(y+1.5, 'f')
+			return z
+		c = f(a)
+		d = slow(b+1, 'd')
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None)
+	assert recorder == ['a', 'b', 'f', 'd']
+	
+	# only dependent statements are executed again
+	recorder.clear()
+	assert interpreter.scrub(code.index('3\n'), 5, lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == ['a', 'f']
+	assert interpreter.scopes['<test>']['c'] == 11.5
+	
+	# literals in functions change the statements using the function
+	recorder.clear()
+	assert interpreter.scrub(code.index('1.5'), 2.5, lambda *args: None)
+	assert recorder == ['f']
+	assert interpreter.scopes['<test>']['c'] == 12.5
+	
+	# not a literal
+	assert not interpreter.scrub(code.index('width'), 1, lambda *args: None)
+	
+	# executing the changed source does not execute anything again
+	recorder.clear()
+	interpreter.execute(code.replace('width = 3', 'width = 5').replace('1.5', '2.5'), lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == []
+
+def test_subexpressions(recorder):
+	code = normalize_indent('''\
+		a = 1
+		b = 2
+		c = _test_record('c', _test_record('a', a) + _test_record('b', b))
+		d = _test_record('d', a) if b else _test_record('e', a)
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	assert sorted(recorder) == ['a', 'b', 'c', 'd']
+	
+	# only the nested recorder depending on the change are executed again
+	recorder.clear()
+	interpreter.execute(code.replace('b = 2', 'b = 3'), lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == ['b', 'c', 'd']
+	assert interpreter.scopes['<test>']['c'] == 4
+	# conditional expressions are not splitted
+	assert not any(name.startswith('_madcad_d')  for name in interpreter.scopes['<test>'])
+
+def test_invalidations():
+	code = normalize_indent('''\
+		a = [3, 1, 2]
+		b = sorted(a)
+		for i in a.copy():
+			c = i
+		d = len(b)
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None)
+	assert {invalidation.reason  for invalidation in interpreter.invalidated} == {'new statement'}
+	
+	interpreter.execute(code.replace('2]', '4]'), lambda *args: None)
+	reasons = {invalidation.key: invalidation.reason  for invalidation in interpreter.invalidated}
+	assert reasons['a1'] == 'code changed'
+	assert reasons['b1'] == 'depends on changed a'
+	assert reasons['d1'] == 'depends on changed b'
+
+def test_store_assignments(recorder):
+	code = normalize_indent('''\
+		parts = dict(base=_test_record('base', 0))
+		parts['gear'] = _test_record('gear', 1)
+		parts['screw'] = _test_record('screw', 2)
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == ['base', 'gear', 'screw']
+	
+	# the other stores do not depend on the changed part
+	recorder.clear()
+	interpreter.execute(code.replace("'gear', 1", "'gear', 3"), lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == ['gear']
+	assert interpreter.scopes['<test>']['parts'] == dict(base=0, gear=3, screw=2)
+	
+	# cached values are stored again into a new container
+	recorder.clear()
+	interpreter.execute(code.replace("'base', 0", "'base', 4").replace("'gear', 1", "'gear', 3"), lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == ['base']
+	assert interpreter.scopes['<test>']['parts'] == dict(base=4, gear=3, screw=2)
+
+def test_iterations(recorder):
+	code = normalize_indent('''\
+		sizes = [1, 2, 3]
+		parts = []
+		total = 0
+		for size in sizes:
+			parts.append(_test_record(size, size*2))
+			total = total + _test_record(-size, size)
+		''')
+	interpreter = Interpreter('<test>', iterations=True)
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == [1, -1, 2, -2, 3, -3]
+	
+	# only the iteration of the changed element is executed again
+	recorder.clear()
+	interpreter.execute(code.replace('[1, 2, 3]', '[1, 5, 3]'), lambda *args: None)
+	assert interpreter.exception is None
+	assert recorder == [5, -5]
+	assert interpreter.scopes['<test>']['parts'] == [2, 10, 6]
+	assert interpreter.scopes['<test>']['total'] == 9
+	
+	# names bound by lambdas and comprehensions in the loop are not loop inputs
+	interpreter.execute(normalize_indent('''\
+		scales = []
+		for x in [1, 2]:
+			f = lambda t: t*x
+			scales.append(f(2) + sum(y*x  for y in range(3)))
+		'''), lambda *args: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['scales'] == [5, 10]
+
+def test_fingerprint():
+	from uimadcad.ast import fingerprint
+	from copy import deepcopy
+	from types import SimpleNamespace as Part
+	part = Part(size=[1, 2])
+	assert hash(fingerprint([part, {'a': part}])) == hash(fingerprint(deepcopy([part, {'a': part}])))
+	assert fingerprint(Part(size=[1, 3])) != fingerprint(part)
+	def factory(k):
+		return lambda x: x*k
+	assert fingerprint(factory(1)) == fingerprint(factory(1))
+	assert fingerprint(factory(1)) != fingerprint(factory(2))
+	
+	# objects referring to themselves
+	looped = [1, 2]
+	looped.append(looped)
+	copied = deepcopy(looped)
+	assert fingerprint(looped) == fingerprint(copied)
+	copied[0] = 0
+	assert fingerprint(looped) != fingerprint(copied)
+	def recursive(k):
+		def rec(n):
+			return k if n <= 0 else rec(n-1)
+		return rec
+	assert fingerprint(recursive(1)) == fingerprint(recursive(1))
+	assert fingerprint(recursive(1)) != fingerprint(recursive(2))
+
+def test_iterations_recursive():
+	# the loop inputs are fingerprinted, including a recursive function in its own closure
+	interpreter = Interpreter('<test>', iterations=True)
+	interpreter.execute(normalize_indent('''\
+		def build():
+			def rec(n):
+				return 0 if n <= 0 else n + rec(n-1)
+			return rec
+		f = build()
+		total = []
+		for x in [1, 2]:
+			total.append(f(x))
+		'''), lambda *args: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['total'] == [1, 3]
+
+def test_collect():
+	code = normalize_indent('''\
+		big = bytearray(100000)
+		def f(x):
+			y = len(x)
+			return y
+		small = f(big) + len(str(big))
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	scope = interpreter.scopes['<test>']
+	assert {'big', 'f', 'small'} <= set(scope)
+	# only the selectable temporaries are kept
+	assert not any(name.startswith('__') or name in ('_madcad_tmp', '_madcad_cache')  for name in scope)
+	
+	# variables and cached results no longer defined are released
+	interpreter.execute('small = 1', lambda *args: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes == {'<test>': {'small': 1}}
+	assert interpreter.collected[('<test>', 'big')] > 100000
+	assert interpreter.collected[('<test>', 'big1')] > 100000
+	assert list(interpreter.previous) == ['<test>']
+	
+	# the names brought by star imports are not released
+	code = normalize_indent('''\
+		from math import *
+		from os.path import *
+		a = sqrt(2)
+		b = join('a', 'b')
+		''')
+	interpreter.execute(code, lambda *args: None)
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	assert {'sqrt', 'pi', 'join', 'a', 'b'} <= set(interpreter.scopes['<test>'])
+	assert not interpreter.collected
+	interpreter.execute(code.replace("b = join('a', 'b')", ''), lambda *args: None)
+	assert 'b' not in interpreter.scopes['<test>'] and 'sqrt' in interpreter.scopes['<test>']
+	assert list(interpreter.collected) == [('<test>', 'b')]
+
+def test_tiers():
+	from uimadcad.storage import Tiers, Compressed, Spilled
+	from uimadcad.ast import ArgumentsKey
+	code = normalize_indent('''\
+		a = list(range(10000))
+		b = list(range(10000, 20000))
+		c = list(range(20000, 30000))
+		d = (a, b, c)
+		''')
+	# budgets for about one list per tier
+	tiers = Tiers(hot=100_000, warm=30_000, threshold=1000)
+	interpreter = Interpreter('<test>', tiers=tiers)
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	cache = interpreter.cache['<test>'][ArgumentsKey(())]
+	stored = [type(cache.scope[key])  for key in sorted(cache.scope)]
+	assert Compressed in stored and Spilled in stored
+	statistics = tiers.statistics()
+	assert statistics['demotions'] >= 2
+	assert statistics['cold']['entries'] and statistics['warm']['entries']
+	
+	# retreiving values promotes them
+	interpreter.execute(code.replace('d = (a, b, c)', 'd = (a, b, c, 1)'), lambda *args: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['d'][2][0] == 20000
+	statistics = tiers.statistics()
+	assert statistics['promotions'] == statistics['warm']['hits'] + statistics['cold']['hits'] > 0
+	
+	# removed entries release their files
+	spilled = [stored.path  for stored in cache.scope.values()  if isinstance(stored, Spilled)]
+	interpreter.execute('a = 1', lambda *args: None)
+	assert tiers.statistics()['cold']['entries'] == 0
+	assert not any(os.path.exists(path)  for path in spilled)
+
+def test_resolution():
+	from madcad import settings
+	default = tuple(settings.resolution)
+	code = normalize_indent('''\
+		from madcad import settings
+		r = tuple(settings.resolution)
+		p = _madcad_resolution
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.resolution = ['rad', 1.]
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.exception is None
+	assert interpreter.scopes['<test>']['r'] == interpreter.scopes['<test>']['p'] == ('rad', 1.)
+	assert tuple(settings.resolution) == default
+	preview = interpreter.cache
+	
+	# full quality results are cached separately
+	interpreter.resolution = None
+	interpreter.execute(code, lambda *args: None)
+	assert interpreter.scopes['<test>']['r'] == default
+	assert interpreter.cache is not preview
+	interpreter.resolution = ('rad', 1.)
+	assert interpreter.cache is preview
+	
+	interpreter.clear_cache()
+	assert not interpreter.cache and not interpreter._namespaces
+	
+	# an other document does not execute with the resolution of a preview running meanwhile
+	from threading import Thread
+	interpreter.resolution = ('rad', 1.)
+	running = Thread(target=interpreter.execute, args=(code + 'import time\ntime.sleep(0.2)\n', lambda *args: None))
+	running.start()
+	import time
+	time.sleep(0.05)
+	other = Interpreter('<other>')
+	other.execute(code, lambda *args: None)
+	running.join()
+	assert interpreter.scopes['<test>']['r'] == ('rad', 1.)
+	assert other.scopes['<other>']['r'] == default
+	assert tuple(settings.resolution) == default
+	
+	# an execution waiting for the preview to end can still be interrupted
+	from uimadcad.interpreter import InterpreterInterrupt
+	running = Thread(target=interpreter.execute, args=(code + 'import time\ntime.sleep(1)\n', lambda *args: None))
+	running.start()
+	time.sleep(0.05)
+	waiting = Thread(target=other.execute, args=(code + 'c = 1\n', lambda *args: None))
+	waiting.start()
+	time.sleep(0.05)
+	other.interrupt()
+	waiting.join(0.5)
+	assert not waiting.is_alive()
+	assert isinstance(other.exception, InterpreterInterrupt)
+	running.join()
+	assert interpreter.exception is None
+
+def test_demand():
+	code = normalize_indent('''\
+		from math import sqrt
+		def f(x):
+			return sqrt(x*k)
+		k = 2
+		a = f(2)
+		b = f(8)
+		c = [a]
+		c.append(f(18))
+		''')
+	interpreter = Interpreter('<test>')
+	interpreter.execute(code, lambda *args: None, demand={'c'})
+	assert interpreter.exception is None
+	scope = interpreter.scopes['<test>']
+	assert scope['c'] == [2, 6]
+	assert 'b' not in scope
+	assert interpreter.deferred == 1
+	
+	# the deferred statements are executed, the others come from the cache
+	interpreter.resume(lambda *args: None)
+	assert interpreter.exception is None and interpreter.deferred == 0
+	assert interpreter.scopes['<test>']['b'] == 4
+	
+	# statements not demanded keep their previous values until resumed
+	interpreter.execute(code.replace('f(8)', 'f(32)'), lambda *args: None, demand={'a'})
+	assert interpreter.scopes['<test>']['b'] == 4
+	interpreter.resume(lambda *args: None)
+	assert interpreter.scopes['<test>']['b'] == 8
+	
+	# an interruption arriving between the demanded execution and its resumption stops the resumption
+	from uimadcad.interpreter import InterpreterInterrupt
+	interpreter.execute(code.replace('f(8)', 'f(2)'), lambda *args: None, demand={'a'})
+	assert interpreter.exception is None
+	interpreter.interrupt()
+	interpreter.resume(lambda *args: None)
+	assert isinstance(interpreter.exception, InterpreterInterrupt)
+
+def test_shared(tmp_path):
+	from uimadcad.storage import SharedStore
+	code = normalize_indent('''\
+		def part(n):
+			return [float(i) for i in range(n)]
+		a = part(1000)
+		''')
+	first = Interpreter('<first>', shared=SharedStore(str(tmp_path), threshold=0))
+	first.execute(code, lambda *args: None)
+	assert first.exception is None
+	assert first.shared.writes
+	
+	# an other document computing the same value with different names
+	second = Interpreter('<second>', shared=SharedStore(str(tmp_path), threshold=0))
+	second.execute(normalize_indent('''\
+		def part(n):
+			return [float(i) for i in range(n)]
+		count = 1000
+		b = part(count)
+		'''), lambda *args: None)
+	assert second.exception is None
+	assert second.shared.hits == 1
+	assert second.scopes['<second>']['b'] == first.scopes['<first>']['a']
+	
+	# a different function body is a different content
+	third = Interpreter('<third>', shared=SharedStore(str(tmp_path), threshold=0))
+	third.execute(code.replace('float(i)', 'float(-i)'), lambda *args: None)
+	assert third.shared.hits == 0
+	assert third.scopes['<third>']['a'][1] == -1.
+	
+	# documents of a same process share the values in memory
+	fourth = Interpreter('<fourth>', shared=third.shared)
+	fourth.execute(code.replace('float(i)', 'float(-i)'), lambda *args: None)
+	assert third.shared.hits == 1
+	assert fourth.cache['<fourth>.part'] and third.shared.recent
+	
+	# a script modifying its value after it is cached does not alter the value shared
+	store = SharedStore(str(tmp_path / 'mutated'), threshold=0)
+	fifth = Interpreter('<fifth>', shared=store)
+	fifth.execute(code + 'a.append(-1.)\n', lambda *args: None)
+	assert fifth.scopes['<fifth>']['a'][-1] == -1.
+	sixth = Interpreter('<sixth>', shared=store)
+	sixth.execute(code, lambda *args: None)
+	assert store.hits == 1
+	assert len(sixth.scopes['<sixth>']['a']) == 1000
+	
+	# without persistence, the documents of the process still share the values in memory
+	store = SharedStore(str(tmp_path / 'memory'), threshold=0, persistent=False)
+	Interpreter('<seventh>', shared=store).execute(code, lambda *args: None)
+	eighth = Interpreter('<eighth>', shared=store)
+	eighth.execute(code, lambda *args: None)
+	assert store.hits == 1 and store.writes == 0
+	assert len(eighth.scopes['<eighth>']['a']) == 1000
+	assert not os.path.exists(tmp_path / 'memory')
+
+def test_digest():
+	import sys, subprocess
+	from uimadcad.storage import digest
+	value = ('part', {'size': 2.5, 'names': ['a', 'b']}, {'x', 'y'}, len)
+	command = 'from uimadcad.storage import digest; print(digest({}))'.format(repr(value).replace('<built-in function len>', 'len'))
+	# string hashes are randomized between processes, digests are not
+	for seed in ('1', '2'):
+		result = subprocess.run([sys.executable, '-c', command], capture_output=True, text=True, env={**os.environ, 'PYTHONHASHSEED': seed})
+		assert result.stdout.strip() == digest(value)
+	assert digest(value) != digest(('part', {'size': 2.6, 'names': ['a', 'b']}, {'x', 'y'}, len))
+	# sets of objects that cannot be addressed cannot be either
+	from threading import Lock
+	assert digest({Lock()}) is None
+	assert digest({1, Lock()}) is None
+
+def test_digest_local_module(tmp_path):
+	import sys, importlib
+	from uimadcad.storage import digest
+	module = tmp_path/'_test_helpers.py'
+	module.write_text('def helper(x):\n\treturn inner(x)\ndef inner(x):\n\treturn x\n')
+	sys.path.insert(0, str(tmp_path))
+	try:
+		helpers = importlib.import_module('_test_helpers')
+		before = digest(helpers.helper)
+		# an inner helper changed, not the function itself
+		module.write_text('def helper(x):\n\treturn inner(x)\ndef inner(x):\n\treturn 2*x\n')
+		os.utime(module, (1, 1))
+		assert digest(helpers.helper) != before
+	finally:
+		sys.path.pop(0)
+		sys.modules.pop('_test_helpers', None)
@@ -48,3 +48,33 @@ def test_substitution_index():
 	assert index.steps() == 1
 	test(17, add=1)
 	assert index.steps() == 2
+
+def test_text_substitutions():
+	from uimadcad.scriptview import text_substitutions
+	
+	# positions are in UTF-16 units, like in Qt documents
+	def apply(text, substitutions):
+		text = text.encode('utf-16-le')
+		for position, removed, added in substitutions:
+			text = text[:2*position] + added.encode('utf-16-le') + text[2*(position+removed):]
+		return text.decode('utf-16-le')
+	
+	old = 'a = 1\nb = a+1\nc = b\n\nprint(c)\n'
+	for new in [
+		old,
+		'',
+		'a = 2\nb = a+1\nc = b\n\nprint(c)\n',
+		'a = 1\nb = a+1\nd = 5\nc = b\n\nprint(c)\n',
+		'b = a+1\nc = b\n\nprint(c)',
+		'a = 1\nb = a+1\nc = b\n\nprint(c)\nprint(a)',
+		'# \U0001f600 smile\na = 1\nb = a+2\nc = b\n\nprint(c)\n',
+		]:
+		substitutions = text_substitutions(old, new)
+		assert apply(old, substitutions) == new
+		assert sorted(substitutions, reverse=True) == substitutions
+	
+	assert text_substitutions(old, old) == []
+	assert text_substitutions(old, old.replace('b = a+1', 'b = a+2')) == [(6, 8, 'b = a+2\n')]
+	# the emoji takes two positions
+	emoji = '# \U0001f600\n' + old
+	assert text_substitutions(emoji, emoji.replace('b = a+1', 'b = a+2')) == [(11, 8, 'b = a+2\n')]
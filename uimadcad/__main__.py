@@ -3,17 +3,33 @@ if __name__ == '__main__':
 
 	# import the minimal runtime before checks
 	import sys, os, locale
+	
+	# the timeline must be installed before the imports it measures
+	from uimadcad import startup
+	if '--profile-startup' in sys.argv:
+		sys.argv.remove('--profile-startup')
+		startup.Timeline().install()
+	
+	# the headless mode must not import Qt nor OpenGL
+	if len(sys.argv) >= 2 and sys.argv[1] == '--batch':
+		from uimadcad.batch import main
+		status = main(sys.argv[2:])
+		if startup.timeline:
+			startup.timeline.report()
+		sys.exit(status)
 
-	import madcad
-	from madcad.qt import (
-		Qt, QTimer,
-		QIcon,
-		QApplication, QErrorMessage, QMessageBox,
-		)
+	with startup.step('import madcad'):
+		import madcad
+		from madcad.qt import (
+			Qt, QTimer,
+			QIcon,
+			QApplication, QErrorMessage, QMessageBox,
+			)
 	
-	from uimadcad import version, settings, resourcedir
-	from uimadcad.utils import *
-	from uimadcad.app import Madcad
+	with startup.step('import uimadcad'):
+		from uimadcad import version, settings, resourcedir
+		from uimadcad.utils import *
+		from uimadcad.app import Madcad
 	
 	# set process name
 	if sys.platform == 'linux':
@@ -24,42 +40,53 @@ if __name__ == '__main__':
 		buff.value = newname
 		libc.prctl(15, byref(buff), 0, 0, 0)
 	
-	# parse commandline arguments
-	file = None
-	if len(sys.argv) >= 2:
-		file = sys.argv[1]
-	
-	# set Qt opengl context sharing to avoid reinitialization of scenes everytime, (this is for pymadcad display)
-	QApplication.setAttribute(Qt.AA_ShareOpenGLContexts, True)
-	# setup Qt application
-	app = QApplication(sys.argv)
-	app.setApplicationName('madcad')
-	app.setApplicationVersion(version)
-	app.setApplicationDisplayName('madcad v{}'.format(version))
-	
-	# set icons as not always provided by the system
-	path = QIcon.themeSearchPaths()
-	path.append(resourcedir + '/icons')
-	QIcon.setThemeSearchPaths(path)
-	QIcon.setThemeName('breeze')
+	# parse commandline arguments, each file is open in its own document
+	files = sys.argv[1:] or [None]
 	
-	madcad.settings.install()
-	madcad.settings.load()
-	settings.install()
-	settings.load()
-	settings.use_color_preset()
-	settings.use_stylesheet()
+	with startup.step('application'):
+		# set Qt opengl context sharing to avoid reinitialization of scenes everytime, (this is for pymadcad display)
+		QApplication.setAttribute(Qt.AA_ShareOpenGLContexts, True)
+		# setup Qt application
+		app = QApplication(sys.argv)
+		app.setApplicationName('madcad')
+		app.setApplicationVersion(version)
+		app.setApplicationDisplayName('madcad v{}'.format(version))
+		
+		# set icons as not always provided by the system
+		path = QIcon.themeSearchPaths()
+		path.append(resourcedir + '/icons')
+		QIcon.setThemeSearchPaths(path)
+		QIcon.setThemeName('breeze')
 	
-	# set locale settings to C default to get correct 'repr' of glm types
-	locale.setlocale(locale.LC_NUMERIC, 'C')
+	with startup.step('settings'):
+		madcad.settings.install()
+		madcad.settings.load()
+		settings.install()
+		settings.load()
+		settings.use_color_preset()
+		settings.use_stylesheet()
+		
+		# set locale settings to C default to get correct 'repr' of glm types
+		locale.setlocale(locale.LC_NUMERIC, 'C')
+		
+		# create or load config
+		if madcad.settings.display['system_theme']:
+			madcad.settings.use_qt_colors()
+		if settings.scriptview['system_theme']:
+			settings.use_qt_colors()
 	
-	# create or load config
-	if madcad.settings.display['system_theme']:
-		madcad.settings.use_qt_colors()
-	if settings.scriptview['system_theme']:
-		settings.use_qt_colors()
+	# start software, documents are kept referenced by `uimadcad.app.documents`
+	with startup.step('documents'):
+		for file in files:
+			Madcad(file)
 	
-	# start software
-	madcad = Madcad(file)
+	# the timeline ends when the event loop starts processing the windows events
+	if startup.timeline:
+		timeline = startup.timeline
+		def report():
+			timeline.mark('event loop started')
+			timeline.uninstall()
+			timeline.report()
+		QTimer.singleShot(0, report)
 	
 	qtmain(app)
@@ -1,18 +1,20 @@
 import sys, os
+from time import perf_counter
 from dataclasses import dataclass
 
 from processional import SlaveThread
 from madcad.qt import (
-	QObject, QApplication, QTimer,
+	QObject, QApplication, QTimer, QFileSystemWatcher,
 	QTextDocument, QFileDialog, QErrorMessage, QPlainTextDocumentLayout,
 	)
 
-from . import settings
-from .utils import signal, window, action, button, Initializer, qtschedule
-from .interpreter import Interpreter
+from . import settings, ast, startup
+from .utils import signal, window, action, button, singleton, Initializer, qtschedule
+from .interpreter import Interpreter, InterpreterInterrupt, ExecutionQueue
+from .storage import Tiers, SharedStore
 from .mainwindow import MainWindow
 from .sceneview import Scene
-from .scriptview import SubstitutionIndex
+from .scriptview import SubstitutionIndex, text_substitutions, apply_text_substitutions
 
 
 @dataclass
@@ -28,8 +30,14 @@ class Active:
 	date: float = 0.
 	export: str = None
 
+# documents open in this process
+documents = []
+
 class Madcad(QObject):
-	''' a uimadcad application instance '''
+	''' a uimadcad document: its script, interpreter, scenes and window
+	
+		Several documents can be open in the same process, they share the openGL context and its resources, the icons, and the cached values (see `cache_tiers` and `shared_store`)
+	'''
 	active_changed = signal()
 	file_changed = signal()
 	executed = signal()
@@ -39,22 +47,76 @@ class Madcad(QObject):
 		Initializer.process(self)
 		
 		self.active = Active()
+		ast.pure_methods.update(settings.execution['pure_methods'])
+		ast.pure_functions.update(settings.execution['pure_functions'])
 		self.scenes = []
 		self.views = set()
-		self.interpreter = Interpreter('<uimadcad>')
+		with startup.step('interpreter'):
+			self.interpreter = Interpreter('<uimadcad>', 
+				keep_frames = settings.execution['keep_frames'],
+				iterations = settings.execution['iteration_cache'],
+				tiers = cache_tiers(),
+				shared = shared_store(),
+				)
 		self.document = QTextDocument(self)
 		self.document.setDocumentLayout(QPlainTextDocumentLayout(self.document))
 		self.reindex = SubstitutionIndex()
-		self.window = window(MainWindow(self))
+		with startup.step('window'):
+			self.window = window(MainWindow(self))
 		self.thread = SlaveThread()
+		self.executions = ExecutionQueue(self.thread)
 		
+		# the file watcher is notified by the system (inotify, kqueue, ...) when available
+		self._watcher = QFileSystemWatcher(self)
+		self._watcher.fileChanged.connect(self._file_event)
+		self._watcher.directoryChanged.connect(self._file_event)
+		# editors often save in several steps (truncate, write, rename), so wait for the burst to end
+		self._debounce_timer = QTimer(self)
+		self._debounce_timer.setSingleShot(True)
+		self._debounce_timer.setInterval(settings.execution['file_debounce'])
+		self._debounce_timer.timeout.connect(self.check_change)
+		# polling fallback when the watcher cannot follow the file
 		self._check_change_timer = QTimer(self)
 		self._check_change_timer.setInterval(5000)
 		self._check_change_timer.timeout.connect(self.check_change)
+		# live execution waits for the user to stop typing
+		self._live_timer = QTimer(self)
+		self._live_timer.setSingleShot(True)
+		self._live_timer.setInterval(settings.execution['live_delay'])
+		self._live_timer.timeout.connect(self._live_execute)
+		self._live_running = False
+		# index of the changes since the start of the running live execution, replacing `reindex` once it completes
+		self._live_reindex = None
+		# full quality execution once the user is idle, following a preview execution
+		self._refine_timer = QTimer(self)
+		self._refine_timer.setSingleShot(True)
+		self._refine_timer.setInterval(settings.execution['preview_delay'])
+		self._refine_timer.timeout.connect(self._refine)
+		self._previewed = None
+		# a numeric literal is being scrubbed
+		self.scrubbing = False
 		
-		self.document.contentsChange.connect(self.reindex.substitute)
+		self.document.contentsChange.connect(self._reindex)
+		self.document.contentsChange.connect(self._live_change)
 		
-		self.load_file(file)
+		with startup.step('load file'):
+			self.load_file(file)
+		documents.append(self)
+	
+	def close(self):
+		''' release the resources of this document, its window being closed '''
+		if self not in documents:
+			return
+		documents.remove(self)
+		self._unwatch()
+		self._live_timer.stop()
+		self._refine_timer.stop()
+		interpreter = self.interpreter
+		def release():
+			interpreter.release()
+			interpreter.clear_cache()
+		self.executions.submit(release)
+		self.thread.close()
 		
 	def load_file(self, file=None):
 		''' load the content of the file at the given path and replace the current scritpt '''
@@ -63,8 +125,21 @@ class Madcad(QObject):
 		self.window.setWindowFilePath(self.active.file or 'untitled')
 		self.document.setPlainText(open(self.active.file or settings.locations['startup'], 'r').read())
 		self.document.setModified(False)
+		self._rewatch()
 		if not file:
 			self.execute.trigger()
+	
+	def reload_file(self):
+		''' reload the content of the current file, only changing the parts of the document that differ 
+			so the highlighting, undo history and execution caches are kept for the unchanged code
+		'''
+		date = os.path.getmtime(self.active.file)
+		new = open(self.active.file, 'r').read()
+		substitutions = text_substitutions(self.document.toPlainText(), new)
+		self.active.date = date
+		apply_text_substitutions(self.document, substitutions)
+		self.document.setModified(False)
+		return bool(substitutions)
 
 	def open_file_external(self, file):
 		''' open a file with an appropriate software decided by the desktop '''
@@ -76,7 +151,7 @@ class Madcad(QObject):
 			raise EnvironmentError('unable to open a textfile on platform {}'.format(os.platform))
 
 	def open_uimadcad(self, *args):
-		''' execute a new instance of uimadcad in a separate process '''
+		''' execute a new instance of uimadcad in a separate process, documents are rather opened in the current process (see `new` and `open`) '''
 		argv = [sys.executable, '-P', '-m', 'uimadcad']
 		argv.extend(args)
 		os.spawnv(os.P_NOWAIT, sys.executable, argv)
@@ -100,33 +175,207 @@ class Madcad(QObject):
 			when disabled, you must trigger manually
 		'''
 		if enable:
-			self.load_file(self.active.file)
+			if self.active.file:
+				self.reload_file()
+				self._watch()
 			self.execute.trigger()
+		else:
+			self._unwatch()
+	
+	def _watch(self):
+		''' follow changes of the current file '''
+		self._unwatch()
+		if not self.active.file:
+			return
+		# the directory is watched as well because many editors save by replacing the file, which drops the file watch
+		failed = self._watcher.addPaths([self.active.file, os.path.dirname(os.path.abspath(self.active.file))])
+		if failed:
 			self._check_change_timer.start()
+	
+	def _rewatch(self):
+		''' follow the current file after it changed, if the file changes trigger executions '''
+		if self.trigger_on_file_change.isChecked():
+			self._watch()
 		else:
-			self._check_change_timer.stop()
+			self._unwatch()
+	
+	def _unwatch(self):
+		''' stop following changes of the current file '''
+		paths = self._watcher.files() + self._watcher.directories()
+		if paths:
+			self._watcher.removePaths(paths)
+		self._check_change_timer.stop()
+		self._debounce_timer.stop()
+	
+	def _file_event(self, path):
+		''' a watched path changed, wait for the end of the burst of changes before checking '''
+		self._debounce_timer.start()
 			
 	def check_change(self):
 		''' if enabled, check if the file changed on disk, then reload and reexecute it '''
-		if self.trigger_on_file_change.isChecked():
-			disk = os.path.getmtime(self.active.file)
+		if self.trigger_on_file_change.isChecked() and self.active.file:
+			try:
+				disk = os.path.getmtime(self.active.file)
+			except OSError:
+				# the file is being replaced, a new event will come once it is back
+				return
+			# the file watch is lost when the file has been replaced
+			if self.active.file not in self._watcher.files():
+				self._watcher.addPath(self.active.file)
 			if disk > self.active.date:
-				self.load_file(self.active.file)
-				self.execute.trigger()
+				if self.reload_file():
+					self.execute.trigger()
 	
 	@action(icon='media-playback-start', shortcut='Ctrl+Return')
 	def execute(self):
 		''' run the script. 
 			a parcimonial interpreter will take care of reexecuting only the changed code
 		'''
-		self.stop.trigger()
 		self.window.open_panel.setChecked(True)
+		self.run(self.document.toPlainText())
+	
+	@action(icon='insert-text', checked=False, shortcut='Ctrl+Shift+E')
+	def live_execution(self, enable):
+		''' run the script automatically while typing
+		
+			the script is executed in background when the user stops typing, 
+			results are displayed when the execution completes
+		'''
+		if enable:
+			self._live_timer.start()
+		else:
+			self._live_timer.stop()
+			if self._live_running:
+				self.executions.cancel()
+	
+	def _reindex(self, position, removed, added):
+		''' follow the document changes in the index of the executed source, and of the live execution running '''
+		self.reindex.substitute(position, removed, added)
+		if self._live_reindex is not None:
+			self._live_reindex.substitute(position, removed, added)
+	
+	def _live_change(self, position, removed, added):
+		''' the document changed, cancel the current live execution and wait for the user to stop typing '''
+		if not self.scrubbing:
+			self._refine_timer.stop()
+		if not self.live_execution.isChecked() or self.scrubbing:
+			return
+		if self._live_running:
+			self.executions.cancel()
+		self._live_timer.start()
+	
+	def _live_execute(self):
+		''' start a live execution if the script is valid python '''
+		code = self.document.toPlainText()
+		try:
+			ast.parse(code)
+		except SyntaxError:
+			# the user is certainly still typing, a next change will start a new execution
+			return
+		self.run(code, live=True)
+	
+	@action(icon='view-grid', checked=False, shortcut='Ctrl+Shift+P')
+	def preview(self, enable):
+		''' execute with a coarse curve resolution, for a faster feedback while editing
+		
+			the script is executed again at full quality in background once the user is idle.
+			The preview and full quality results are cached separately
+		'''
+		if not enable and self._previewed is not None:
+			self._refine()
+	
+	@action(icon='go-jump', checked=False, shortcut='Ctrl+Shift+R')
+	def demand_execution(self, enable):
+		''' execute first only the statements needed by the variables displayed or selected, then the rest of the script in background
+		
+			this gives a faster feedback when working on a part of a large script
+		'''
+	
+	def demand(self) -> set[str]|None:
+		''' module variables displayed or selected in the scenes, or None if they all may be '''
+		demand = set()
+		for scene in self.scenes:
+			names = scene.demand()
+			if names is None:
+				return None
+			demand |= names
+		return demand
+	
+	def _refine(self):
+		''' execute at full quality the script last previewed, unless it changed since '''
+		self._refine_timer.stop()
 		code = self.document.toPlainText()
-		self.reindex.clear()
+		if code == self._previewed:
+			self._previewed = None
+			self.run(code, live=True, preview=False)
+	
+	def scrub(self, position:int, value):
+		''' change the value of the numeric literal at the given position in the last executed code, 
+			and execute again the statements depending on it
+		'''
+		interpreter = self.interpreter
+		def scrubbing():
+			if not interpreter.scrub(position, value, lambda *args: None):
+				return
+			exception = interpreter.exception
+			# superseded by a next value
+			if isinstance(exception, InterpreterInterrupt):
+				return
+			@qtschedule
+			def update():
+				if exception:
+					self.window.panel.set_exception(exception)
+				if interpreter is self.interpreter:
+					self.active.sceneview.scene.sync()
+					self.active.sceneview.update()
+				if not exception and interpreter.resolution is not None:
+					self._previewed = self.document.toPlainText()
+					self._refine_timer.start()
+		self.executions.submit(scrubbing, interpreter.interrupt, interpreter.rearm)
+	
+	def run(self, code:str, live=False, preview=None):
+		''' run the given code in the execution thread, reporting the progress and results to the GUI 
+		
+			a live execution does not display its results before it completes, and its interruption is not reported
+			a preview execution uses a coarse curve resolution, and is followed by a full quality execution once the user is idle. By default it follows the `preview` action
+		'''
+		interpreter = self.interpreter
+		if preview is None:
+			preview = self.preview.isChecked()
+		resolution = settings.execution['preview_resolution'] if preview else None
+		demand = self.demand() if self.demand_execution.isChecked() else None
+		self._refine_timer.stop()
+		self._previewed = None
+		# a live execution only replaces the executed source, along with its index, when it completes
+		if live:
+			reindex = self._live_reindex = SubstitutionIndex()
+		else:
+			reindex = self._live_reindex = None
+			self.reindex.clear()
+		def finish(completed:bool):
+			if self._live_running is execution:
+				self._live_running = False
+			if self._live_reindex is reindex:
+				if completed:
+					self.reindex = reindex
+				self._live_reindex = None
 		
 		progress = {}
+		# display results as soon as top-level statements complete, at most once per frame
+		refresh = 1 / (QApplication.primaryScreen().refreshRate() or 60)
+		displayed = [perf_counter(), False]  # last display date, display pending
 		def step(scope, step, steps):
 			progress[scope] = step/steps
+			if (settings.execution['progressive_display'] and not live and scope == interpreter.filename 
+			and not displayed[1] and perf_counter() - displayed[0] > refresh):
+				interpreter.report_progress()
+				displayed[1] = True
+				qtschedule(update_display)
+		def update_display():
+			if interpreter is self.interpreter and self.active.scope == interpreter.filename:
+				self.active.sceneview.scene.sync()
+				self.active.sceneview.update()
+			displayed[:] = [perf_counter(), False]
 		
 		update_progress = QTimer()
 		update_progress.setInterval(200)
@@ -134,26 +383,46 @@ class Madcad(QObject):
 			self.window.panel.set_progress(progress)
 		update_progress.timeout.connect(update_step)
 		
-		step(self.interpreter.filename, 0, 1)
+		step(interpreter.filename, 0, 1)
 		update_step()
 		
-		@self.thread.schedule
 		def execution():
 			qtschedule(update_progress.start)
-			self.interpreter.execute(code, step)
-			if self.interpreter.exception:
+			interpreter.resolution = resolution
+			interpreter.execute(code, step, demand, staged=live)
+			# a newer execution pending will execute the deferred statements anyway
+			if interpreter.deferred and not interpreter.exception and not self.executions.pending:
+				# display the demanded variables before executing the others
+				interpreter.report_progress()
+				displayed[1] = True
+				qtschedule(update_display)
+				interpreter.resume(step)
+			exception = interpreter.exception
+			# an execution superseded by a newer one does not report
+			if isinstance(exception, InterpreterInterrupt) and (live or self.executions.pending):
+				qtschedule(update_progress.stop)
+				qtschedule(lambda: finish(False))
+				return
+			qtschedule(lambda: finish(True))
+			if exception:
 				@qtschedule
 				def update():
-					self.window.panel.set_exception(self.interpreter.exception)
+					self.window.panel.set_exception(exception)
 			else:
 				@qtschedule
 				def update():
 					self.window.panel.set_success()
 					QTimer.singleShot(1000, lambda: self.window.open_panel.setChecked(False))
+					if preview and interpreter is self.interpreter:
+						self._previewed = code
+						self._refine_timer.start()
 			
 			self.active.sceneview.scene.sync()
 			self.active.sceneview.update()
 			qtschedule(update_progress.stop)
+		
+		self._live_running = execution if live else False
+		self.executions.submit(execution, interpreter.interrupt, interpreter.rearm)
 	
 	@action(icon='view-refresh', shortcut='Ctrl+Shift+Backspace')
 	def clear(self):
@@ -161,22 +430,33 @@ class Madcad(QObject):
 			next execution will reexecute the whole script from the beginning
 		'''
 		self.stop.trigger()
-		self.interpreter = Interpreter(self.interpreter.filename)
+		former = self.interpreter
+		self.interpreter = Interpreter(former.filename, 
+			keep_frames = settings.execution['keep_frames'],
+			iterations = settings.execution['iteration_cache'],
+			tiers = former.tiers,
+			shared = former.shared,
+			)
 		self.reindex = SubstitutionIndex()
+		# the storage tiers are shared with other documents, so the previous caches must release their entries
+		def release():
+			former.release()
+			former.clear_cache()
+		self.executions.submit(release)
 		
 	@action(icon='media-playback-stop', shortcut='Ctrl+Backspace')
 	def stop(self):
 		''' cancel the script execution '''
-		self.interpreter.interrupt()
+		self.executions.cancel()
 	
 	@action(icon='document-new', shortcut='Ctrl+N')
 	def new(self):
-		''' open a new madcad instance with a blank script '''
-		self.open_uimadcad()
+		''' open a new document with a blank script '''
+		Madcad()
 	
 	@action(icon='document-open', shortcut='Ctrl+O')
 	def open(self):
-		''' close this file and open an other script file '''
+		''' open a script file in a new document '''
 		filename, _ = QFileDialog.getOpenFileName(
 			self.window, 
 			caption = 'open madcad file', 
@@ -185,7 +465,7 @@ class Madcad(QObject):
 			)
 		if not filename:
 			return
-		self.open_uimadcad(filename)
+		Madcad(filename)
 	
 	@action(icon='document-save', shortcut='Ctrl+S')
 	def save(self):
@@ -222,3 +502,29 @@ class Madcad(QObject):
 		self.active.file = filename
 		self.window.setWindowFilePath(self.active.file)
 		self.save.trigger()
+		self._rewatch()
+
+
+@singleton
+def cache_tiers() -> Tiers:
+	''' storage tiers of the interpreters caches, as configured in the settings 
+	
+		the tiers are common to all documents, so their memory budget is for the whole process
+	'''
+	return Tiers(
+		hot = settings.execution['cache_memory'] << 20,
+		warm = settings.execution['cache_compressed'] << 20,
+		compression = settings.execution['cache_compression'],
+		)
+
+@singleton
+def shared_store() -> SharedStore:
+	''' store sharing the cached values with the other documents, and with the other processes as configured in the settings '''
+	try:
+		return SharedStore(
+			size = settings.execution['shared_cache_size'] << 20, 
+			persistent = settings.execution['shared_cache'],
+			)
+	except OSError as err:
+		print('unable to use the shared cache:', err, file=sys.stderr)
+		return SharedStore(persistent=False)
@@ -7,40 +7,54 @@ from dataclasses import dataclass
 from itertools import chain
 from functools import partial
 from copy import deepcopy
+from time import perf_counter
+import pickle
 
-from pnprint import nprint
 
-
-def parcimonize(cache: dict, scope: str, args: list[str], globals: set[str], code: Iterable[AST], previous: dict, filter:callable=None) -> Iterable[AST]:
-	''' make a code lazily executable by reusing as much previous results as possible '''
+def parcimonize(cache: dict, scope: str, args: list[str], globals: set[str], code: Iterable[AST], previous: dict, filter:callable=None, statements:dict=None, split:bool=False, invalidated:list=None, iterations:bool=False, varying:set[str]=None, analysis:Analysis=None, shared:bool=False, origins:dict=None) -> Iterable[AST]:
+	''' make a code lazily executable by reusing as much previous results as possible 
+	
+		Args:
+			args:        variables identifying the scope instance, or None if the code is part of an enclosing scope that already initializes its cache
+			previous:    the structural hashes of the statements of the previous execution in each scope, updated by this function
+			statements:  if given, the cached statements of each scope are recorded in it, as lists of tuples `(key, node, dependencies, results)`
+			split:       if True, the nested calls in assigned, returned and evaluated expressions are cached separately, so only the calls whose inputs changed are executed again
+			invalidated: if given, the `Invalidation` of each statement that cannot reuse its previous results is appended to it
+			iterations:  if True, the iterations of `for` loops are cached separately, so only the iterations whose inputs changed are executed again
+			varying:     variables whose value is not identified by the scope arguments, the statements depending on them are executed without cache
+			analysis:    facts about the code nodes, reused if given
+			shared:      if True, the cached assignments and returns pass their content address to the cache, so their results can be shared with other processes (see `storage.SharedStore`)
+			origins:     if given, the statement of the given code each yielded node comes from is recorded in it, or None for the nodes initializing the scope
+	'''
+	if analysis is None:
+		analysis = Analysis()
 	assigned = Counter()
 	changed = set()
-	memo = dict()
-	locals = set(results(code))
+	locals = set(analysis.writes(code))
+	varying = set(varying or ())
 	
-	homogenize(code, set(args) | globals)
+	if args is not None:
+		homogenize(code, set(args) | globals, analysis)
 	
-	# new ast body
-	yield from _scope_init(scope, args)
-	for node in code:
-		# find inputs and outputs of this statement
-		deps = list(set(dependencies(node)))
-		provided = sorted(set(results(node)), reverse=True)
-		
-		if not provided: 
-			yield node
-			continue
-		
-		# update the number of assignments to provided variables
-		assigned.update(provided)
-		# cache key for this statement
-		key = '{}{}'.format(provided[0], assigned[provided[0]])
+	scopes = previous
+	previous = scopes.setdefault(scope, {})
+	if statements is not None:
+		statements[scope] = []
+	
+	def statement(node, key, deps, provided):
+		if statements is not None:
+			statements[scope].append((key, node, deps, provided))
 		# check if the node code or dependencies has changed
-		if scope not in previous:
-			previous[scope] = {}
-		previous = previous[scope]
-		
-		if not equal(previous.get(key), node) or any(dep in changed  for dep in deps):
+		prev = previous.get(key)
+		current = analysis.hash(node)
+		modified = prev != current
+		if modified or any(dep in changed  for dep in deps):
+			if invalidated is not None:
+				invalidated.append(Invalidation(scope, key, node, 
+					'new statement' if prev is None else 
+					'code changed' if modified else
+					'depends on changed ' + ', '.join(sorted(dep  for dep in deps  if dep in changed))
+					))
 			# count all depending variables as changed
 			changed.update(provided)
 			# void cache of changed statements
@@ -51,36 +65,162 @@ def parcimonize(cache: dict, scope: str, args: list[str], globals: set[str], cod
 				if not cache[scope]:
 					cache.pop(scope)
 					
-		previous[key] = deepcopy(node, memo)
+		previous[key] = current
 		
 		# functions are caching in separate scopes
 		if isinstance(node, FunctionDef):
 			# TODO do not parcimonize functions that are passed as arguments (callbacks are likely to be called very often)
-			yield _parcimonize_func(cache, scope, globals | locals, node, key, previous, filter)
+			yield _parcimonize_func(cache, scope, globals | locals, node, scopes, filter, statements, split, invalidated, iterations, analysis, shared)
+		
+		# the results of a statement depending on varying variables are varying as well
+		elif varying.intersection(deps):
+			varying.update(provided)
+			yield node
 		
 		elif not filter or filter(node):
 			# an expression assigned is assumed to not modify its arguments
+			# when assigned to subscripts or attributes, the store is replayed on the objects when the value comes from the cache
 			if isinstance(node, Assign):
-				yield from _parcimonize_assign(key, node)
+				yield from _parcimonize_assign(key, node, _content_address(node.value, analysis) if shared else None)
 			
 			# an expression without result is assumed to be an inplace modification
 			# a block cannot be splitted because its bodies may be executed multiple times or not at all
 			elif isinstance(node, (Expr, For, While, Try, With, If, Match)):
 				provided = [name for name in set(provided or deps) 
 						if name not in globals]
-				yield from _parcimonize_block(key, provided, node)
+				if iterations and isinstance(node, For) and _iterations_cachable(node):
+					yield from _parcimonize_block(key, provided, 
+						_parcimonize_for(cache, scope, key, globals, node, scopes, filter, statements, split, invalidated, analysis, shared))
+				else:
+					yield from _parcimonize_block(key, provided, node)
 				
 			# an expression returned is assumed to not modify its arguments
 			elif isinstance(node, Return):
-				yield from _parcimonize_return(key, node)
+				yield from _parcimonize_return(key, node, _content_address(node.value, analysis) if shared and node.value else None)
 				
 			else:
 				yield node
-				
-			# TODO: decide what to do when the target is a subscript
 		else:
 			yield node
 	
+	def transform(node):
+		# find inputs and outputs of this statement
+		if isinstance(node, Assign) and all(isinstance(target, (Subscript, Attribute))  for target in node.targets):
+			deps = _store_dependencies(node, analysis)
+		else:
+			deps = list(analysis.reads(node))
+		provided = sorted(analysis.writes(node), reverse=True)
+		
+		if not provided: 
+			yield node
+			return
+		
+		# update the number of assignments to provided variables
+		assigned.update(provided)
+		# cache key for this statement
+		key = '{}{}'.format(provided[0], assigned[provided[0]])
+		
+		# nested calls are cached as separate statements before their parent statement
+		if split and isinstance(node, (Assign, Return, Expr)) and node.value and (not filter or filter(node)):
+			subcalls = _split_calls(node.value, '_madcad_'+key)
+			for i, sub in enumerate(subcalls, 1):
+				yield from statement(sub, '{}.{}'.format(key, i), list(analysis.reads(sub)), list(analysis.writes(sub)))
+			if subcalls:
+				deps = list(set(deps) | {sub.targets[0].id  for sub in subcalls})
+		
+		yield from statement(node, key, deps, provided)
+	
+	# new ast body
+	if args is not None:
+		for init in _scope_init(scope, args):
+			if origins is not None:
+				origins[init] = None
+			yield init
+	for node in code:
+		for transformed in transform(node):
+			if origins is not None:
+				origins[transformed] = node
+			yield transformed
+
+def closure(code: list[AST], names: Iterable[str], analysis: Analysis) -> set[AST]:
+	''' statements of the given code needed to compute the given variables, including the statements they depend on
+	
+		Imports are always needed since they may define names unknown to the analysis (like star imports). A statement without result is assumed to modify its dependencies inplace, so it is needed along with the variables it reads. A definition needs the variables its body reads from the enclosing scope.
+	'''
+	needed = set(names)
+	statements = set()
+	# functions read the variables of their enclosing scope when called, so they may need statements following their definition
+	while True:
+		count = len(statements)
+		for node in reversed(code):
+			if node in statements:
+				continue
+			writes = analysis.writes(node)
+			reads = analysis.reads(node)
+			if (isinstance(node, (Import, ImportFrom)) 
+			or needed.intersection(writes) 
+			or not writes and needed.intersection(reads)):
+				statements.add(node)
+				needed.update(reads)
+				if isinstance(node, (FunctionDef, AsyncFunctionDef, ClassDef)):
+					needed.update(_free_variables(node, analysis))
+		if len(statements) == count:
+			return statements
+
+def _free_variables(node: FunctionDef|ClassDef, analysis: Analysis) -> set[str]:
+	''' names a definition reads from its enclosing scope, when defined or called '''
+	# the variables modified inplace are not local, only the assigned ones
+	names = set(analysis.reads(node.body)) - {
+		child.id  for child in walk(Module(node.body, type_ignores=[]))
+		if isinstance(child, Name) and isinstance(child.ctx, Store)}
+	evaluated = list(node.decorator_list)
+	if isinstance(node, ClassDef):
+		evaluated.extend(node.bases)
+	else:
+		args = node.args
+		names -= {arg.arg  for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]  if arg}
+		evaluated.extend(args.defaults)
+		evaluated.extend(default  for default in args.kw_defaults  if default)
+	for expression in evaluated:
+		names.update(analysis.reads(expression))
+	return names
+
+def _store_dependencies(node: Assign, analysis: Analysis) -> list[str]:
+	''' dependencies of an assignment to subscripts or attributes
+	
+		the objects stored into are not dependencies of the assigned value: when they change, the cached value can still be stored into them again
+	'''
+	deps = set(analysis.reads(node.value))
+	for target in node.targets:
+		while isinstance(target, (Subscript, Attribute)):
+			if isinstance(target, Subscript):
+				deps.update(analysis.reads(target.slice))
+			target = target.value
+		if not isinstance(target, Name):
+			deps.update(analysis.reads(target))
+	return list(deps)
+
+def _split_calls(node: expr, name: str) -> list[Assign]:
+	''' extract the nested calls of the given expression to assignments of temporary variables, in evaluation order
+	
+		the expression is modified inplace to use the temporary variables. Only the calls that are always evaluated are extracted, so short-circuits, conditional expressions, comprehensions and lambdas are left untouched.
+	'''
+	evaluated = (Call, BinOp, UnaryOp, Tuple, List, Set, Dict, Attribute, Subscript, Slice, Starred, keyword)
+	extracted = []
+	def capture(node):
+		if not isinstance(node, evaluated):
+			return
+		propagate(node, capture)
+		if isinstance(node, Call):
+			extracted.append(Assign([Name('{}_{}'.format(name, len(extracted)+1), Store())], node))
+			return Name(extracted[-1].targets[0].id, Load())
+	
+	if not isinstance(node, evaluated) or any(isinstance(child, NamedExpr)  for child in walk(node)):
+		return extracted
+	# the expression itself remains in its statement
+	propagate(node, capture)
+	return extracted
+	
 def _scope_init(scope: str, args: list[str]) -> Iterator[AST]:
 	# get the cache dictionnary for this scope
 	return [Assign(
@@ -100,17 +240,24 @@ def _parcimonize_func(
 	scope: str, 
 	globals: set[str],
 	node: FunctionDef, 
-	key: str, 
 	previous: dict,
 	filter: callable,
+	statements: dict,
+	split: bool,
+	invalidated: list,
+	iterations: bool,
+	analysis: Analysis,
+	shared: bool,
 	) -> AST:
 	# functions are caching in separate scopes
 	subscope = scope + '.' + node.name
 	# clear function caches if the function signature changed
-	prev = previous.get(key)
-	if not prev or node.name != prev.name or not equal(node.args, prev.args):
+	# the signature is kept along the statements of the function, with a key that no statement can have
+	signature = analysis.hash(node.args)
+	if previous.setdefault(subscope, {}).get('()') != signature:
 		# print('discarding cache (signature changed) for', subscope)
-		cache.pop(subscope, None)
+		drop_caches(cache, subscope)
+	previous[subscope]['()'] = signature
 	
 	args = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
 	if node.args.vararg:	args.append(node.args.vararg)
@@ -129,39 +276,189 @@ def _parcimonize_func(
 			code = node.body,
 			previous = previous,
 			filter = filter,
+			statements = statements,
+			split = split,
+			invalidated = invalidated,
+			iterations = iterations,
+			analysis = analysis,
+			shared = shared,
 			)),
 		decorator_list = node.decorator_list,
 		)
 
-def _parcimonize_return(key, node:AST) -> Iterator[AST]:
+# maximum number of iterations cached for each loop
+max_iterations = 1000
+
+def iteration_scope(scope: str, key: str) -> str:
+	''' name of the scope caching the iterations of the loop with the given key '''
+	return '{}.{}[]'.format(scope, key)
+
+def _iterations_cachable(node: For) -> bool:
+	''' check that the iterations of a loop can be cached separately
+	
+		the loop variables must identify the iteration, and the body must not leave its iteration early
+	'''
+	return (all(isinstance(child, (Name, Tuple, List, Starred, expr_context))  for child in walk(node.target))
+		and not _jumps(node.body))
+
+def _jumps(node: AST|list[AST], loop=True) -> bool:
+	''' check if the given code can leave the iteration of its enclosing loop (`loop=True`) or its scope '''
+	if isinstance(node, list):
+		return any(_jumps(child, loop)  for child in node)
+	elif isinstance(node, (FunctionDef, AsyncFunctionDef, Lambda, ClassDef)):
+		return False
+	elif isinstance(node, (Return, Yield, YieldFrom, Await)) or loop and isinstance(node, (Break, Continue)):
+		return True
+	# jumps in nested loops only leave the nested loop
+	elif isinstance(node, (For, AsyncFor, While)):
+		return _jumps(node.body, False) or _jumps(node.orelse, loop)
+	else:
+		return any(_jumps(child, loop)  for child in iter_child_nodes(node))
+
+def _nested_reads(node: AST) -> set[str]:
+	''' names only read inside the lambdas, definitions and comprehensions of the given node, where they are bound (like arguments) 
+	
+		these are not variables of the scope of the node
+	'''
+	inner, outer = set(), set()
+	def visit(node, bound):
+		if isinstance(node, (Lambda, FunctionDef, AsyncFunctionDef)):
+			args = node.args
+			# defaults and decorators are evaluated in the enclosing scope
+			for child in chain(args.defaults, filter(None, args.kw_defaults), getattr(node, 'decorator_list', ())):
+				visit(child, bound)
+			bound = bound | {arg.arg  for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]  if arg}
+			body = node.body if isinstance(node.body, list) else [node.body]
+			if not isinstance(node, Lambda):
+				bound = bound | {child.id  for child in walk(Module(body, type_ignores=[]))
+					if isinstance(child, Name) and isinstance(child.ctx, Store)}
+			for child in body:
+				visit(child, bound)
+			return
+		elif isinstance(node, (ListComp, SetComp, GeneratorExp, DictComp)):
+			bound = bound | {child.id  for generator in node.generators  for child in walk(generator.target)
+				if isinstance(child, Name)}
+		elif isinstance(node, Name) and isinstance(node.ctx, Load):
+			(inner if node.id in bound else outer).add(node.id)
+		for child in iter_child_nodes(node):
+			visit(child, bound)
+	visit(node, frozenset())
+	return inner - outer
+
+def _parcimonize_for(
+	cache: dict, 
+	scope: str, 
+	key: str,
+	globals: set[str],
+	node: For, 
+	previous: dict,
+	filter: callable,
+	statements: dict,
+	split: bool,
+	invalidated: list,
+	analysis: Analysis,
+	shared: bool,
+	) -> list[AST]:
+	''' cache each iteration of a loop in a separate scope version, identified by the loop variables and the loop invariant inputs
+	
+		the variables carried from an iteration to the next (read before being assigned in the body, and modified by the body) cannot identify an iteration, so the statements depending on them are executed without cache
+	'''
+	subscope = iteration_scope(scope, key)
+	# variables saving the enclosing cache, unique in nested loops
+	depth = subscope.count('[]')
+	saved = '_madcad_cache{}'.format(depth)
+	invariant = '_madcad_invariant{}'.format(depth)
+	
+	targets = sorted(analysis.writes(node.target))
+	# variables read before being assigned in the body
+	exposed = set()
+	assigned = set(targets)
+	for child in node.body:
+		exposed.update(analysis.reads(child) - assigned - _nested_reads(child))
+		assigned.update(analysis.writes(child))
+	modified = analysis.writes(node.body)
+	
+	return [
+		Assign([Name(saved, Store())], Name('_madcad_cache', Load())),
+		# inputs not changing during the loop are fingerprinted once
+		Assign([Name(invariant, Store())], Call(
+			Name('_madcad_fingerprint', Load()),
+			args = [Tuple([Name(name, Load())  for name in sorted(exposed - modified)], Load())],
+			keywords = [],
+			)),
+		For(
+			target = node.target,
+			iter = node.iter,
+			body = [
+				# get the cache of this iteration
+				Assign([Name('_madcad_cache', Store())], Call(
+					Name('_madcad_global_cache', Load()),
+					args = [
+						Constant(subscope),
+						Tuple([
+							Name(invariant, Load()),
+							Call(
+								Name('_madcad_fingerprint', Load()),
+								args = [Tuple([Name(name, Load())  for name in targets], Load())],
+								keywords = [],
+								),
+							], Load()),
+						Constant(max_iterations),
+						],
+					keywords = [],
+					)),
+				*parcimonize(
+					cache,
+					scope = subscope,
+					args = None,
+					globals = globals,
+					code = node.body,
+					previous = previous,
+					filter = filter,
+					statements = statements,
+					split = split,
+					invalidated = invalidated,
+					iterations = True,
+					varying = exposed & modified,
+					analysis = analysis,
+					shared = shared,
+					),
+				],
+			orelse = node.orelse,
+			type_comment = None,
+			),
+		Assign([Name('_madcad_cache', Store())], Name(saved, Load())),
+		]
+
+def _parcimonize_return(key, node:AST, address:AST=None) -> Iterator[AST]:
 	# an expression returned is assumed to not modify its arguments
-	r = _parcimonize_assign(key, Assign([Name('_return', Store())], node.value))
+	r = _parcimonize_assign(key, Assign([Name('_return', Store())], node.value), address)
 	r.append(Return(Name('_return', Load())))
 	return r
 
-def _parcimonize_assign(key, node:AST) -> Iterator[AST]:
+def _parcimonize_assign(key, node:AST, address:AST=None) -> Iterator[AST]:
 	# an expression assigned is assumed to not modify its arguments
-	return _cache_use(key, node.targets, [
+	return _cache_use(key, node.targets, address, [
 		Assign(targets = [Name('_madcad_tmp', Store())], value = node.value), 
 		_cache_set(key, value = Name('_madcad_tmp', Load())),
 		Assign(targets = node.targets, value = Name('_madcad_tmp', Load())),
 		])
 		
-def _parcimonize_block(key, res:list[str], node:AST) -> Iterator[AST]:
+def _parcimonize_block(key, res:list[str], node:AST|list[AST]) -> Iterator[AST]:
 	# an expression without result is assumed to be an inplace modification
 	# a block cannot be splitted because its bodies may be executed multiple times or not at all
 	outs = [Name(dep, Store())  for dep in res]
 	ins = [Name(dep, Load())  for dep in res]
-	return _cache_use(key, [Tuple(outs, Store())], [
+	return _cache_use(key, [Tuple(outs, Store())], None, [
 		# run original code
-		node,
+		*([node] if isinstance(node, AST) else node),
 		# cache results
 		_cache_set(key, value = Tuple(ins, Load())),
 		])
 
-def _cache_use(key: hash, targets: list, generate: list) -> list:
+def _cache_use(key: hash, targets: list, address: AST, generate: list) -> list:
 	return [
-		Assign([Name('_madcad_tmp', Store())], _cache_get(key)),
+		Assign([Name('_madcad_tmp', Store())], _cache_get(key, address)),
 		If(
 			# if cache is None
 			test = Compare(
@@ -183,13 +480,34 @@ def _cache_use(key: hash, targets: list, generate: list) -> list:
 			),
 		]
 
-def _cache_get(key) -> Expr:
+def _cache_get(key, address:AST=None) -> Expr:
 	''' expression for accessing the cache value for this variable name in this function's scope '''
 	return Call(
 		Attribute(Name('_madcad_cache', Load()), 'get', Load()), 
-		args = [Constant(key)],
+		args = [Constant(key)] + ([address] if address else []),
 		keywords = [],
 		)
+
+def _content_address(node: expr, analysis: Analysis) -> AST:
+	''' expression for the content identifying the result of the given expression: its code and the values of the variables it reads
+	
+		the code is identified by a digest of its structure where the variables are numbered in order of appearance, so it does not depend on the process, on the source position, nor on the variable names
+	'''
+	reads = analysis.reads(node)
+	order = {}
+	for child in walk(node):
+		if isinstance(child, Name) and child.id in reads:
+			order.setdefault(child.id, len(order))
+	renamed = deepcopy(node)
+	for child in walk(renamed):
+		if isinstance(child, Name) and child.id in order:
+			child.id = str(order[child.id])
+	import hashlib
+	code = hashlib.blake2b(dump(renamed).encode(), digest_size=16).hexdigest()
+	return Tuple([
+		Constant(code), 
+		Tuple([Name(name, Load())  for name in order], Load()),
+		], Load())
 	
 def _cache_set(key, value) -> Expr:
 	''' statment for setting the given value to the given cache key '''
@@ -199,58 +517,122 @@ def _cache_set(key, value) -> Expr:
 		keywords = [],
 		))
 
-def global_cache(cache: dict, scope: str, args: tuple):
-	''' function retreiving/creating the caches for a function according to its arguments '''
-	# maximum number of versions kept for this function
-	# when inserting a new version, previous caches will be randomly poped to not get over this limit
-	max_versions = 20
+def global_cache(cache: dict, scope: str, args: tuple, max_versions: int=20, tiers=None, shared=None):
+	''' function retreiving/creating the caches for a function according to its arguments 
 	
+		`max_versions` is the maximum number of versions kept for this function, when inserting a new version, previous caches will be randomly poped to not get over this limit
+		`tiers` and `shared` are the `storage.Tiers` and `storage.SharedStore` of the created caches, if any
+	'''
 	if scope not in cache:
 		cache[scope] = {}
 	versions = cache[scope]
 	args = ArgumentsKey(args)
 	if args not in versions:
 		if len(versions) > max_versions:
-			versions.popitem()
-		versions[args] = ScopeCache()
+			versions.popitem()[1].clear()
+		versions[args] = ScopeCache(tiers, shared)
 	return versions[args]
+
+def drop_caches(cache: dict, scope: str):
+	''' remove all the caches of a scope, releasing their stored values '''
+	for backups in cache.pop(scope, {}).values():
+		backups.clear()
 	
 class ScopeCache:
 	''' dictionnary of caches for a scope 
 	
 		this class simply provide convenient methods including deepcopy when necessary
+		when `tiers` is given, the cached values may be compressed or spilled to disk while not used, see `storage.Tiers`
+		when `shared` is given, the values missing are looked up by content address in a store shared with other processes, see `storage.SharedStore`
 	'''
-	def __init__(self):
+	def __init__(self, tiers=None, shared=None):
 		self.scope = {}
+		self.tiers = tiers
+		self.shared = shared
+		self.pending = {} # content digest and start time of the values missing, until they are set
+		self.hits = 0     # number of values retreived from the cache
+		self.misses = 0   # number of values requested but not in the cache
 	
 	# list of types that do not need to be deepcopied (immutable or uncopiable)
 	whitelist = {types.ModuleType, types.FunctionType, type, str, int, float}
 	
-	def get(self, key):
-		''' retreive a cached value '''
+	def get(self, key, address=None):
+		''' retreive a cached value 
+		
+			`address` is the content identifying the value, to retreive it from the shared store when not in this cache
+		'''
 		cached = self.scope.get(key)
-		if not type(cached) in self.whitelist:
-			try:
-				cached = deepcopy(cached)
-			except TypeError:
-				pass
-		return cached
+		# None is not distinguished from a missing value by the parcimonized code
+		if cached is None:
+			self.misses += 1
+			if address is not None and self.shared is not None:
+				return self._get_shared(key, address)
+			return None
+		self.hits += 1
+		if self.tiers is not None:
+			cached = self.tiers.retreive(self, key, cached)
+		return self._copy(cached)
 	
 	def set(self, key, value):
 		''' cache a value '''
+		# the script keeps its own object and can still modify it, so only the copy is shared
+		stored = self._copy(value)
+		self._store(key, stored)
+		if self.pending:
+			pending = self.pending.pop(key, None)
+			if pending:
+				digest, start = pending
+				# values quick to compute are not worth sharing
+				if perf_counter() - start >= self.shared.threshold:
+					self.shared.save(digest, stored)
+	
+	def _get_shared(self, key, address):
+		digest = self.shared.digest(address)
+		if digest is None:
+			return None
+		value = self.shared.load(digest)
+		if value is None:
+			self.pending[key] = (digest, perf_counter())
+			return None
+		# the loaded value is memory-mapped, so it is cached as is and the script gets a copy
+		self._store(key, value)
+		return self._copy(value)
+	
+	def _store(self, key, value):
+		self.discard(key)
+		self.scope[key] = value
+		if self.tiers is not None:
+			self.tiers.store(self, key, value)
+	
+	def _copy(self, value):
 		if not type(value) in self.whitelist:
 			try:
 				value = deepcopy(value)	
 			except TypeError:
 				pass
-		self.scope[key] = value
+		return value
 		
 	def discard(self, key):
 		''' discard a cached value, if any '''
-		self.scope.pop(key, None)
+		self.pop(key)
+	
+	def pop(self, key):
+		''' remove a cached value and return it as stored (it might be compressed or spilled), or None '''
+		if self.tiers is None:
+			return self.scope.pop(key, None)
+		with self.tiers.lock:
+			stored = self.scope.pop(key, None)
+			if stored is not None:
+				self.tiers.forget(self, key, stored)
+		return stored
+	
+	def clear(self):
+		''' discard all cached values '''
+		for key in list(self.scope):
+			self.pop(key)
 		
 	def __bool__(self):
-		return bool(self.scopes)
+		return bool(self.scope)
 		
 	def __contains__(self, key):
 		return key in self.scope
@@ -259,6 +641,45 @@ class ScopeCache:
 		# return '{}{{{}}}'.format(self.__class__.__name__, ', '.join(self.scope.keys()))
 		return self.__class__.__name__+repr(self.scope)
 	
+def fingerprint(value, memo:dict=None) -> object:
+	''' hashable value identifying the content of the given value
+	
+		values compared by identity are pickled, so copies of a same object (like values retreived from a cache) have the same fingerprint. Values that cannot be pickled are their own fingerprint
+		containers and functions already visited (like a recursive function in its own closure) are fingerprinted as a back-reference to their first visit, `memo` holds the visit order of the objects already visited
+	'''
+	if isinstance(value, (tuple, list, dict, set, frozenset, types.FunctionType)):
+		if memo is None:
+			memo = {}
+		if id(value) in memo:
+			return BackReference, memo[id(value)][0]
+		# the value is kept referenced so its id cannot be reused by an other object meanwhile
+		memo[id(value)] = (len(memo), value)
+	
+	if isinstance(value, (tuple, list)):
+		return type(value), tuple(fingerprint(item, memo)  for item in value)
+	elif isinstance(value, dict):
+		return dict, tuple((fingerprint(key, memo), fingerprint(item, memo))  for key, item in value.items())
+	elif isinstance(value, (set, frozenset)):
+		return type(value), frozenset(fingerprint(item, memo)  for item in value)
+	# functions are defined again at each execution, but their code and closure remain the same
+	elif isinstance(value, types.FunctionType):
+		try:
+			closure = tuple(cell.cell_contents  for cell in value.__closure__ or ())
+		except ValueError:
+			return value
+		return value.__code__, fingerprint(value.__defaults__, memo), fingerprint(closure, memo)
+	elif isinstance(value, (types.ModuleType, types.BuiltinFunctionType, type)):
+		return value
+	elif type(value).__hash__ in (None, object.__hash__):
+		try:
+			return type(value), pickle.dumps(value)
+		except Exception:
+			return value
+	return value
+
+class BackReference:
+	''' marker of an object already fingerprinted, see `fingerprint` '''
+	
 class ArgumentsKey:
 	__slots__ = 'key', 'args'
 	def __init__(self, args):
@@ -289,7 +710,9 @@ def dependencies(node: AST|list[AST]) -> Iterator[str]:
 		yield node.id
 	elif isinstance(node, FunctionDef):
 		for expr in chain(node.args.defaults, node.args.kw_defaults):
-			yield from dependencies(expr)
+			# keyword only arguments without default have a None default
+			if expr is not None:
+				yield from dependencies(expr)
 	# prevent yielding generator variables as dependencies (they are from local scope)
 	elif isinstance(node, (ListComp, DictComp, SetComp, GeneratorExp)):
 		targets = set()
@@ -306,8 +729,33 @@ def dependencies(node: AST|list[AST]) -> Iterator[str]:
 		for node in node:
 			yield from dependencies(node)
 
+# methods known to not modify the object they are called on, whatever its type
+pure_methods = {
+	# pymadcad meshes
+	'barycenter', 'barycenter_points', 'box', 'check', 'display', 'edge', 'edgedirection', 'edgenear', 'edgenormals', 
+	'edgepoints', 'edges', 'edges_oriented', 'extremities', 'facenear', 'facenormal', 'facenormals', 'facepoints', 
+	'flip', 'frontiers', 'group', 'groupextremities', 'groupislands', 'groupnear', 'groupoutlines', 
+	'isenvelope', 'islands', 'isline', 'isloop', 'issurface', 'isvalid', 'length', 'maxnum', 'normal', 'orient', 
+	'outlines', 'outlines_oriented', 'outlines_unoriented', 'own', 'pointat', 'pointnear', 'precision', 
+	'qualified_groups', 'qualified_indices', 'segmented', 'subdivide', 'surface', 'tangents', 'transform', 'unclose', 
+	'vertexnormals', 'volume', 'arcs',
+	# python containers and strings
+	'copy', 'count', 'index', 'get', 'keys', 'values', 'items', 
+	'format', 'join', 'strip', 'startswith', 'endswith', 'lower', 'upper',
+	}
+# functions known to not modify their arguments
+pure_functions = {
+	'print', 'repr', 'str', 'len', 'abs', 'min', 'max', 'sum', 'round', 'any', 'all', 'sorted', 'reversed',
+	'bool', 'int', 'float', 'list', 'tuple', 'set', 'dict', 'range', 'enumerate', 'zip', 
+	'isinstance', 'issubclass', 'type', 'id', 'hash', 'format', 'getattr', 'hasattr',
+	'show', 'deepcopy', 'copy',
+	}
+
 def results(node: AST|list[AST], inplace=False) -> Iterator[str]:
-	''' yield names of variables assigned by a node '''
+	''' yield names of variables assigned by a node 
+	
+		calls to methods and functions not in `pure_methods` and `pure_functions` are assumed to modify the object they are called on or their first argument
+	'''
 	if isinstance(node, Name) and (isinstance(node.ctx, Store) or inplace):
 		yield node.id
 	elif isinstance(node, (FunctionDef, ClassDef)):
@@ -329,9 +777,10 @@ def results(node: AST|list[AST], inplace=False) -> Iterator[str]:
 	elif isinstance(node, Call):
 		# if attribute is called, it is assumed to be a method modifying its self
 		if isinstance(node.func, Attribute):
-			yield from results(node.func.value, inplace=True)
+			if node.func.attr not in pure_methods:
+				yield from results(node.func.value, inplace=True)
 		# if function is called with inplace presumtion it is assumed to modify its first argument
-		elif inplace:
+		elif inplace and not (isinstance(node.func, Name) and node.func.id in pure_functions):
 			arg = next(iter(node.args), None) or next(iter(node.keywords), None)
 			if arg:
 				yield from results(arg, inplace=True)
@@ -343,19 +792,21 @@ def results(node: AST|list[AST], inplace=False) -> Iterator[str]:
 			yield from results(node, True)
 
 
-def homogenize(node:AST|list[AST], scope:set[str]=None) -> set[str]:
+def homogenize(node:AST|list[AST], scope:set[str]=None, analysis:Analysis=None) -> set[str]:
 	''' make sure that the variables existing in each scope are the same after controlflow switches '''
 	if scope is None:
 		scope = set()
+	if analysis is None:
+		analysis = Analysis()
 		
 	# if True is not altered
 	if isinstance(node, If) and isinstance(node.test, Constant) and node.test.value:
-		homogenize(node.body, scope)
+		homogenize(node.body, scope, analysis)
 	
 	# homogenize other if statements
 	elif isinstance(node, If):
-		out_body = homogenize(node.body, scope.copy())
-		out_else = homogenize(node.orelse, scope.copy())
+		out_body = homogenize(node.body, scope.copy(), analysis)
+		out_else = homogenize(node.orelse, scope.copy(), analysis)
 		out = out_body | out_else
 		_complete_scope(node.body, out_body, out)
 		_complete_scope(node.orelse, out_else, out)
@@ -364,7 +815,7 @@ def homogenize(node:AST|list[AST], scope:set[str]=None) -> set[str]:
 	# homogenize match cases
 	elif isinstance(node, Match):
 		out_cases = [
-			homogenize(case.body, scope.copy())
+			homogenize(case.body, scope.copy(), analysis)
 			for case in node.cases
 			]
 		out = reduce(operator.or_, out_cases)
@@ -381,19 +832,19 @@ def homogenize(node:AST|list[AST], scope:set[str]=None) -> set[str]:
 		args.update(arg.arg  for arg in node.args.kwonlyargs)
 		if node.args.kwarg:
 			args.add(node.args.kwarg.arg)
-		homogenize(node.body, scope.union(args))
+		homogenize(node.body, scope.union(args), analysis)
 		scope.add(node.name)
 	
 	# process nested controlflow
 	elif isinstance(node, (For, While, With)):
-		homogenize(node.body, scope)
+		homogenize(node.body, scope, analysis)
 	# keep track of created variables
 	elif isinstance(node, AST):
-		scope.update(results(node))
+		scope.update(analysis.writes(node))
 	# process nested controlflow
 	else:
 		for child in node:
-			homogenize(child, scope)
+			homogenize(child, scope, analysis)
 	
 	return scope
 
@@ -575,6 +1026,26 @@ def steppize(code:list[AST], scope:str, filter:callable=None) -> Iterator[AST]:
 			explore(node)
 		yield node
 
+def steplines(code:list[AST], lines:dict=None) -> dict[tuple[str, int], int]:
+	''' source line of the statement following each step inserted by `steppize`
+	
+		the code must have its locations fixed, the result is a dictionnary `{(scope, step): line}`
+	'''
+	if lines is None:
+		lines = {}
+	step = None
+	for node in code:
+		if (isinstance(node, Expr) and isinstance(node.value, Call) 
+		and isinstance(node.value.func, Name) and node.value.func.id == '_madcad_step'):
+			step = (node.value.args[0].value, node.value.args[1].value)
+		elif step and getattr(node, 'lineno', 0):
+			lines[step] = node.lineno
+			step = None
+		for field, value in iter_fields(node):
+			if isinstance(value, list) and value and isinstance(value[0], (stmt, excepthandler)):
+				steplines(value, lines)
+	return lines
+
 def report(code:list[AST], scope:str, clear=True) -> list[AST]:
 	''' change the given code to report its variables to madcad '''
 	def filter(node):
@@ -608,30 +1079,13 @@ def report(code:list[AST], scope:str, clear=True) -> list[AST]:
 	return [Try(body=code, handlers=[], orelse=[], finalbody=finalbody)]
 
 def locate(code:Iterable[AST], scope:str, locations=None) -> dict[str, dict[str, AST]]:
-	''' change the given code to report its variables to madcad '''
+	''' find the statements defining the variables of each scope defined in this AST '''
+	definitions = Analysis(code, scope).definitions
 	if locations is None:
-		locations = {}
-	locations[scope] = {}
-	def filter(node):
-		if isinstance(node, (Module, FunctionDef)):
-			locations[scope][node.name] = node
-			locate(node.body, scope+'.'+node.name, locations)
-		elif isinstance(node, Assign):
-			for target in node.targets:
-				if isinstance(target, Name):
-					locations[scope][target.id] = node
-		elif isinstance(node, NamedExpr):
-			if isinstance(target, Name):
-				locations[scope][target.id] = node
-		else:
-			propagate(node, filter)
-	
-	for node in code:
-		filter(node)
-	
+		return definitions
+	locations.update(definitions)
 	return locations
 	
-	
 def usage(code:Iterable[AST], scope:str, usages:dict=None, stops:dict=None) -> dict[str, Usage]:
 	''' analyse the variables usage in all function scopes defined in this AST 
 		
@@ -639,41 +1093,229 @@ def usage(code:Iterable[AST], scope:str, usages:dict=None, stops:dict=None) -> d
 			usages: dictionnary of scopes usages, updated and returned by this function, leaving it empty creates a new dict
 			stops:  dictionnary of stop points in each scope, useful to know the scope's variables usage before an exception
 	'''
-	if usages is None:	usages = {}
-	if stops is None:	stops = {}
-	
-	ro = set()  # only read
-	wo = set() # only written
-	rw = set()  # read and written
+	return Analysis(code, scope).usage(stops, usages)
 
-	def filter(node):
-		if isinstance(node, (Module, FunctionDef)):
-			usage(node.body, scope+'.'+node.name, usages, stops)
-		# if the current node is after the current scope's end, do not count its usages
-		elif getattr(node, 'lineno', 0) > stops.get(scope, inf):
-			pass
-		# count statement usages
-		elif isinstance(node, (Expr, Assign)):
-			for var in dependencies(node):
-				if var in wo or var in rw:
-					rw.add(var)
-				else:
-					ro.add(var)
-				wo.discard(var)
-			for var in results(node):
-				if var in ro or var in rw:
-					rw.add(var)
-				else:
-					wo.add(var)
-				ro.discard(var)
+class Analysis:
+	''' facts about the nodes of a code, computed in one traversal
+	
+		The facts of each node are stored in a side table, so the passes transforming the code can query them rather than walking the node subtrees again. Nodes created after the analysis are analysed on demand, nodes modified inplace keep the facts of their original version.
+		
+		When a scope name is given, the definitions and usages of variables in this scope and its functions are collected during the traversal.
+	'''
+	facts: dict[AST, Facts]
+	definitions: dict[str, dict[str, AST]]
+	''' statements defining the variables of each scope, as returned by `locate` '''
+	statements: dict[str, list[AST]]
+	''' statements of each scope counted by `usage`, in execution order '''
+	variables: dict[str, set[str]]
+	''' names bound in each scope, including function arguments and imports '''
+	fields: dict[AST, list]
+	''' fields of each node when it was analysed, the transformations may since have replaced them '''
+	
+	def __init__(self, code:Iterable[AST]=(), scope:str=None):
+		self.facts = {}
+		self.fields = {}
+		self.definitions = {}
+		self.statements = {}
+		self.variables = {}
+		if scope is not None:
+			self._scope(scope)
+		for node in code:
+			self._visit(node, scope)
+	
+	def reads(self, node:AST|list[AST]) -> frozenset[str]:
+		''' names of variables a node or a list of statements depends on, like `dependencies` '''
+		if isinstance(node, list):
+			return _union([self.reads(child)  for child in node])
+		facts = self.facts.get(node) or self._visit(node)
+		return facts.reads
+		
+	def writes(self, node:AST|list[AST]) -> frozenset[str]:
+		''' names of variables assigned by a node or a list of statements, like `results` '''
+		if isinstance(node, list):
+			return _union([self.writes(child)  for child in node])
+		facts = self.facts.get(node) or self._visit(node)
+		return facts.writes
+	
+	def calls(self, node:AST) -> bool:
+		''' check if a node contains function calls '''
+		facts = self.facts.get(node) or self._visit(node)
+		return facts.calls
+	
+	def hash(self, node:AST) -> int:
+		''' structural hash of a node, equal for nodes performing the same operations whatever their location in the source '''
+		facts = self.facts.get(node) or self._visit(node)
+		return facts.hash
+	
+	def rehash(self, node:AST) -> int:
+		''' compute again the structural hash of an analysed node, after constants it contained were changed inplace '''
+		if isinstance(node, Constant):
+			self.fields[node] = [value  for field, value in iter_fields(node)]
+		for value in self.fields[node]:
+			for child in (value if isinstance(value, list) else (value,)):
+				if isinstance(child, AST):
+					self.rehash(child)
+		facts = self.facts[node]
+		facts.hash = self._structure(node)
+		return facts.hash
+	
+	def usage(self, stops:dict=None, usages:dict=None) -> dict[str, Usage]:
+		''' variables usage in each scope, as returned by `usage` '''
+		if usages is None:	usages = {}
+		if stops is None:	stops = {}
+		for scope, statements in self.statements.items():
+			ro = set()  # only read
+			wo = set()  # only written
+			rw = set()  # read and written
+			stop = stops.get(scope, inf)
+			for node in statements:
+				# if the current node is after the current scope's end, do not count its usages
+				if getattr(node, 'lineno', 0) > stop:
+					continue
+				facts = self.facts[node]
+				for var in facts.reads:
+					if var in wo or var in rw:
+						rw.add(var)
+					else:
+						ro.add(var)
+					wo.discard(var)
+				for var in facts.writes:
+					if var in ro or var in rw:
+						rw.add(var)
+					else:
+						wo.add(var)
+					ro.discard(var)
+			usages[scope] = Usage(ro, wo, rw)
+		return usages
+	
+	def _visit(self, node:AST, scope:str=None) -> Facts:
+		''' compute the facts of a node and all its children '''
+		if scope is not None:
+			definitions = self.definitions[scope]
+			if isinstance(node, FunctionDef):
+				definitions[node.name] = node
+			elif isinstance(node, Assign):
+				for target in node.targets:
+					if isinstance(target, Name):
+						definitions[target.id] = node
+			elif isinstance(node, NamedExpr) and isinstance(node.target, Name):
+				definitions[node.target.id] = node
+			if isinstance(node, (Expr, Assign)):
+				self.statements[scope].append(node)
+			
+			variables = self.variables[scope]
+			if isinstance(node, Name) and not isinstance(node.ctx, Load):
+				variables.add(node.id)
+			elif isinstance(node, (FunctionDef, AsyncFunctionDef, ClassDef)):
+				variables.add(node.name)
+			elif isinstance(node, alias):
+				variables.add((node.asname or node.name).split('.')[0])
+			elif isinstance(node, ExceptHandler) and node.name:
+				variables.add(node.name)
+		
+		# children facts, function bodies are in a new scope
+		children = []
+		fields = self.fields[node] = []
+		for field, value in iter_fields(node):
+			inner = scope
+			if field == 'body' and isinstance(node, FunctionDef) and scope is not None:
+				inner = scope+'.'+node.name
+				self._scope(inner, node.args)
+			fields.append(list(value) if isinstance(value, list) else value)
+			for child in (value if isinstance(value, list) else (value,)):
+				if not isinstance(child, AST):
+					continue
+				# nodes created after the analysis often contain analysed nodes
+				facts = self.facts.get(child) if inner is None else None
+				children.append(facts or self._visit(child, inner))
+		
+		# variables read
+		if isinstance(node, Name):
+			reads = frozenset((node.id,)) if isinstance(node.ctx, Load) else _empty
+		elif isinstance(node, FunctionDef):
+			reads = _union([self.facts[expr].reads  
+				for expr in chain(node.args.defaults, node.args.kw_defaults)  
+				if expr is not None])
+		# generator variables are from the comprehension scope
+		elif isinstance(node, (ListComp, DictComp, SetComp, GeneratorExp)):
+			targets = _union([self.facts[generator.target].writes  for generator in node.generators])
+			reads = _union([facts.reads  for facts in children]) - targets
 		else:
-			propagate(node, filter)
+			reads = _union([facts.reads  for facts in children])
+		
+		# variables written
+		if isinstance(node, Name):
+			writes = frozenset((node.id,)) if isinstance(node.ctx, Store) else _empty
+		elif isinstance(node, (FunctionDef, ClassDef)):
+			writes = frozenset((node.name,))
+		# expressions modified inplace depend on their context, they are rarely large
+		elif isinstance(node, (Import, ImportFrom, Return, Assign, NamedExpr, Call)):
+			writes = frozenset(results(node))
+		elif isinstance(node, (Attribute, Subscript)):
+			writes = self.facts[node.value].writes
+		else:
+			writes = _union([facts.writes  for facts in children])
+		
+		facts = self.facts[node] = Facts(reads, writes, 
+			isinstance(node, Call) or any(facts.calls  for facts in children),
+			self._structure(node))
+		return facts
 	
-	for node in code:
-		filter(node)
+	def _scope(self, scope:str, args:arguments=None):
+		''' start collecting the definitions and usages of a new scope '''
+		self.definitions[scope] = {}
+		self.statements[scope] = []
+		self.variables[scope] = set()
+		if args:
+			self.variables[scope].update(arg.arg  for arg in chain(
+				args.posonlyargs, args.args, args.kwonlyargs, 
+				filter(None, [args.vararg, args.kwarg]),
+				))
 	
-	usages[scope] = Usage(ro, wo, rw)
-	return usages
+	def _structure(self, node:AST) -> int:
+		''' structural hash of a node from the hashes of its children, which must be already analysed '''
+		parts = [type(node)]
+		for value in self.fields[node]:
+			if isinstance(value, list):
+				parts.append(tuple(self.facts[child].hash if isinstance(child, AST) else child  for child in value))
+			elif isinstance(value, AST):
+				parts.append(self.facts[value].hash)
+			else:
+				parts.append(value)
+		# distinguish literals comparing equal, like 1 and 1.0 and True
+		if isinstance(node, Constant):
+			parts.append(type(node.value))
+		return hash(tuple(parts))
+
+_empty = frozenset()
+
+def _union(sets:list[frozenset]) -> frozenset:
+	''' union of the given sets, reusing one of them when the others are empty '''
+	sets = [item  for item in sets  if item]
+	if not sets:
+		return _empty
+	elif len(sets) == 1:
+		return sets[0]
+	return sets[0].union(*sets[1:])
+
+@dataclass(slots=True)
+class Invalidation:
+	''' reason why a statement cannot reuse its previous results '''
+	scope: str
+	key: str
+	''' cache key of the statement in its scope '''
+	node: AST
+	reason: str
+
+@dataclass(slots=True)
+class Facts:
+	''' variables read and written by a node, as given by `dependencies` and `results` '''
+	reads: frozenset[str]
+	writes: frozenset[str]
+	calls: bool
+	''' whether the node contains function calls '''
+	hash: int
+	''' structural hash of the node and its children, ignoring locations '''
 
 @dataclass(slots=True)
 class Usage:
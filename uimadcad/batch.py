@@ -0,0 +1,186 @@
+''' headless execution of a madcad script: run it and export its results without the GUI
+
+	This module never imports Qt nor OpenGL, so it starts fast and runs on servers. (pymadcad itself is only imported when exporting, or by the script)
+
+	usage:
+
+		python -m uimadcad --batch script.py -e part -e screw=screw.stl
+		python -m uimadcad --batch script.py --sweep sizes.csv -e part
+'''
+import sys, os
+import traceback
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from time import perf_counter
+
+from .interpreter import Interpreter
+
+
+class StepTimer:
+	''' step callback for `Interpreter.execute` measuring the time spent in each top-level statement
+
+		the time between two steps of the module scope is attributed to the statement following the first step, so time spent in functions is attributed to the top-level statement calling them
+	'''
+	def __init__(self, scope:str):
+		self.scope = scope
+		self.times = {}  # time spent after each step
+		self.current = 0
+		self.start = self.last = perf_counter()
+
+	def __call__(self, scope, step, steps):
+		if scope == self.scope:
+			self.lap(step)
+
+	def lap(self, step=None):
+		''' end the time measure of the current step and start the measure of the given one '''
+		now = perf_counter()
+		self.times[self.current] = self.times.get(self.current, 0.) + now - self.last
+		self.current = step
+		self.last = now
+
+	@property
+	def total(self) -> float:
+		return self.last - self.start
+
+	def report(self, interpreter:Interpreter, file=sys.stdout):
+		''' print the time spent in each statement, along with its source line '''
+		source = interpreter.source.splitlines()
+		for step, time in self.times.items():
+			if step is None:
+				continue
+			line = interpreter.steps.get((self.scope, step))
+			if line:
+				text = source[line-1].strip()
+				if len(text) > 60:
+					text = text[:57]+'...'
+				print('{:>10.3f}s  line {:<5} {}'.format(time, line, text), file=file)
+			else:
+				print('{:>10.3f}s  {}'.format(time, 'before first statement' if step == 0 else 'step {}'.format(step)), file=file)
+		print('{:>10.3f}s  total'.format(self.total), file=file)
+
+
+def invalidation_line(invalidation) -> int:
+	''' source line of an invalidated statement '''
+	node = invalidation.node
+	return getattr(node, 'lineno', None) or getattr(getattr(node, 'value', None), 'lineno', None)
+
+@contextmanager
+def script_directory(script:str):
+	''' execute a script as if it was run from its directory, so it can import its sibling modules '''
+	sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+	try:
+		yield
+	finally:
+		sys.path.pop(0)
+
+def export(value, filename:str):
+	''' write the given value to a mesh file, the format is deduced from the file extension (stl, ply, obj) '''
+	from madcad.io import write
+	write(value, filename)
+
+def exports_destinations(script:str, exports:list[str], directory:str=None, format:str='stl') -> dict[str, str]:
+	''' destination file of each exported variable
+
+		exports are either variable names, or `name=file` pairs
+	'''
+	directory = directory or os.path.dirname(os.path.abspath(script))
+	stem = os.path.splitext(os.path.basename(script))[0]
+	destinations = {}
+	for item in exports:
+		name, _, file = item.partition('=')
+		if not file:
+			file = '{}-{}.{}'.format(stem, name, format)
+		destinations[name] = os.path.join(directory, file)
+	return destinations
+
+def run(script:str, exports:dict[str, str], timing=True, explain=False, file=sys.stdout) -> int:
+	''' execute the given script and export the given variables, return the process status to exit with
+
+		Args:
+			script:   path to the script to execute
+			exports:  destination file for each variable to export
+			timing:   if True, print the time spent in each top-level statement
+			explain:  if True, print the statements that could not be retreived from the cache
+	'''
+	source = open(script, 'r').read()
+	interpreter = Interpreter(script)
+	timer = StepTimer(interpreter.filename)
+	with script_directory(script):
+		interpreter.execute(source, timer)
+	timer.lap()
+
+	if timing:
+		timer.report(interpreter, file=file)
+	if explain:
+		for invalidation in interpreter.invalidated:
+			print('line {:<5} {}: {}'.format(invalidation_line(invalidation), invalidation.key, invalidation.reason), file=file)
+	if interpreter.exception:
+		exception = interpreter.exception
+		# skip the interpreter frame
+		tb = exception.__traceback__
+		traceback.print_exception(type(exception), exception, tb.tb_next if tb else None)
+		return 1
+
+	status = 0
+	scope = interpreter.scopes.get(interpreter.filename, {})
+	for name, destination in exports.items():
+		if name not in scope:
+			print('error: variable {} is not defined by the script'.format(repr(name)), file=sys.stderr)
+			status = 1
+			continue
+		try:
+			export(scope[name], destination)
+		except Exception as err:
+			print('error: unable to export {} to {}: {}'.format(repr(name), destination, err), file=sys.stderr)
+			status = 1
+		else:
+			print('exported {} to {}'.format(name, destination), file=file)
+	return status
+
+def main(argv:list[str]=None) -> int:
+	''' command line entry point of the batch mode, return the process status '''
+	parser = ArgumentParser(
+		prog = 'python -m uimadcad --batch',
+		description = 'execute a madcad script without GUI and export its results',
+		)
+	parser.add_argument('script', help='madcad script to execute')
+	parser.add_argument('-e', '--export', action='append', default=[], metavar='NAME[=FILE]',
+		help='variable to export, to the given file or to SCRIPT-NAME.FORMAT')
+	parser.add_argument('-o', '--output', metavar='DIRECTORY',
+		help='directory of the exported files, default to the script directory')
+	parser.add_argument('-f', '--format', default='stl', choices=['stl', 'ply', 'obj'],
+		help='file format of exported variables when no file is given')
+	parser.add_argument('-q', '--quiet', action='store_true',
+		help='do not print statements timing')
+	parser.add_argument('--explain', action='store_true',
+		help='print the statements executed again and why')
+	parser.add_argument('-s', '--sweep', metavar='TABLE',
+		help='csv table of parameters overrides, executing one variant of the script per row')
+	parser.add_argument('-j', '--jobs', type=int,
+		help='number of processes executing the sweep variants, default to the number of cpus')
+	args = parser.parse_args(argv)
+
+	for file in filter(None, [args.script, args.sweep]):
+		if not os.path.exists(file):
+			print('error: no such file {}'.format(file), file=sys.stderr)
+			return 1
+	destinations = exports_destinations(args.script, args.export, args.output, args.format)
+	
+	if args.sweep:
+		from .sweep import sweep, load_table, report
+		# each variant exports to its own files
+		for name, destination in destinations.items():
+			root, extension = os.path.splitext(destination)
+			destinations[name] = root + '-{variant}' + extension
+		base, variants = sweep(args.script, load_table(args.sweep), destinations, args.jobs)
+		report(base, variants)
+		if base.error:
+			print('error: {}'.format(base.error), file=sys.stderr)
+		return int(bool(base.error) or any(variant.error  for variant in variants))
+	
+	return run(
+		args.script,
+		destinations,
+		timing = not args.quiet,
+		explain = args.explain,
+		)
@@ -3,16 +3,19 @@ from bisect import bisect
 from types import FunctionType, BuiltinFunctionType
 
 from pnprint import nformat
+from processional import thread
 from madcad.mathutils import mix
 from madcad.qt import (
     Qt, QSizePolicy, QTextCursor, QFont, QPalette, QColor, QSize,
     QApplication, QWidget, QLabel, QTextBrowser, QTimer, QTextEdit,
+    QTreeView, QAbstractItemModel, QModelIndex,
     )
 from . import settings
+from .interpreter import exception_stack, format_stack, summary, Summarized
 from .utils import (
     PlainTextEdit, Splitter, 
     hlayout, vlayout, widget,
-    button, Initializer, 
+    button, Initializer, qtschedule,
     charformat, qcolor_to_vec, vec_to_qcolor,
     )
 
@@ -23,16 +26,18 @@ class ErrorView(QWidget):
 		self.exception = None
 		self.font = QFont(*settings.scriptview['font'])
 		self._index = [] # end text position of each scope in displayed order
+		self._first = 0  # index of the first displayed scope in the exception stack
 		
 		super().__init__(parent)
 		Initializer.process(self)
 		
 		self.traceback = QTextBrowser()
-		self.scope = QTextBrowser()
+		self.scope = QTreeView()
 		self.label = QLabel()
 		
 		self.traceback.setLineWrapMode(QTextEdit.NoWrap)
-		self.scope.setLineWrapMode(QTextEdit.NoWrap)
+		self.scope.setHeaderHidden(True)
+		self.scope.expanded.connect(self._scope_expanded)
 		self.traceback.cursorPositionChanged.connect(self._cursor_moved)
 		self.traceback.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 		self.scope.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
@@ -64,12 +69,13 @@ class ErrorView(QWidget):
 		self.exception = None
 		self.label.setText('no exception')
 		self.traceback.setPlainText('')
-		self.scope.setPlainText('')
+		self.scope.setModel(None)
 		self._index.clear()
 			
 	def set(self, exception):
 		''' set the exception to display '''
 		self._index.clear()
+		self._first = 0
 		self.exception = exception
 		# set labels
 		self.setWindowTitle(type(exception).__name__)
@@ -100,9 +106,9 @@ class ErrorView(QWidget):
 				cursor.insertText(exception.text[offset:], fmt_error)
 				self._index.append(cursor.position())
 		else:
-			tb = traceback.extract_tb(exception.__traceback__)
-			i = next((i for i in range(len(tb)) if tb[i].filename == self.app.interpreter.filename), 0)
-			for line in traceback.format_list(tb)[i:]:
+			tb = exception_stack(exception)
+			i = self._first = next((i for i in range(len(tb)) if tb[i].filename == self.app.interpreter.filename), 0)
+			for line in format_stack(tb)[i:]:
 				if line.startswith('    '):
 					cursor.insertText(line, fmt_code)
 					self._index.append(cursor.position())
@@ -123,6 +129,8 @@ class ErrorView(QWidget):
 	def keep_apart(self):
 		''' show this exception in a separate window to prevent erasing it at the next execution '''
 		if self.app.active.errorview is self:
+			# a separate window may retain the exception for long, so its execution frames are released
+			self.app.interpreter.snapshot(self.exception)
 			new = ErrorView(self.app)
 			new.set(self.exception)
 			new.show()
@@ -138,7 +146,7 @@ class ErrorView(QWidget):
 		
 			move the cursor in the traceback to select a scope
 		'''
-		if visible and self.exception and self.exception.__traceback__:
+		if visible and self.exception and self._current_frame():
 			self._update_scope(self._current_frame())
 		else:
 			self.traceback.setFocus()
@@ -151,61 +159,27 @@ class ErrorView(QWidget):
 			return
 			
 		frame = self._current_frame()
-		if frame.tb_frame.f_code.co_filename == self.app.interpreter.filename == self.app.interpreter.filename and self.app.active.scriptview:
-			self.app.active.scriptview.seek_line(frame.tb_lineno)
+		if not frame:
+			return
+		if frame.filename == self.app.interpreter.filename and self.app.active.scriptview:
+			self.app.active.scriptview.seek_line(frame.lineno)
 		self._update_scope(frame)
 		
-	def _current_frame(self):
-		''' retreive call frame matching the current cursor in the traceback view '''
+	def _current_frame(self) -> traceback.FrameSummary:
+		''' retreive call frame matching the current cursor in the traceback view, or None if there is no frame '''
+		stack = exception_stack(self.exception)
+		if not stack:
+			return None
 		n = bisect(self._index, self.traceback.textCursor().position())
-		step = self.exception.__traceback__
-		for i in range(n+1):
-			if step.tb_next:
-				step = step.tb_next
-		return step
+		return stack[min(self._first + n, len(stack)-1)]
 	
 	def _update_scope(self, frame):
 		''' refresh the content of the scope view '''
-		scope = frame.tb_frame.f_locals
-	
-		self.scope.document().clear()
-		cursor = QTextCursor(self.scope.document())
-		palette = self.palette()
-		familly, size = settings.scriptview['font']
-		
-		fmt_value = charformat(
-						font=QFont(familly, size), 
-						foreground=palette.text())
-		fmt_key = charformat(
-						font=QFont(familly, int(size*1.2), weight=QFont.Bold), 
-						foreground=palette.link())
-		fmt_error = charformat(
-						font=QFont(familly, int(size*1.2), weight=QFont.Bold), 
-						foreground=QColor(255,0,0))
+		self.scope.setModel(ScopeModel(frame.locals, self.app.interpreter.filename, self.palette()))
 		
-		if isinstance(scope, dict):
-			for key, value in scope.items():
-				if key.startswith('_'):
-					continue
-				if isinstance(value, (type, FunctionType, BuiltinFunctionType)) and value.__module__ != self.app.interpreter.filename:
-					continue
-				if isinstance(value, (type, FunctionType)):
-					print('value', value.__module__)
-				# repr may be user code, so take care of possible failures
-				try:
-					formated = nformat(repr(value))
-				except Exception as err:
-					cursor.insertText((key+':').ljust(16), fmt_key)
-					cursor.insertText(object.__repr__(value)+'\n', fmt_error)
-					continue
-				# one line format
-				if not '\n' in formated:	
-					cursor.insertText((key+':').ljust(16), fmt_key)
-					cursor.insertText(formated+'\n', fmt_value)
-				# multiline format
-				else:
-					cursor.insertText(key+':', fmt_key)
-					cursor.insertText(('\n'+formated).replace('\n', '\n    ')+'\n', fmt_value)
+	def _scope_expanded(self, index):
+		''' the formatted value of an expanded variable takes the whole width '''
+		self.scope.setFirstColumnSpanned(0, index, True)
 
 	def keyPressEvent(self, evt):
 		if evt.key() == Qt.Key_Escape:		self.close()
@@ -214,3 +188,134 @@ class ErrorView(QWidget):
 		if self.app.active.errorview is self:
 			self.app.active.errorview = None
 		evt.accept()
+
+
+class ScopeModel(QAbstractItemModel):
+	''' lazy tree model presenting the variables of a scope 
+	
+		- each variable is shown with a short summary of its value, computed only when the row is displayed
+		- the full formatted value is the only child of each variable, it is computed only when the variable is expanded, in a separate thread, truncated and abandoned when too long
+	'''
+	budget = 2.
+	''' maximum time (seconds) allowed to format a value '''
+	truncate = 10_000
+	''' maximum number of characters of a formatted value '''
+	
+	def __init__(self, scope:dict, filename:str, palette:QPalette, parent=None):
+		super().__init__(parent)
+		self.names = []
+		self.values = []
+		self.summaries = {}  # summary text for each row already shown
+		self.formatted = {}  # formatted text for each row already expanded, None when still processing
+		self.failed = set()   # rows for which the formatting failed
+		
+		if isinstance(scope, dict):
+			for key, value in scope.items():
+				if key.startswith('_'):
+					continue
+				if isinstance(value, (type, FunctionType, BuiltinFunctionType)) and value.__module__ != filename:
+					continue
+				self.names.append(key)
+				self.values.append(value)
+		
+		familly, size = settings.scriptview['font']
+		self.font_value = QFont(familly, size)
+		self.font_key = QFont(familly, int(size*1.2), weight=QFont.Bold)
+		self.color_key = palette.link()
+		self.color_value = palette.text()
+		self.color_error = QColor(255,0,0)
+	
+	def index(self, row, column, parent=QModelIndex()):
+		if not self.hasIndex(row, column, parent):
+			return QModelIndex()
+		# variables have internal id 0, their value have the variable row + 1
+		if parent.isValid():
+			return self.createIndex(row, column, parent.row()+1)
+		return self.createIndex(row, column, 0)
+	
+	def parent(self, index):
+		if not index.isValid() or not index.internalId():
+			return QModelIndex()
+		return self.createIndex(index.internalId()-1, 0, 0)
+	
+	def rowCount(self, parent=QModelIndex()):
+		if not parent.isValid():
+			return len(self.names)
+		if not parent.internalId() and parent.column() == 0:
+			return 1
+		return 0
+		
+	def columnCount(self, parent=QModelIndex()):
+		return 2
+	
+	def data(self, index, role=Qt.DisplayRole):
+		if not index.isValid():
+			return None
+		# variable row
+		if not index.internalId():
+			row = index.row()
+			if role == Qt.DisplayRole:
+				if index.column() == 0:
+					return self.names[row]
+				if row not in self.summaries:
+					self.summaries[row] = summary(self.values[row])
+				return self.summaries[row]
+			elif role == Qt.FontRole:
+				return self.font_key if index.column() == 0 else self.font_value
+			elif role == Qt.ForegroundRole:
+				return self.color_key if index.column() == 0 else self.color_value
+		# value row, only queried when expanded
+		else:
+			row = index.internalId()-1
+			if role == Qt.DisplayRole:
+				if index.column():
+					return None
+				if row not in self.formatted:
+					self._format(row)
+				return self.formatted[row] or 'formatting ...'
+			elif role == Qt.FontRole:
+				return self.font_value
+			elif role == Qt.ForegroundRole:
+				return self.color_error if row in self.failed else self.color_value
+		return None
+	
+	def _format(self, row):
+		''' start formatting the value at the given row in a separate thread '''
+		self.formatted[row] = None
+		value = self.values[row]
+		truncate = self.truncate
+		# value dropped by an exception snapshot
+		if isinstance(value, Summarized):
+			self.formatted[row] = value.text
+			return
+		
+		def task():
+			# repr may be user code, so take care of possible failures
+			try:
+				text = repr(value)
+				if len(text) > truncate:
+					text = text[:truncate]+' ...'
+				text = nformat(text)
+			except Exception as err:
+				text = '{}\n{}: {}'.format(object.__repr__(value), type(err).__name__, err)
+				qtschedule(lambda: self._formatted(row, text, True))
+			else:
+				qtschedule(lambda: self._formatted(row, text))
+		worker = thread(task)
+		
+		def timeout():
+			if self.formatted[row] is None:
+				worker.interrupt(TimeoutError)
+				self._formatted(row, '{}\nformatting took more than {}s'.format(object.__repr__(value), self.budget), True)
+		QTimer.singleShot(int(self.budget*1000), timeout)
+	
+	def _formatted(self, row, text, failed=False):
+		''' set the formatted value at the given row '''
+		if self.formatted.get(row) is not None:
+			return
+		self.formatted[row] = text
+		if failed:
+			self.failed.add(row)
+		index = self.index(0, 0, self.index(row, 0))
+		self.dataChanged.emit(index, index)
+
@@ -1,9 +1,14 @@
 import importlib, re
+import os, sys
+import pickle, hashlib
+import tempfile, atexit
+from collections import OrderedDict
 
-from madcad.qt import Qt, QIcon, QIconEngine, QColor, QApplication, QPalette, QPixmap, QPainter
+from madcad.qt import Qt, QIcon, QIconEngine, QColor, QApplication, QPalette, QPixmap, QImage, QPainter, QTimer
 
 from . import settings, resourcedir
 from . import utils
+from . import storage
 
 # import QtSvg, but using the same qt wrapper as pymadcad
 QtSvg = importlib.import_module(Qt.__module__.split('.')[0] + '.QtSvg')
@@ -14,10 +19,19 @@ def icon_from_theme(name):
     return QIcon(QThemeIconEngine(name))
 
 class QThemeIconEngine(QIconEngine):
-    ''' icon renderer following the svg symbolic icon specifications from freedesktop.org '''
+    ''' icon renderer following the svg symbolic icon specifications from freedesktop.org 
+    
+        renderings are kept in memory for the current palette, and in the disk atlas of the palette and size (see `IconAtlas`), so the icons are rendered only once across startups
+    '''
 
     _pattern = re.compile('<style\s(.*?)</style>', re.DOTALL)
-    _cache = {}
+    # svg sources of the icons
+    _sources = {}
+    # most recently painted pixmaps for the current palette
+    _cache = OrderedDict()
+    _cache_size = 512
+    # key and icon colors of the current palette, see `current_palette`
+    _palette = None
     
     def __init__(self, name:str):
         super().__init__()
@@ -30,27 +44,43 @@ class QThemeIconEngine(QIconEngine):
         painter.drawPixmap(rect.topLeft(), self.pixmap(rect.size(), mode, state))
         
     def pixmap(self, size, mode, state):
+        # normal, active and selected modes share the same colors
+        disabled = mode == QIcon.Mode.Disabled
         # cache svg rendering to fasten painting
-        key = (self.name, utils.qsize_to_vec(size), mode)
-        if key not in self._cache:
-            self._cache[key] = self._pixmap(size, mode, state)
-        return self._cache[key]
+        key = (self.name, utils.qsize_to_vec(size), disabled)
+        cache = self._cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        
+        palette, colors = current_palette()
+        variant = '{}:{}'.format(self.name, 'disabled' if disabled else 'normal')
+        mtime = self._mtime()
+        try:
+            atlas = IconAtlas.get(palette, size)
+        # without a writable cache directory, the icons are only kept in memory
+        except OSError:
+            atlas = None
+        image = atlas.image(variant, mtime) if atlas else None
+        if image is None:
+            image = self._image(size, colors[disabled])
+            if atlas:
+                atlas.add(variant, image, mtime)
+        
+        pixmap = cache[key] = QPixmap.fromImage(image)
+        while len(cache) > self._cache_size:
+            cache.popitem(last=False)
+        return pixmap
     
-    def _pixmap(self, size, mode, state):
-        ''' compute pixmap, only called when cache is empty '''
+    def _image(self, size, colors:tuple[str, str]) -> QImage:
+        ''' render the icon with the given highlight and text colors, only called when the caches are empty '''
         # cache svg source to avoid file access
-        if self.name not in self._cache:
-            self._cache[self.name] = self._source()
-        source = self._cache[self.name]
+        if self.name not in self._sources:
+            self._sources[self.name] = self._source()
+        source = self._sources[self.name]
         
         # apply theme color
-        palette = QApplication.palette()
-        if mode == QIcon.Mode.Disabled:
-            highlight = qcolor_to_hex(palette.color(QPalette.ColorRole.Midlight))
-            text = qcolor_to_hex(palette.color(QPalette.ColorRole.Dark))
-        else:
-            highlight = qcolor_to_hex(palette.color(QPalette.ColorRole.Highlight))
-            text = qcolor_to_hex(palette.color(QPalette.ColorRole.Text))
+        highlight, text = colors
         style = '''
             <style id="current-color-scheme" type="text/css">
                 .ColorScheme-Highlight {{ color:{}; }}
@@ -66,18 +96,191 @@ class QThemeIconEngine(QIconEngine):
         # render target
         renderer = QtSvg.QSvgRenderer(source.encode("utf-8"))
         
-        pixmap = QPixmap(size)
-        pixmap.fill(Qt.transparent)
-        painter = QPainter(pixmap)
+        image = QImage(size, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
         renderer.render(painter)
         painter.end()
         
-        return pixmap
+        return image
         
     def _source(self):
         ''' icon svg source code, only called when cache is empty '''
         # load icon file
-        return open(f'{resourcedir}/icons/{self.name}.svg').read()
+        return open(self._path()).read()
+    
+    def _path(self) -> str:
+        return f'{resourcedir}/icons/{self.name}.svg'
+    
+    def _mtime(self) -> float:
+        ''' modification date of the icon file, invalidating its renderings in the atlases '''
+        try:
+            return os.stat(self._path()).st_mtime
+        except OSError:
+            return 0.
+
+
+def palette_colors(palette:QPalette, mode) -> tuple[str, str]:
+    ''' highlight and text colors of the icons in the given mode '''
+    if mode == QIcon.Mode.Disabled:
+        return (
+            qcolor_to_hex(palette.color(QPalette.ColorRole.Midlight)),
+            qcolor_to_hex(palette.color(QPalette.ColorRole.Dark)),
+            )
+    else:
+        return (
+            qcolor_to_hex(palette.color(QPalette.ColorRole.Highlight)),
+            qcolor_to_hex(palette.color(QPalette.ColorRole.Text)),
+            )
+
+def palette_key(palette:QPalette) -> str:
+    ''' short hash of the palette colors used by the icons, naming the atlases of this palette '''
+    colors = palette_colors(palette, QIcon.Mode.Normal) + palette_colors(palette, QIcon.Mode.Disabled)
+    return hashlib.blake2b(' '.join(colors).encode(), digest_size=8).hexdigest()
+
+def current_palette() -> tuple[str, tuple]:
+    ''' key and icon colors, normal then disabled, of the application palette
+    
+        they are only computed again after `invalidate`, rather than at every paint
+    '''
+    if QThemeIconEngine._palette is None:
+        palette = QApplication.palette()
+        QThemeIconEngine._palette = (
+            palette_key(palette), 
+            (palette_colors(palette, QIcon.Mode.Normal), palette_colors(palette, QIcon.Mode.Disabled)),
+            )
+    return QThemeIconEngine._palette
+
+def invalidate():
+    ''' drop the icons rendered in memory, to be called when the palette changes 
+    
+        the atlases on disk are kept, since they are specific to their palette
+    '''
+    QThemeIconEngine._cache.clear()
+    QThemeIconEngine._palette = None
+
+
+class IconAtlas:
+    ''' icons rendered for a palette and a size, stored in one file to be memory-mapped at the next startup
+    
+        Icons missing are rendered and added to the atlas, which is written again shortly after. The file holds an index of the icons and their pixels, in the format of `storage.write`
+        
+        Attributes:
+            path:     atlas file
+            size:     width and height of the icons
+            index:    offset in `pixels` and modification date of the source, for each icon variant
+            pixels:   memory-mapped pixels of the icons in the file
+            added:    pixels and modification date of the icons rendered since the file was read
+    '''
+    _atlases = {}
+    
+    def __init__(self, path:str, size:tuple[int, int]):
+        self.path = path
+        self.size = size
+        self.index = {}
+        self.pixels = memoryview(b'')
+        self.added = {}
+        self._scheduled = False
+        try:
+            parts = storage.read(path)
+            index = pickle.loads(parts[0])
+        # a missing, partial or foreign file is simply rendered again
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return
+        if index.get('size') == size:
+            self.index = index['icons']
+            self.pixels = parts[1]
+    
+    @classmethod
+    def get(cls, palette:str, size) -> 'IconAtlas':
+        ''' atlas of the given palette key and icon size, loaded on first use '''
+        size = (size.width(), size.height())
+        key = (palette, size)
+        if key not in cls._atlases:
+            cls._atlases[key] = cls(os.path.join(atlas_directory(), '{}-{}x{}.atlas'.format(palette, *size)), size)
+        return cls._atlases[key]
+    
+    @property
+    def nbytes(self) -> int:
+        ''' bytes of an icon '''
+        return 4 * self.size[0] * self.size[1]
+    
+    def image(self, name:str, mtime:float) -> QImage:
+        ''' rendering of the given icon variant, or None if not in the atlas or outdated '''
+        if name in self.added:
+            pixels, date = self.added[name]
+        elif name in self.index:
+            offset, date = self.index[name]
+            pixels = self.pixels[offset:offset+self.nbytes]
+        else:
+            return None
+        if date != mtime or len(pixels) != self.nbytes:
+            return None
+        # the image is copied so it doesn't refer to the mapping
+        return QImage(bytes(pixels), *self.size, 4*self.size[0], QImage.Format.Format_ARGB32_Premultiplied).copy()
+    
+    def add(self, name:str, image:QImage, mtime:float):
+        ''' add a rendered icon variant and schedule writing the atlas '''
+        image = image.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+        self.added[name] = (image_bytes(image), mtime)
+        if not self._scheduled:
+            self._scheduled = True
+            # icons are mostly rendered together at startup, so they are written together
+            QTimer.singleShot(1000, self.save)
+    
+    def save(self):
+        ''' write the atlas file with the icons added '''
+        self._scheduled = False
+        if not self.added:
+            return
+        index = {}
+        pixels = bytearray()
+        for name, (offset, date) in self.index.items():
+            if name not in self.added:
+                index[name] = (len(pixels), date)
+                pixels += self.pixels[offset:offset+self.nbytes]
+        for name, (data, date) in self.added.items():
+            index[name] = (len(pixels), date)
+            pixels += data
+        directory = os.path.dirname(self.path)
+        try:
+            # written aside, then renamed so other processes never read a partial atlas
+            descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with open(descriptor, 'wb') as file:
+                storage.write(file, [
+                    memoryview(pickle.dumps({'size': self.size, 'icons': index})), 
+                    memoryview(pixels),
+                    ])
+            os.replace(temporary, self.path)
+        except OSError as err:
+            print('unable to write the icons atlas:', err, file=sys.stderr)
+            return
+        self.index = index
+        self.pixels = memoryview(bytes(pixels))
+        self.added.clear()
+
+@atexit.register
+def _save_atlases():
+    for atlas in IconAtlas._atlases.values():
+        atlas.save()
+
+def atlas_directory() -> str:
+    ''' directory of the icons atlases, specific to the installed version since the icons may change '''
+    from . import version
+    directory = os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'uimadcad', 'icons', str(version),
+        )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def image_bytes(image:QImage) -> bytes:
+    ''' copy of the pixels of an image '''
+    bits = image.constBits()
+    # PyQt returns a pointer to size, PySide a memoryview
+    if hasattr(bits, 'asstring'):
+        return bits.asstring(image.sizeInBytes())
+    return bytes(bits)
 
 
 def qcolor_to_hex(color:QColor) -> str:
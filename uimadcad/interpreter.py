@@ -3,14 +3,77 @@ from __future__ import annotations
 from copy import deepcopy
 from functools import partial
 from dataclasses import dataclass
+from contextlib import contextmanager
 from bisect import bisect_right
+from threading import Lock, Condition
 import traceback
+import sys
 
 from . import ast
+from .storage import memsize, Tiers, SharedStore
 
 
 class InterpreterError(Exception):	pass
 
+class InterpreterInterrupt(BaseException):
+	''' raised in the executed code when the execution is interrupted 
+	
+		it does not inherit from Exception so the user code cannot catch it by mistake
+	'''
+
+class ResolutionLock:
+	''' process-wide lock on the pymadcad resolution setting, for documents executing in their own threads
+	
+		Executions with the default resolution share it, while an execution with its own resolution holds it alone, so no other execution runs with the wrong resolution and the former resolutions are restored in order.
+		Pending exclusive executions go first, so a flow of executions sharing it cannot delay a preview indefinitely.
+		While waiting for the lock, the `interrupted` callback is checked regularly, so a superseded execution stops waiting with an `InterpreterInterrupt`
+	'''
+	# seconds between two checks of the interruption while waiting
+	period = 0.05
+	
+	def __init__(self):
+		self._condition = Condition()
+		self._shared = 0
+		self._exclusive = False
+		self._waiting = 0
+	
+	def _wait(self, available:callable, interrupted:callable):
+		while not self._condition.wait_for(available, timeout=self.period):
+			if interrupted and interrupted():
+				raise InterpreterInterrupt('execution interrupted')
+	
+	@contextmanager
+	def shared(self, interrupted:callable=None):
+		with self._condition:
+			self._wait(lambda: not self._exclusive and not self._waiting, interrupted)
+			self._shared += 1
+		try:
+			yield
+		finally:
+			with self._condition:
+				self._shared -= 1
+				self._condition.notify_all()
+	
+	@contextmanager
+	def exclusive(self, interrupted:callable=None):
+		with self._condition:
+			self._waiting += 1
+			try:
+				self._wait(lambda: not self._exclusive and not self._shared, interrupted)
+			finally:
+				self._waiting -= 1
+				# executions waiting for the shared lock may proceed if this one gave up
+				self._condition.notify_all()
+			self._exclusive = True
+		try:
+			yield
+		finally:
+			with self._condition:
+				self._exclusive = False
+				self._condition.notify_all()
+
+_resolution_lock = ResolutionLock()
+
 
 class Interpreter:
 	''' this class execute the uimadcad file code and exposes the resulting scope, errors and code analysis 
@@ -25,10 +88,40 @@ class Interpreter:
 	locations: list[Located]
 	identified: dict[int, Located]
 	usages: dict[str, Usage]
+	analysis: ast.Analysis
+	''' facts about the nodes of the last executed source '''
+	steps: dict[tuple[str, int], int]
+	''' source line of the statement following each step reported during execution '''
+	code: ast.Module
+	''' transformed code of the last execution, or None if the transformation failed '''
+	statements: dict[str, list[tuple]]
+	''' cached statements of each scope, as returned by `ast.parcimonize` '''
+	constants: dict[int, tuple[str, int, ast.Constant]]
+	''' numeric literals of the cached statements by source position, with their scope and statement index '''
+	invalidated: list[ast.Invalidation]
+	''' statements of the last execution that could not reuse their previous results, and why '''
 	exception: Exception
+	keep_frames: bool
+	''' if True, the last exception keeps its execution frames until the next execution, else it is immediately snapshoted '''
+	released: int
+	''' estimated number of bytes released by the last exception snapshot '''
+	collected: dict[tuple[str, str], int]
+	''' estimated number of bytes released after the last execution, for each variable or cached result `(scope, name)` the source no longer defines '''
+	iterations: bool
+	''' if True, the iterations of `for` loops are cached separately '''
+	tiers: Tiers
+	''' storage tiers of the cached values, or None to keep them all alive '''
+	shared: SharedStore
+	''' store sharing the cached values with other processes, or None '''
+	deferred: int
+	''' number of top-level statements the last execution did not execute because they were not demanded, see `execute` and `resume` '''
 	
-	def __init__(self, filename:str):
+	def __init__(self, filename:str, keep_frames:bool=True, iterations:bool=False, tiers:Tiers=None, shared:SharedStore=None):
 		self.cache = {}
+		self._resolution = None
+		self._namespaces = {}
+		self.tiers = tiers
+		self.shared = shared
 		self.filename = filename
 		self.source = ''
 		self.previous = {}
@@ -38,39 +131,89 @@ class Interpreter:
 		self.definitions = {}
 		self.locations = []
 		self.usages = {}
+		self.analysis = ast.Analysis()
+		self.steps = {}
+		self.code = None
+		self.statements = {}
+		self.constants = {}
+		self.invalidated = []
 		# TODO reimplement interpreter early stop
 		# self.stops = []
 		self.exception = None
+		self._interrupted = False
+		self._module = None
+		self.keep_frames = keep_frames
+		self.iterations = iterations
+		self.released = 0
+		self.collected = {}
+		self._bound = {}
+		self.deferred = 0
+	
+	@property
+	def resolution(self) -> tuple:
+		''' pymadcad curve resolution of the executions (like `('rad', 0.5)`), or None for the resolution of the pymadcad settings
+		
+			A coarse resolution gives a fast preview of the script. Each resolution has its own cached results, so switching back and forth between a preview and full quality executions reuses the results of both. The preview results are not shared with other processes.
+			
+			This must only be changed between executions, in the executing thread
+		'''
+		return self._resolution
+	
+	@resolution.setter
+	def resolution(self, resolution):
+		if resolution is not None:
+			resolution = tuple(resolution)
+		if resolution == self._resolution:
+			return
+		# the statements hashes tell which cached results are still valid, so they go along with their cache
+		self._namespaces[self._resolution] = (self.cache, self.previous)
+		self.cache, self.previous = self._namespaces.pop(resolution, ({}, {}))
+		self._resolution = resolution
 	
-	def execute(self, source:str, step:callable):
+	def execute(self, source:str, step:callable, demand:set[str]=None, staged:bool=False):
 		''' execute the code in the given string
 		
 			- this is a lazy execution where all previous result from previous execution are reused when possible
 			- step is a callback executed regularly during execuction:
 				
 				step(scope: str, current_line: int, total_lines: int)
+			
+			- if `demand` is given, only the top-level statements needed to compute these module variables are executed. The others are deferred until `resume` is called, their variables keep the values of the previous execution meanwhile
+			- if `staged` is True, the source, its analysis and the variables computed are only put in the interpreter when the execution ends, and if it is interrupted, the source and results of the previous execution are left in place
 		'''
-		self.exception = None
-		self.source = source
-		
-		module = dict(
-			__file__ = self.filename,
-			__name__ = '__madcad__',
-			_madcad_global_cache = partial(ast.global_cache, self.cache),
-			_madcad_scopes = self.scopes,
-			_madcad_step = step,
-			_madcad_vars = vars,
+		# attributes describing this execution, put in the interpreter before running the code, or when it ends if staged
+		stage = dict(
+			source = source,
+			code = None,
+			statements = {},
+			constants = {},
+			invalidated = [],
+			deferred = 0,
 			)
+		origins = {}
+		module = self._start(step)
+		scopes = self.scopes
+		if staged:
+			scopes = module['_madcad_scopes'] = {scope: dict(values)  for scope, values in self.scopes.items()}
 		
 		try:
-			code = self.ast = ast.parse(source).body
+			code = stage['ast'] = ast.parse(source).body
 			# collect user variable with their original definitions, the definition will be modified inplace but at least we have its root
-			originals = ast.locate(code, self.filename)
-			self.usages = ast.usage(code, self.filename)
+			analysis = stage['analysis'] = ast.Analysis(code, self.filename)
+			originals = analysis.definitions
+			stage['usages'] = analysis.usage()
 			code = list(ast.parcimonize(self.cache, self.filename, (), module.keys(), code, self.previous, 
 				# assuming only calls might be long ioperations
-				filter=lambda node: any(isinstance(node, ast.Call)  for node in ast.walk(node)),
+				filter=analysis.calls,
+				statements=stage['statements'],
+				split=True,
+				invalidated=stage['invalidated'],
+				iterations=self.iterations,
+				analysis=analysis,
+				shared=self._shared() is not None,
+				origins=origins,
 				))
+			stage['constants'] = self._index_constants(source, stage['statements'])
 			code = list(ast.steppize(code, self.filename, 
 				# place steps before parcimonized steps because assumed to be long operations
 				filter=lambda node: isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name) and node.targets[0].id == '_madcad_tmp' or isinstance(node, ast.Return),
@@ -78,10 +221,13 @@ class Interpreter:
 			code = list(ast.flatten(code))
 			# collect temporary variables created by this interpreter
 			created = ast.locate(code, self.filename)
+			# the cache temporary holds successive values, it cannot be selected
+			for definitions in created.values():
+				definitions.pop('_madcad_tmp', None)
 			code = list(ast.report(code, self.filename, clear=False))
 			
 			# prefer original defintions to created ones
-			self.definitions = {
+			stage['definitions'] = {
 				scope: created[scope] | originals[scope]
 				for scope in originals
 				}
@@ -90,7 +236,7 @@ class Interpreter:
 			
 			# build a sorted location index
 			locations = []
-			for scope, definitions in self.definitions.items():
+			for scope, definitions in stage['definitions'].items():
 				for name, node in definitions.items():
 					if haslocation(node):
 						located = node
@@ -109,41 +255,309 @@ class Interpreter:
 						scope, 
 						name,
 						))
-			self.locations = sorted(locations, key=lambda item: item.range.start)
+			stage['locations'] = sorted(locations, key=lambda item: item.range.start)
 			
 			code = ast.Module(list(code), type_ignores=[])
 			ast.fix_locations(code)
-			bytecode = compile(code, self.filename, 'exec')
-			
-			# import dis
-			# dis.dis(bytecode)
-			# from pnprint import cprint, nprint
-			# print(ast.dump(code, indent=4))
-			# cprint(ast.unparse(code))
-			# nprint('cache', self.cache)
+			stage['steps'] = ast.steplines(code.body)
+			stage['code'] = code
+			if demand is not None:
+				code, stage['deferred'] = self._demanded(code, stage['ast'], analysis, origins, demand)
+			if not staged:
+				self.__dict__.update(stage)
+			self._run(code, module, stage)
+				
+		except (Exception, InterpreterInterrupt) as err:
+			self._fail(err)
+		if staged and isinstance(self.exception, InterpreterInterrupt):
+			self._module = None
+			return
+		self.__dict__.update(stage)
+		self.scopes = scopes
+		self._end()
+	
+	def resume(self, step:callable):
+		''' execute the whole code of the last execution, including the statements it deferred 
 		
+			the statements already executed are retreived from the cache. An interruption since the last execution also stops this one, like any execution not rearmed
+		'''
+		if self.code is None:
+			return
+		self.deferred = 0
+		module = self._start(step)
+		try:
+			self._run(self.code, module)
+		except (Exception, InterpreterInterrupt) as err:
+			self._fail(err)
+		self._end()
+	
+	def _demanded(self, code:ast.Module, tree:list[AST], analysis:ast.Analysis, origins:dict, demand:set[str]) -> tuple[ast.Module, int]:
+		''' restrict the transformed code to the statements needed by the given module variables, return it with the number of top-level statements deferred '''
+		needed = ast.closure(tree, demand, analysis)
+		# the transformed statements are in the reporting block
+		report, = code.body
+		body = []
+		following = []
+		for node in report.body:
+			following.append(node)
+			# steps and temporaries are inserted before the statement they belong to
+			if node in origins:
+				if origins[node] is None or origins[node] in needed:
+					body.extend(following)
+				following.clear()
+		body.extend(following)
+		demanded = ast.Module([ast.Try(body, report.handlers, report.orelse, report.finalbody)], type_ignores=[])
+		ast.fix_locations(demanded)
+		return demanded, len(tree) - len(needed)
+	
+	def scrub(self, position:int, value, step:callable) -> bool:
+		''' change the value of the numeric literal at the given position of the last executed source, then execute again
+		
+			- only the statements depending on the literal are executed again, the others are retreived from the cache
+			- the transformed code of the last execution is patched, avoiding to parse and transform the source again. So `self.source` and locations are not changed.
+			- return False and do nothing if there is no numeric literal at this position in the last successfully transformed code
+		'''
+		if self.code is None or position not in self.constants:
+			return False
+		scope, index, constant = self.constants[position]
+		constant.value = value
+		self._invalidate(scope, index, constant)
+		
+		# the patched code is entirely executed
+		self.deferred = 0
+		module = self._start(step)
+		try:
+			self._run(self.code, module)
+		except (Exception, InterpreterInterrupt) as err:
+			self._fail(err)
+		self._end()
+		return True
+	
+	def _index_constants(self, source:str, statements:dict) -> dict:
+		''' index the numeric literals of the parcimonized statements by their position in the source '''
+		constants = {}
+		lines = [0]
+		for line in source.splitlines(keepends=True):
+			lines.append(lines[-1] + len(line))
+		for scope, statements in statements.items():
+			for index, (key, node, deps, provided) in enumerate(statements):
+				for child in ast.walk(node):
+					if (isinstance(child, ast.Constant) and type(child.value) in (int, float)
+					and child.lineno == child.end_lineno):
+						position = lines[child.lineno-1] + child.col_offset
+						# prefer the innermost scope for literals in function definitions
+						previous = constants.get(position)
+						if previous is None or len(previous[0]) < len(scope):
+							constants[position] = (scope, index, child)
+		return constants
+	
+	def _invalidate(self, scope:str, index:int, constant:ast.Constant):
+		''' discard the cached results of the given statement and of the statements depending on it, in its scope and its parent scopes '''
+		# functions definitions and loops in parent scopes
+		parents = {}
+		for parent, statements in self.statements.items():
+			for i, (key, node, deps, provided) in enumerate(statements):
+				if isinstance(node, ast.FunctionDef):
+					parents[parent+'.'+node.name] = (parent, i)
+				elif isinstance(node, ast.For):
+					parents[ast.iteration_scope(parent, key)] = (parent, i)
+		
+		while True:
+			statements = self.statements[scope]
+			# the previous execution must remember the new value, so the next execution consider the statement unchanged
+			key, node = statements[index][:2]
+			self.previous[scope][key] = self.analysis.rehash(node)
+			# propagate the change to the statements depending on it
+			changed = set()
+			for i in range(index, len(statements)):
+				key, node, deps, provided = statements[i]
+				if i == index or any(dep in changed  for dep in deps):
+					changed.update(provided)
+					for backups in self.cache.get(scope, {}).values():
+						backups.discard(key)
+			# the function containing this scope changed
+			if scope not in parents:
+				break
+			scope, index = parents[scope]
+	
+	def _start(self, step:callable) -> dict:
+		''' prepare a new execution, return the module dictionnary to execute in '''
+		self.released = 0
+		self.release()
+		
+		def checkpoint(scope, current, total):
+			if self._interrupted:
+				raise InterpreterInterrupt('execution interrupted')
+			step(scope, current, total)
+		
+		return dict(
+			__file__ = self.filename,
+			__name__ = '__madcad__',
+			_madcad_global_cache = partial(ast.global_cache, self.cache, tiers=self.tiers, shared=self._shared()),
+			_madcad_fingerprint = ast.fingerprint,
+			_madcad_scopes = self.scopes,
+			_madcad_step = checkpoint,
+			_madcad_vars = vars,
+			_madcad_resolution = self._resolution,
+			)
+	
+	def _shared(self) -> SharedStore:
+		''' store shared with other processes for the current resolution, previews are not worth sharing '''
+		if self._resolution is None:
+			return self.shared
+	
+	@contextmanager
+	def _resolution_applied(self):
+		''' use the current resolution in pymadcad during the execution 
+		
+			pymadcad reads its default resolution from a global of its settings module, so the executions of other documents wait for a preview to end, see `ResolutionLock`
+		'''
+		interrupted = lambda: self._interrupted
+		if self._resolution is None:
+			with _resolution_lock.shared(interrupted):
+				yield
+			return
+		with _resolution_lock.exclusive(interrupted):
+			from madcad import settings
+			former = settings.resolution
+			settings.resolution = self._resolution
 			try:
-				exec(bytecode, module, module)
-			except Exception as err:
-				stops = {}
-				for frame, line in traceback.walk_tb(err.__traceback__):
-					name = frame.f_code.co_name
-					if name == '<module>':
-						name = self.filename
-					stops[name] = line
-					# TODO: use a try finally for the scope capture
-				self.usages = ast.usage(code.body, self.filename, stops=stops)
-				raise
-				
-		except Exception as err:
-			self.exception = err
+				yield
+			finally:
+				settings.resolution = former
+	
+	def _run(self, code:ast.Module, module:dict, stage:dict=None):
+		''' compile and execute the transformed code in the given module 
 		
+			the usages at the failure are put in `stage`, the attributes of the execution not yet put in the interpreter
+		'''
+		if stage is None:
+			stage = self.__dict__
+		bytecode = compile(code, self.filename, 'exec')
+		
+		# import dis
+		# dis.dis(bytecode)
+		# from pnprint import cprint, nprint
+		# print(ast.dump(code, indent=4))
+		# cprint(ast.unparse(code))
+		# nprint('cache', self.cache)
+	
+		try:
+			self._module = module
+			with self._resolution_applied():
+				exec(bytecode, module, module)
+		except (Exception, InterpreterInterrupt) as err:
+			stops = {}
+			for frame, line in traceback.walk_tb(err.__traceback__):
+				name = frame.f_code.co_name
+				if name == '<module>':
+					name = self.filename
+				stops[name] = line
+				# TODO: use a try finally for the scope capture
+			stage['usages'] = stage['analysis'].usage(stops)
+			raise
+	
+	def _fail(self, err:BaseException):
+		''' keep the exception that ended the execution '''
+		self.exception = err
+		if not self.keep_frames:
+			self.released = self.snapshot(err)
+	
+	def _end(self):
+		''' finish an execution, indexing its results '''
+		self._module = None
+		if self.code is not None:
+			self.collect()
 		self.identified = {
 			id(self.scopes[located.scope][located.name]): located  
 			for located in self.locations
 			if located.scope in self.scopes
 			and located.name in self.scopes[located.scope]}
 		
+	def collect(self):
+		''' release the variables, cached results and statements hashes of the previous executions that the current source no longer defines
+		
+			The temporary variables created by the interpreter are only kept when they can be selected in the source. This must be called after a successful transformation of the source, the estimated memory released is put in `collected`.
+			The names brought by star imports are unknown to the analysis, so in a scope with a star import only the names the source bound in the previous execution are released.
+		'''
+		removed = []
+		# variables
+		selectable = {}
+		for located in self.locations:
+			selectable.setdefault(located.scope, set()).add(located.name)
+		bound = {}
+		for scope in list(self.scopes):
+			variables = self.analysis.variables.get(scope)
+			if variables is None:
+				removed.extend((scope, name, value)  for name, value in self.scopes.pop(scope).items())
+				continue
+			values = self.scopes[scope]
+			keep = bound[scope] = variables | selectable.get(scope, set())
+			if '*' in variables:
+				former = self._bound.get(scope, set())
+				unbound = [name  for name in values  
+					if name not in keep and (name in former or name.startswith(('_madcad_', '__')))]
+			else:
+				unbound = [name  for name in values  if name not in keep]
+			for name in unbound:
+				removed.append((scope, name, values.pop(name)))
+		self._bound = bound
+		# cached results and previous statements
+		for scope in list(self.cache):
+			keys = {key  for key, *_ in self.statements.get(scope, ())}
+			for cache in self.cache[scope].values():
+				for key in [key  for key in cache.scope  if key not in keys]:
+					removed.append((scope, key, cache.pop(key)))
+			if not keys:
+				ast.drop_caches(self.cache, scope)
+		for scope in list(self.previous):
+			if scope not in self.statements:
+				del self.previous[scope]
+				continue
+			keys = {key  for key, *_ in self.statements[scope]}
+			previous = self.previous[scope]
+			for key in [key  for key in previous  if key not in keys and key != '()']:
+				del previous[key]
+		
+		# values still referenced are not released
+		memo = {id(module)  for module in sys.modules.values()}
+		for values in self.scopes.values():
+			memo.update(id(value)  for value in values.values())
+		for versions in self.cache.values():
+			for cache in versions.values():
+				memo.update(id(value)  for value in cache.scope.values())
+		self.collected = {}
+		# values shared between scopes are attributed to the outermost one
+		removed.sort(key=lambda item: len(item[0]))
+		for scope, name, value in removed:
+			# interpreter internals are not user data
+			if name.startswith(('_madcad_', '__')):
+				continue
+			size = memsize(value, memo)
+			if size:
+				self.collected[scope, name] = self.collected.get((scope, name), 0) + size
+		
+	def clear_cache(self):
+		''' drop all the cached results of all resolutions, releasing their storage '''
+		for cache, previous in [(self.cache, self.previous), *self._namespaces.values()]:
+			for scope in list(cache):
+				ast.drop_caches(cache, scope)
+			previous.clear()
+		self._namespaces.clear()
+		
+	def release(self):
+		''' drop the last exception, after releasing the execution frames it retains 
+		
+			the exception may still be referenced elsewhere (like in an error view), so it is snapshoted
+		'''
+		if self.exception is not None:
+			self.released = self.snapshot(self.exception)
+		self.exception = None
+	
+	def snapshot(self, exception:Exception) -> int:
+		''' snapshot the given exception, not counting the variables still retained by the interpreter as released memory '''
+		return snapshot(exception, keep=[self, self.cache, self._namespaces, self.scopes, *self.scopes.values()])
+		
 	def names_crossing(self, area:range) -> Iterator[Located]:
 		''' yield variables with text range crossing the given position range '''
 		stop = bisect_right(self.locations, area.stop, key=lambda item: item.range.start)
@@ -172,9 +586,130 @@ class Interpreter:
 				return item.scope+'.'+item.name
 		return self.filename
 	
+	def report_progress(self):
+		''' report the module variables computed so far by the current execution, so they are available in `self.scopes` before the execution ends
+		
+			this method must be called from the `step` callback, in the executing thread
+		'''
+		if self._module is None:
+			return
+		# replace the scope dictionnary rather than updating it, so other threads reading the previous one are not disturbed
+		scopes = self._module['_madcad_scopes']
+		scopes[self.filename] = {**scopes.get(self.filename, {}), **self._module}
+	
 	def interrupt(self):
-		# TODO
-		pass
+		''' stop the current execution at the next step of the executed code, 
+			it will end with an `InterpreterInterrupt` exception
+			
+			this method is meant to be called from an other thread than the one executing. The interruption lasts until `rearm` is called, so it also stops an execution that has not started yet
+		'''
+		self._interrupted = True
+	
+	def rearm(self):
+		''' clear the last interruption, so next executions run until their end
+		
+			this is meant to be called when an execution is dequeued, see `ExecutionQueue.submit`
+		'''
+		self._interrupted = False
+
+class ExecutionQueue:
+	''' schedule executions in a thread, keeping at most one pending execution
+	
+		A new execution supersedes the pending one (that will never run) and interrupts the running one, so only the latest request is fully executed.
+	
+		This class is thread-safe
+	'''
+	def __init__(self, thread):
+		self.thread = thread
+		self.lock = Lock()
+		self.pending = None  # (task, interrupt, rearm) waiting to be executed
+		self.running = None  # (task, interrupt, rearm) currently executed
+		self.running_interrupted = False
+		self.scheduled = False
+		
+		self.requested = 0     # number of executions submitted
+		self.completed = 0     # number of executions run until their end
+		self.superseded = 0    # number of pending executions dropped before running
+		self.interrupted = 0   # number of running executions interrupted
+	
+	@property
+	def depth(self) -> int:
+		''' number of executions currently running or waiting '''
+		return (self.pending is not None) + (self.running is not None)
+	
+	@property
+	def wasted(self) -> int:
+		''' number of submitted executions that did not run until their end '''
+		return self.superseded + self.interrupted
+		
+	def statistics(self) -> dict:
+		''' execution counters since the queue creation '''
+		return dict(
+			depth = self.depth,
+			requested = self.requested,
+			completed = self.completed,
+			superseded = self.superseded,
+			interrupted = self.interrupted,
+			wasted = self.wasted,
+			)
+	
+	def submit(self, task:callable, interrupt:callable=None, rearm:callable=None):
+		''' schedule the given task, superseding the pending one and interrupting the running one
+		
+			Args:
+				task:       the function performing the execution, called in the thread
+				interrupt:  function to call (from any thread) to stop `task` earlier
+				rearm:      function clearing a previous interruption, called when `task` is dequeued so an interruption arriving before `task` starts is not lost
+		'''
+		with self.lock:
+			self.requested += 1
+			if self.pending is not None:
+				self.superseded += 1
+			self.pending = (task, interrupt, rearm)
+			self._interrupt()
+			schedule, self.scheduled = not self.scheduled, True
+		if schedule:
+			self.thread.schedule(self._run)
+	
+	def cancel(self):
+		''' drop the pending execution and interrupt the running one '''
+		with self.lock:
+			if self.pending is not None:
+				self.superseded += 1
+			self.pending = None
+			self._interrupt()
+	
+	def _interrupt(self):
+		''' interrupt the running task if not already done, the lock must be held '''
+		if self.running is not None and not self.running_interrupted:
+			self.running_interrupted = True
+			self.interrupted += 1
+			interrupt = self.running[1]
+			if interrupt:
+				interrupt()
+	
+	def _run(self):
+		''' execute tasks until there is no pending one, called in the thread '''
+		while True:
+			with self.lock:
+				if self.pending is None:
+					self.running = None
+					self.scheduled = False
+					return
+				self.running, self.pending = self.pending, None
+				self.running_interrupted = False
+				# interruptions are only sent while holding the lock, so none can be missed from here
+				rearm = self.running[2]
+				if rearm:
+					rearm()
+			try:
+				self.running[0]()
+			except Exception:
+				traceback.print_exc()
+			with self.lock:
+				if not self.running_interrupted:
+					self.completed += 1
+
 
 @dataclass
 class Located:
@@ -193,3 +728,99 @@ def haslocation(node):
 def test_interpreter():
 	# TODO test that the interpreter result is the same as the normal python interpreter even when reexecuting and modifying parts of the script
 	indev
+
+
+def exception_stack(exception: Exception) -> traceback.StackSummary:
+	''' stack of frames of the given exception, whether it has been snapshoted or not 
+	
+		`FrameSummary.locals` is set to the variables of each frame, as live values if the exception still has its traceback, or as `Summarized` values if it has been snapshoted
+	'''
+	if exception.__traceback__ is None:
+		return getattr(exception, '_madcad_snapshot', traceback.StackSummary())
+	stack = traceback.extract_tb(exception.__traceback__)
+	for frame, (live, _) in zip(stack, traceback.walk_tb(exception.__traceback__)):
+		frame.locals = live.f_locals
+	return stack
+
+def format_stack(stack: traceback.StackSummary) -> list[str]:
+	''' format the frames of a stack like `traceback.format_list`, but without their variables 
+	
+		the variables set by `exception_stack` would otherwise be formatted along, which is slow and unreadable for big values
+	'''
+	return traceback.format_list([(frame.filename, frame.lineno, frame.name, frame.line)  for frame in stack])
+
+def snapshot(exception: Exception, keep:list=()) -> int:
+	''' replace the traceback of the given exception (and of its chained exceptions) by a lightweight stack summary, dropping the execution frames and their variables
+	
+		The summary is a `traceback.StackSummary` where the frames variables are replaced by `Summarized` values, it can be retreived using `exception_stack`
+	
+		Args:
+			keep:  objects still referenced elsewhere, that the memory estimation will not count as released
+		
+		Return:  an estimation of the number of bytes released
+	'''
+	memo = set()
+	for obj in keep:
+		memo.add(id(obj))
+		if isinstance(obj, dict):
+			memo.update(id(value)  for value in obj.values())
+	
+	released = 0
+	chained = set()
+	pending = [exception]
+	while pending:
+		exception = pending.pop()
+		if exception is None or id(exception) in chained:
+			continue
+		chained.add(id(exception))
+		pending.append(exception.__cause__)
+		pending.append(exception.__context__)
+		
+		tb = exception.__traceback__
+		if tb is None:
+			continue
+		stack = exception_stack(exception)
+		for frame in stack:
+			summaries = {}
+			for name, value in frame.locals.items():
+				released += memsize(value, memo)
+				summaries[name] = Summarized(summary(value))
+			frame.locals = summaries
+		# the snapshot must be available before the traceback disappears
+		exception._madcad_snapshot = stack
+		exception.__traceback__ = None
+		traceback.clear_frames(tb)
+	return released
+
+class Summarized:
+	''' text summary replacing a value that is no longer retained '''
+	__slots__ = 'text',
+	def __init__(self, text:str):
+		self.text = text
+	def __repr__(self):
+		return self.text
+
+def summary(value) -> str:
+	''' short description of a value, quick to compute whatever the size of the value '''
+	if isinstance(value, Summarized):
+		return value.text
+	if value is None or isinstance(value, (bool, int, float, complex)):
+		return repr(value)
+	text = type(value).__name__
+	if isinstance(value, str) and len(value) <= 40:
+		return repr(value)
+	# user types may fail anywhere
+	try:
+		shape = getattr(value, 'shape', None)
+		if isinstance(shape, tuple):
+			text += ' {}'.format('x'.join(str(n) for n in shape))
+		# madcad meshes
+		elif hasattr(value, 'points') and hasattr(value, 'faces'):
+			text += ' of {} points, {} faces'.format(len(value.points), len(value.faces))
+		elif hasattr(value, 'points') and hasattr(value, 'edges'):
+			text += ' of {} points, {} edges'.format(len(value.points), len(value.edges))
+		elif hasattr(value, '__len__'):
+			text += ' of {} items'.format(len(value))
+	except Exception:
+		pass
+	return text
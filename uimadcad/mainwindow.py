@@ -13,10 +13,9 @@ from madcad.qt import (
 from madcad.rendering import Orthographic
 from madcad.mathutils import fvec3, fquat, pi
 
-from . import settings
+from . import settings, startup, icon
 from .sceneview import SceneView
 from .scriptview import ScriptView
-from .errorview import ErrorView
 from .utils import ToolBar, Button, button, Initializer, action, hlayout, spacer, Menu, Action, shortcut
 
 
@@ -38,6 +37,9 @@ class MainWindow(QMainWindow):
 			self.app.clear,
 			self.open_panel,
 			self.app.trigger_on_file_change,
+			self.app.live_execution,
+			self.app.preview,
+			self.app.demand_execution,
 			None,
 			self.app.open_uimadcad_settings,
 			self.app.open_pymadcad_settings,
@@ -66,7 +68,8 @@ class MainWindow(QMainWindow):
 			]))
 		
 		self.resize(*settings.window['size'])
-		self.layout_preset(settings.window['layout'])
+		with startup.step('layout'):
+			self.layout_preset(settings.window['layout'])
 		self.open_panel.toggled.emit(False)
 		
 	def keyPressEvent(self, event):
@@ -91,6 +94,14 @@ class MainWindow(QMainWindow):
 		# window activation should trigger execution if enabled
 		if event.type() == QEvent.ActivationChange and self.isActiveWindow():
 			self.app.check_change()
+		# icons rendered with the former colors
+		elif event.type() == QEvent.ApplicationPaletteChange:
+			icon.invalidate()
+	
+	def closeEvent(self, event):
+		# other documents of the process may still be open
+		self.app.close()
+		super().closeEvent(event)
 	
 	# @shortcut(shortcut='Esc')
 	def _focus_other(self):
@@ -355,7 +366,7 @@ class ExecutionPanel(QGroupBox):
 	
 		self.ring = MultiRing(150)
 		self.status = QLabel()
-		self.errorview = ErrorView(self.app)
+		self._errorview = None
 		self.stop = Button(self.app.stop.trigger, 
 			icon = self.app.stop.icon(),
 			description = self.app.stop.toolTip(),
@@ -365,12 +376,19 @@ class ExecutionPanel(QGroupBox):
 		self.setLayout(hlayout([
 			self.ring,
 			self.status,
-			self.errorview,
 			]))
 		self.stop.raise_()
-		
-		self.app.active.errorview = self.errorview
 		self.set_success()
+	
+	@property
+	def errorview(self) -> 'ErrorView':
+		''' traceback view, only created at the first error since it is hidden until then '''
+		if self._errorview is None:
+			from .errorview import ErrorView
+			self._errorview = ErrorView(self.app)
+			self.layout().addWidget(self._errorview)
+			self.app.active.errorview = self._errorview
+		return self._errorview
 		
 	def resizeEvent(self, event):
 		super().resizeEvent(event)
@@ -395,16 +413,20 @@ class ExecutionPanel(QGroupBox):
 		
 	def set_progress(self, progress):
 		''' show the given execution progress in the status panel '''
-		self.errorview.hide()
+		if self._errorview is not None:
+			self._errorview.hide()
 		self.status.show()
 		self.stop.setEnabled(True)
 		self.ring.progressing = True
 		self.ring.progress = [progress 
 			for scope, progress in progress.items() 
 			if progress < 1. ]
-		self.status.setText('\n'.join('{}: {}%'.format(scope, int(progress*100))  
+		status = '\n'.join('{}: {}%'.format(scope, int(progress*100))  
 			for scope, progress in progress.items()
-			if progress < 1. ))
+			if progress < 1. )
+		if self.app.executions.pending:
+			status += '\n1 execution pending'
+		self.status.setText(status)
 		self.ring.color = self.palette().color(QPalette.Active, QPalette.Highlight)
 		self.ring.update()
 		self.adjustSize()
@@ -412,15 +434,35 @@ class ExecutionPanel(QGroupBox):
 	def set_success(self):
 		''' show that last execution was successfull in the status panel '''
 		self.stop.setEnabled(False)
-		self.errorview.hide()
+		if self._errorview is not None:
+			self._errorview.hide()
+			self._errorview.clear()
 		self.status.show()
-		self.status.setText('calculation succeed\n100%')
+		status = 'calculation succeed\n100%'
+		if self.app.interpreter.resolution is not None:
+			status = 'preview succeed\n100%'
+		if self.app.interpreter.released:
+			status += '\nreleased {} from previous error'.format(format_bytes(self.app.interpreter.released))
+		if self.app.interpreter.collected:
+			status += '\nreleased {} from removed variables'.format(format_bytes(sum(self.app.interpreter.collected.values())))
+		tiers = self.app.interpreter.tiers
+		if tiers and (tiers.sizes['warm'] or tiers.sizes['cold']):
+			status += '\ncache: {} compressed, {} on disk'.format(format_bytes(tiers.sizes['warm']), format_bytes(tiers.sizes['cold']))
+		self.status.setText(status)
 		self.ring.progress = [1.]
 		self.ring.progressing = False
 		self.ring.color = QColor(0, 255, 0)
 		self.ring.update()
 		self.adjustSize()
 
+def format_bytes(size:int) -> str:
+	''' human readable memory size '''
+	for unit in ('B', 'kB', 'MB', 'GB'):
+		if size < 1024:
+			break
+		size /= 1024
+	return '{:.3g} {}'.format(size, unit)
+
 class MultiRing(QWidget):
 	''' progress ring '''
 	line_width = 1
@@ -25,11 +25,16 @@ from .utils import *
 empty = ()
 
 
+# resources of each openGL context that are independent of the scene (shaders, textures, fonts), shared by the scenes of all documents
+context_resources = {}
+
 class Scene(madcad.rendering.Scene, QObject):
 	def __init__(self, app, context=None, options=None):
 		# active selection path
 		self.active_selection = None
 		self.active_path = None
+		# source code locations of the selection, computed on demand
+		self._selected_sources = None
 		# systematic scene additions
 		self.additions = {		
 			'__grid__': madcad.rendering.Displayable(Grid),
@@ -55,6 +60,18 @@ class Scene(madcad.rendering.Scene, QObject):
 		
 		self.sync()
 	
+	def share(self, key, generator=None):
+		''' same as `madcad.rendering.Scene.share` but the resources that are only openGL objects are shared by all scenes using the same context, so they are not loaded again for each document '''
+		if key not in self.shared:
+			resources = context_resources.setdefault(self.context, {})
+			if key in resources:
+				self.shared[key] = resources[key]
+			else:
+				resource = madcad.rendering.Scene.share(self, key, generator)
+				if context_resource(resource):
+					resources[key] = resource
+		return madcad.rendering.Scene.share(self, key, generator)
+	
 	def sync(self):
 		''' synchronize the scene content with the rest of the application '''
 		name = self.app.active.scope
@@ -112,7 +129,33 @@ class Scene(madcad.rendering.Scene, QObject):
 		new.update(self.additions)
 		
 		super().update(new)
+		self._selected_sources = None
+		
+	def demand(self) -> set[str]|None:
+		''' names of the module variables this scene displays, or None if it may display any of them 
 		
+			the default displays are the ones of the last execution
+		'''
+		interpreter = self.app.interpreter
+		if self.app.active.scope != interpreter.filename or self.composer.show_all:
+			return None
+		keys = set()
+		if not self.composer.hide_all:
+			usage = interpreter.usages.get(interpreter.filename)
+			if usage is None:
+				return None
+			keys.update(usage.wo)
+			keys.update(usage.ro)
+		keys.difference_update(self.composer.hide_set)
+		keys.update(self.composer.show_set)
+		if self.app.active.scriptview:
+			for selected in self.app.active.scriptview.selection:
+				# variables of functions scopes depend on the calls of the function
+				if selected.scope != interpreter.filename:
+					return None
+				keys.add(selected.name)
+		return keys
+	
 	def prepare(self):
 		super().prepare()
 		# if scene is no more empty, adjust the view automatically
@@ -122,6 +165,7 @@ class Scene(madcad.rendering.Scene, QObject):
 	
 	def selection_add(self, display, sub=None):
 		super().selection_add(display, sub)
+		self._selected_sources = None
 		if display.selected:
 			if sub is None:
 				self.active_path = display.key
@@ -132,6 +176,7 @@ class Scene(madcad.rendering.Scene, QObject):
 				
 	def selection_remove(self, display, sub=None):
 		super().selection_remove(display, sub)
+		self._selected_sources = None
 		if not display.selected:
 			self.active_selection = next(iter(self.selection), None)
 			if self.active_selection:
@@ -139,6 +184,7 @@ class Scene(madcad.rendering.Scene, QObject):
 	
 	def selection_clear(self):
 		super().selection_clear()
+		self._selected_sources = None
 		self.active_selection = None
 		self.active_path = None
 	
@@ -159,6 +205,19 @@ class Scene(madcad.rendering.Scene, QObject):
 				text.append(']')
 		return ''.join(text)
 
+	def selected_sources(self) -> list[Located]:
+		''' source code of all the selected displays and their containing displays
+		
+			the result is cached until the selection or the scene content changes
+		'''
+		if self._selected_sources is None:
+			sources = {}
+			for display in self.selection:
+				for located in self.sources(display):
+					sources[id(located)] = located
+			self._selected_sources = sorted(sources.values(), key=lambda located: located.range.start)
+		return self._selected_sources
+	
 	def sources(self, display) -> Iterator[Located]:
 		''' yield the source code of successive containg displays '''
 		if not display.key:
@@ -962,6 +1021,17 @@ def beginwith(sequence, pattern):
 		if pattern[i] != sequence[i]:
 			return False
 	return True
+
+def context_resource(resource) -> bool:
+	''' check that a scene resource only consists of openGL objects and plain data, so it can be used by any scene with the same context '''
+	if isinstance(resource, (tuple, list)):
+		return all(context_resource(item)  for item in resource)
+	if isinstance(resource, dict):
+		return all(context_resource(item)  for item in resource.values())
+	return isinstance(resource, (
+		mgl.Program, mgl.Buffer, mgl.VertexArray, mgl.Texture, mgl.TextureCube, mgl.TextureArray, mgl.Texture3D,
+		str, int, float, np.ndarray, type(None),
+		))
 		
 class Highlight(madcad.rendering.Display):
 	def __init__(self, scene):
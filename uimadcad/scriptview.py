@@ -1,5 +1,6 @@
 import re
 from collections import deque
+from difflib import SequenceMatcher
 from bisect import bisect_right
 
 from arrex import typedlist
@@ -9,7 +10,7 @@ from madcad.qt import (
 	QWidget, QPlainTextEdit, QTextEdit, QVBoxLayout,
 	QTextCursor, QSyntaxHighlighter, QFont, QFontMetrics, QColor, QBrush, QTextOption, QPalette, QPainter, QTextDocument,
 	QSpinBox, QLabel, QLineEdit,
-	Qt, QEvent, QMargins, QSize, QRect, QSizePolicy, QKeySequence, 
+	Qt, QEvent, QMargins, QPoint, QSize, QRect, QSizePolicy, QKeySequence, 
 	)
 
 from . import settings, ast
@@ -32,6 +33,8 @@ class ScriptView(QWidget):
 		self.app = app
 		self.font = QFont(*settings.scriptview['font'])
 		self.selection = []
+		self._highlights = []	# text ranges to highlight, with their format
+		self._shown = []	# highlights currently set as extra selections
 		
 		# set cursor position on openning
 		if cursor:
@@ -101,6 +104,9 @@ class ScriptView(QWidget):
 		self.setFocusProxy(self.editor)
 		self.editor.updateRequest.connect(self._update_line_numbers)
 		self.editor.cursorPositionChanged.connect(self._update_current_location)
+		# extra selections only cover the visible text, so they must follow the scroll
+		self.editor.verticalScrollBar().valueChanged.connect(self._update_extra_selections)
+		self.editor.blockCountChanged.connect(self._update_extra_selections)
 		# self.editor.cursorPositionChanged.connect(self._update_active_selection)
 		if cursor:
 			self.editor.setTextCursor(cursor)
@@ -192,6 +198,7 @@ class ScriptView(QWidget):
 		# 		)
 		
 		self._update_line_numbers()
+		self._update_extra_selections()
 	
 	def _toolbars_visible(self, enable):
 		self.bot.setVisible(enable or self.findreplace.isVisible())
@@ -207,6 +214,11 @@ class ScriptView(QWidget):
 		
 		self.editor.setPalette(palette)
 		self.highlighter = Highlighter(self.editor.document(), self.font)
+		# formats for extra selections
+		self.fmt_selected = charformat(background=vec_to_qcolor(settings.scriptview['selection_background']))
+		self.fmt_highlighted = charformat(background=vec_to_qcolor(settings.scriptview['hover_background']))
+		self._shown = []
+		self.sync()
 	
 	def _update_line_numbers(self):
 		left = 0
@@ -287,22 +299,41 @@ class ScriptView(QWidget):
 	
 	def sync(self):
 		''' synchronize the text rendering with what is available in the app (selections, hovers, editors, ...) '''
-		s = settings.scriptview
-		selected = charformat(background=vec_to_qcolor(s['selection_background']))
-		highlighted = charformat(background=vec_to_qcolor(s['hover_background']))
-		
 		highlights = []
 		# selections from the script view
 		for item in self.selection:
-			highlights.append(extraselection(self._reindex_cursor(item.range), highlighted))
+			highlights.append((item.range, self.fmt_highlighted))
 		# selection from the scene view
 		if self.app.active.sceneview:
-			scene = self.app.active.sceneview.scene
-			for display in scene.selection:
-				for source in scene.sources(display):
-					highlights.append(extraselection(self._reindex_cursor(source.range), selected))
-				
-		self.editor.setExtraSelections(highlights)
+			for located in self.app.active.sceneview.scene.selected_sources():
+				highlights.append((located.range, self.fmt_selected))
+		
+		self._highlights = highlights
+		self._update_extra_selections()
+	
+	def _update_extra_selections(self):
+		''' set the extra selections for the highlights crossing the visible text
+		
+			setting extra selections is relayouting the document, so we only set the ones that are shown
+		'''
+		visible = self._visible_range()
+		start = self.app.reindex.downgrade(visible.start)
+		stop = self.app.reindex.downgrade(visible.stop)
+		shown = [(range, format)  
+			for range, format in self._highlights
+			if range.start < stop and range.stop > start]
+		if shown == self._shown:
+			return
+		self._shown = shown
+		self.editor.setExtraSelections([
+			extraselection(self._reindex_cursor(range), format)
+			for range, format in shown])
+	
+	def _visible_range(self) -> range:
+		''' text range of the blocks currently visible in the editor '''
+		first = self.editor.firstVisibleBlock()
+		last = self.editor.cursorForPosition(QPoint(0, self.editor.viewport().height())).block()
+		return range(first.position(), last.position() + last.length())
 		
 	def _reindex_cursor(self, range:range):
 		cursor = self.editor.textCursor()
@@ -521,6 +552,7 @@ class ScriptEdit(QPlainTextEdit):
 		self.setTabStopDistance(settings.scriptview['tabsize'] * QFontMetrics(view.font).averageCharWidth()+1.5)
 		self.setCursorWidth(QFontMetrics(view.font).averageCharWidth())
 		self.setCenterOnScroll(True)
+		self._scrub = None
 	
 	def focusInEvent(self, event):
 		view = self.parent()
@@ -548,6 +580,92 @@ class ScriptEdit(QPlainTextEdit):
 		if not event.isAccepted():
 			return super().keyPressEvent(event)
 	
+	def mousePressEvent(self, event):
+		# ctrl-drag on a numeric literal changes its value
+		if event.button() == Qt.LeftButton and event.modifiers() & Qt.ControlModifier:
+			self._scrub = self._scrub_literal(self.cursorForPosition(event.pos()).position())
+			if self._scrub:
+				self._scrub['x'] = event.pos().x()
+				self.viewport().setCursor(Qt.SizeHorCursor)
+				event.accept()
+				return
+		super().mousePressEvent(event)
+		
+	def mouseMoveEvent(self, event):
+		if self._scrub:
+			self._scrub_move(event.pos().x() - self._scrub['x'])
+			event.accept()
+		else:
+			super().mouseMoveEvent(event)
+	
+	def mouseReleaseEvent(self, event):
+		if self._scrub:
+			self._scrub = None
+			self.parent().app.scrubbing = False
+			self.viewport().setCursor(Qt.IBeamCursor)
+			event.accept()
+		else:
+			super().mouseReleaseEvent(event)
+	
+	def _scrub_literal(self, position:int) -> dict:
+		''' find the numeric literal at the given document position, return None if it is not part of the executed code '''
+		app = self.parent().app
+		block = self.document().findBlock(position)
+		column = position - block.position()
+		for match in number_pattern.finditer(block.text()):
+			if match.start() <= column <= match.end():
+				break
+		else:
+			return None
+		# literals with exponents have no obvious step
+		if match.group(2):
+			return None
+		start = block.position() + match.start()
+		source = app.reindex.downgrade(start)
+		if source not in app.interpreter.constants or app.reindex.upgrade(source) != start:
+			return None
+		text = match.group()
+		value = app.interpreter.constants[source][2].value
+		if isinstance(value, int):
+			unit, decimals = 1, 0
+		else:
+			# the step is the last digit of the literal
+			mantissa = match.group(1)
+			decimals = len(mantissa) - mantissa.index('.') - 1  if '.' in mantissa else 0
+			unit = 10**-decimals
+		app.scrubbing = True
+		return dict(start=start, length=len(text), source=source, value=value, unit=unit, decimals=decimals, first=True, submitted=value)
+	
+	def _scrub_move(self, offset:int):
+		''' change the scrubbed literal according to the mouse offset '''
+		scrub = self._scrub
+		steps = int(offset / settings.scriptview['scrub_step'])
+		if isinstance(scrub['value'], int):
+			value = scrub['value'] + steps
+			text = str(value)
+		else:
+			value = round(scrub['value'] + steps * scrub['unit'], scrub['decimals'])
+			text = '{:.{}f}'.format(value, scrub['decimals'])
+		# the mouse moves by pixels, but the value changes by steps
+		if value == scrub['submitted']:
+			return
+		scrub['submitted'] = value
+		
+		cursor = QTextCursor(self.document())
+		# the whole drag is a single undo step
+		if scrub['first']:
+			cursor.beginEditBlock()
+			scrub['first'] = False
+		else:
+			cursor.joinPreviousEditBlock()
+		cursor.setPosition(scrub['start'])
+		cursor.setPosition(scrub['start'] + scrub['length'], QTextCursor.KeepAnchor)
+		if cursor.selectedText() != text:
+			cursor.insertText(text)
+			scrub['length'] = len(text)
+		cursor.endEditBlock()
+		self.parent().app.scrub(scrub['source'], value)
+	
 
 class ScriptLines(QWidget):
 	''' line number display for the text view '''
@@ -950,6 +1068,47 @@ def move_text_cursor(cursor, location, movemode=QTextCursor.MoveAnchor):
 	if cursor.columnNumber() > column:	cursor.movePosition(cursor.PreviousCharacter, movemode, cursor.columnNumber()-column)
 
 
+# numeric literals that can be scrubbed
+number_pattern = re.compile(r'(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+def text_substitutions(old:str, new:str) -> list:
+	''' list of substitutions turning text `old` into `new`, as tuples `(position, removed, added)` 
+		where `removed` is the number of characters removed in `old` at `position` and `added` the inserted text
+		
+		the substitutions are sorted by decreasing position so they can be applied one after the other without reindexing.
+		Positions and numbers of characters are in UTF-16 units, like the positions in a `QTextDocument`
+	'''
+	old_lines = old.splitlines(keepends=True)
+	new_lines = new.splitlines(keepends=True)
+	# character position of each line start
+	starts = [0]
+	for line in old_lines:
+		starts.append(starts[-1] + utf16_length(line))
+	
+	substitutions = []
+	matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+	for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+		if tag == 'equal':
+			continue
+		substitutions.append((starts[i1], starts[i2] - starts[i1], ''.join(new_lines[j1:j2])))
+	substitutions.reverse()
+	return substitutions
+
+def utf16_length(text:str) -> int:
+	''' length of the given text in a `QTextDocument`, where characters outside the basic multilingual plane (like emojis) count twice '''
+	return len(text) + sum(ord(char) > 0xffff  for char in text)
+
+def apply_text_substitutions(document:QTextDocument, substitutions:list):
+	''' apply substitutions from `text_substitutions` to the given document, as one single undo step '''
+	cursor = QTextCursor(document)
+	cursor.beginEditBlock()
+	for position, removed, added in substitutions:
+		cursor.setPosition(position)
+		cursor.setPosition(position + removed, QTextCursor.KeepAnchor)
+		cursor.insertText(added)
+	cursor.endEditBlock()
+
+
 class SubstitutionIndex:
 	''' reindexation between a fixed sequence and a changed sequence '''
 	def __init__(self):
@@ -26,6 +26,8 @@ scriptview = {
 	'autocomplete': True,
 	
 	'tabsize': 4,
+	# mouse distance (pixels) for one step of a numeric literal being ctrl-dragged
+	'scrub_step': 5,
 	'font': ['NotoMono', 8],
 	'system_theme': True,
 	
@@ -42,6 +44,37 @@ scriptview = {
 	'comment_color': fvec3(0.5, 0.5, 0.5),
 	}
 
+execution = {
+	# keep the execution frames of the last exception, for inspecting its variables
+	'keep_frames': True,
+	# delay (ms) waiting for the end of a burst of file changes before reloading the file
+	'file_debounce': 50,
+	# update the scene as soon as top-level statements are executed, instead of at the end of the execution
+	'progressive_display': True,
+	# delay (ms) after the last document change before a live execution starts
+	'live_delay': 500,
+	# names of additional methods and functions known to not modify their object or arguments, so calling them does not invalidate the cache
+	'pure_methods': [],
+	'pure_functions': [],
+	# cache separately each iteration of the loops, so changing an element of the iterated values only executes its iteration again
+	'iteration_cache': False,
+	# memory (MB) of the cached results kept alive, the least recently used beyond are compressed
+	'cache_memory': 1024,
+	# memory (MB) of the compressed cached results, the least recently used beyond are written to temporary files
+	'cache_compressed': 1024,
+	# compression of the cached results: 'zlib' (fast) or 'lzma' (smaller)
+	'cache_compression': 'zlib',
+	# share the results of long computations with the other uimadcad processes, through files in the user cache directory (the documents of a same process always share them in memory)
+	# the results are kept across restarts and addressed by the code and arguments of the calls only, so enable it only for scripts whose calls are pure (not reading files, or local modules being edited)
+	'shared_cache': False,
+	# maximum size (MB) of the shared results, the least recently used beyond are removed
+	'shared_cache_size': 4096,
+	# pymadcad curve resolution of the preview executions, see `madcad.settings.curve_resolution`
+	'preview_resolution': ['rad', 0.8],
+	# delay (ms) after a preview execution before executing again at full quality
+	'preview_delay': 2000,
+	}
+
 configdir = madcad.settings.configdir
 locations = {
 	'config': configdir+'/madcad',
@@ -51,7 +84,7 @@ locations = {
 	'startup': configdir+'/madcad/startup.py',
 	}
 
-settings = {'window':window, 'scriptview':scriptview}
+settings = {'window':window, 'scriptview':scriptview, 'execution':execution}
 
 
 def qtc(c):
@@ -174,6 +207,9 @@ def use_color_preset(name=None):
 	
 	app = QApplication.instance()
 	app.setPalette(palette)
+	# icons rendered with the former colors
+	from . import icon
+	icon.invalidate()
 	app.setStyleSheet(app.styleSheet())
 
 
@@ -0,0 +1,124 @@
+''' startup profiling: timeline of the imports and initialization steps of the application
+
+	usage:
+
+		python -m uimadcad --profile-startup
+
+	Modules of the application mark their initialization steps with `mark` or `step`, that do nothing unless a `Timeline` is installed. This module must stay free of dependencies, so it can be imported before anything else.
+'''
+import sys
+import builtins
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter
+
+
+@dataclass(slots=True)
+class Event:
+	''' an import or initialization step of the timeline '''
+	kind: str
+	''' `'import'`, `'step'` or `'mark'` '''
+	label: str
+	start: float
+	''' seconds since the timeline start '''
+	duration: float = 0.
+	depth: int = 0
+	''' nesting level, imports of imports are nested in their parent import '''
+
+
+class Timeline:
+	''' record the time of the imports and of the initialization steps, once installed '''
+	def __init__(self):
+		self.start = perf_counter()
+		self.events = []
+		self._depth = 0
+		self._import = None
+
+	def install(self):
+		''' start recording, the marks of all modules and the imports of new modules go to this timeline '''
+		global timeline
+		timeline = self
+		self._import = builtins.__import__
+		builtins.__import__ = self._timed_import
+
+	def uninstall(self):
+		''' stop recording '''
+		global timeline
+		if timeline is self:
+			timeline = None
+		if self._import is not None:
+			builtins.__import__ = self._import
+			self._import = None
+
+	def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+		absolute = name
+		if level:
+			package = (globals or {}).get('__package__') or ''
+			if level > 1:
+				package = package.rsplit('.', level-1)[0]
+			absolute = package + '.' + name if name else package
+		# only the first import of a module takes time
+		if absolute in sys.modules:
+			module = sys.modules[absolute]
+			# submodules imported by name
+			new = ['{}.{}'.format(absolute, item)  
+				for item in fromlist or ()  
+				if item != '*' and not hasattr(module, item)]
+		else:
+			new = [absolute]
+		if not new:
+			return self._import(name, globals, locals, fromlist, level)
+		event = Event('import', ', '.join(new), perf_counter() - self.start, depth=self._depth)
+		self.events.append(event)
+		self._depth += 1
+		try:
+			return self._import(name, globals, locals, fromlist, level)
+		finally:
+			self._depth -= 1
+			event.duration = perf_counter() - self.start - event.start
+
+	def mark(self, label:str):
+		self.events.append(Event('mark', label, perf_counter() - self.start, depth=self._depth))
+
+	@contextmanager
+	def step(self, label:str):
+		event = Event('step', label, perf_counter() - self.start, depth=self._depth)
+		self.events.append(event)
+		self._depth += 1
+		try:
+			yield event
+		finally:
+			self._depth -= 1
+			event.duration = perf_counter() - self.start - event.start
+
+	def report(self, file=sys.stderr, threshold:float=0.005):
+		''' print the timeline, omitting the imports shorter than `threshold` seconds '''
+		for event in self.events:
+			if event.kind == 'import' and event.duration < threshold:
+				continue
+			print('{:>9.3f}s {:>9}  {}{} {}'.format(
+				event.start,
+				'{:.3f}s'.format(event.duration) if event.kind != 'mark' else '',
+				'  '*event.depth,
+				event.kind,
+				event.label,
+				), file=file)
+		print('{:>9.3f}s {:>9}  total'.format(perf_counter() - self.start, ''), file=file)
+
+
+# the timeline installed, if any
+timeline = None
+
+def mark(label:str):
+	''' record an instant of the startup in the installed timeline, if any '''
+	if timeline is not None:
+		timeline.mark(label)
+
+@contextmanager
+def step(label:str):
+	''' record the duration of an initialization step in the installed timeline, if any '''
+	if timeline is None:
+		yield
+	else:
+		with timeline.step(label):
+			yield
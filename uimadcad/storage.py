@@ -0,0 +1,601 @@
+''' memory estimation and storage tiers for the cached values of the interpreter
+
+	Cached results of a long script can use more memory than the computer has, while only a few of them are used by each execution. `Tiers` keeps the recently used values alive (hot tier), compresses in memory the values not used for a while (warm tier), and spills to temporary files the values not used for even longer (cold tier). Cold values are memory-mapped back when retreived, so their buffers (numpy arrays, arrex typedlists) are not copied until they are modified.
+'''
+import sys, os, types
+import pickle, zlib
+import struct, mmap
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import time
+from threading import RLock
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+
+def memsize(value, memo:set=None) -> int:
+	''' estimate the memory (bytes) used by a value and the objects it contains
+
+		objects which ids are in `memo` are not counted, and counted objects are added to `memo`
+		long sequences are estimated from their first elements
+	'''
+	if memo is None:
+		memo = set()
+	if id(value) in memo:
+		return 0
+	memo.add(id(value))
+
+	size = sys.getsizeof(value, 0)
+	if isinstance(value, (str, bytes, int, float, bool, type, type(None))):
+		return size
+	# buffers like numpy arrays or arrex typedlists
+	try:
+		view = memoryview(value)
+	except TypeError:
+		pass
+	else:
+		return size + view.nbytes
+
+	if isinstance(value, dict):
+		items = list(value.keys()) + list(value.values())
+	elif isinstance(value, (list, tuple, set, frozenset)):
+		items = list(value)
+	else:
+		items = []
+		if hasattr(value, '__dict__'):
+			items.append(value.__dict__)
+		for cls in type(value).__mro__:
+			for slot in getattr(cls, '__slots__', ()):
+				if hasattr(value, slot):
+					items.append(getattr(value, slot))
+
+	sample = 100
+	if len(items) > sample:
+		sampled = sum(memsize(item, memo)  for item in items[:sample])
+		return size + sampled * len(items) // sample
+	return size + sum(memsize(item, memo)  for item in items)
+
+
+def serialize(value) -> list[memoryview]:
+	''' pickle a value, returning the pickle data followed by the buffers it references
+
+		the buffers (like numpy arrays) are not copied in the pickle data, they are returned as is to be written or compressed separately
+	'''
+	buffers = []
+	data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+	return [memoryview(data), *(buffer.raw()  for buffer in buffers)]
+
+def deserialize(parts:list):
+	''' inverse of `serialize` '''
+	return pickle.loads(parts[0], buffers=parts[1:])
+
+# buffers in files are aligned for vectorized operations on memory-mapped arrays
+_alignment = 64
+
+def write(file, parts:list) -> int:
+	''' write serialized parts to a binary file, so they can be memory-mapped back by `read`. Return the number of bytes written '''
+	header = struct.pack('<{}Q'.format(len(parts)+1), len(parts), *(part.nbytes  for part in parts))
+	offset = file.write(header)
+	for part in parts:
+		offset += file.write(bytes(-offset % _alignment))
+		offset += file.write(part)
+	return offset
+
+def read(path:str) -> list[memoryview]:
+	''' memory-map the serialized parts in a file written by `write`
+
+		the file can be removed once read, the mapping lasts as long as the parts are referenced
+	'''
+	with open(path, 'rb') as file:
+		view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+	count, = struct.unpack_from('<Q', view)
+	offset = 8*(count+1)
+	parts = []
+	for length in struct.unpack_from('<{}Q'.format(count), view, 8):
+		offset += -offset % _alignment
+		parts.append(view[offset:offset+length])
+		offset += length
+	return parts
+
+
+# modules only needed by some configurations are imported on use, to not slow down the startup
+def _lzma_compress(data):
+	import lzma
+	return lzma.compress(data, preset=0)
+
+def _lzma_decompress(data):
+	import lzma
+	return lzma.decompress(data)
+
+compressions = {
+	'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+	'lzma': (_lzma_compress, _lzma_decompress),
+	}
+
+@dataclass(slots=True)
+class Compressed:
+	''' value of the warm tier, serialized and compressed in memory '''
+	compression: str
+	parts: list[bytes]
+	size: int
+	''' bytes used by the compressed parts '''
+	original: int
+	''' estimated bytes used by the live value '''
+
+	def load(self):
+		decompress = compressions[self.compression][1]
+		return deserialize([decompress(part)  for part in self.parts])
+
+@dataclass(slots=True)
+class Spilled:
+	''' value of the cold tier, serialized in a temporary file '''
+	path: str
+	size: int
+	''' bytes used by the file '''
+	original: int
+	''' estimated bytes used by the live value '''
+	owner: int = field(default_factory=os.getpid)
+	''' process that wrote the file, forked processes must not remove it '''
+
+	def load(self):
+		return deserialize(read(self.path))
+
+	def remove(self):
+		if os.getpid() != self.owner:
+			return
+		try:
+			os.unlink(self.path)
+		# the file might still be open or mapped on some systems, it will be removed with its directory
+		except OSError:
+			pass
+
+def _cleanup(directory:str, owner:int):
+	if os.getpid() == owner:
+		import shutil
+		shutil.rmtree(directory, ignore_errors=True)
+
+
+class Tiers:
+	''' storage tiers of the values cached by `ScopeCache`, shared by all the caches of an interpreter
+
+		- hot: values used recently are kept alive
+		- warm: when the hot values exceed their budget, the least recently used are serialized and compressed
+		- cold: when the warm values exceed their budget, the least recently used are written to a temporary directory
+
+		A warm or cold value retreived from its cache is loaded back and promoted to the hot tier. Values smaller than `threshold` and values that cannot be pickled always stay hot.
+
+		Attributes:
+			budgets:  maximum bytes of the hot and warm tiers
+			entries:  the tracked values of each tier `(id(cache), key): (cache, key, size)`, from the least to the most recently used
+			sizes:    bytes used by each tier
+			hits:     number of values retreived from each tier
+	'''
+	tiers = ('hot', 'warm', 'cold')
+
+	def __init__(self, hot:int=1<<30, warm:int=1<<30, compression:str='zlib', threshold:int=1<<16, directory:str=None):
+		if compression not in compressions:
+			raise ValueError('unknown compression {}'.format(repr(compression)))
+		self.budgets = {'hot': hot, 'warm': warm}
+		self.compression = compression
+		self.threshold = threshold
+		self.entries = {tier: OrderedDict()  for tier in self.tiers}
+		self.sizes = dict.fromkeys(self.tiers, 0)
+		self.hits = dict.fromkeys(self.tiers, 0)
+		self.promotions = 0  # number of values moved to the hot tier
+		self.demotions = 0   # number of values moved to a colder tier
+		self.pinned = 0      # number of values kept hot because they cannot be serialized
+		self.directory = directory
+		# tiers may be shared by interpreters executing in different threads
+		self.lock = RLock()
+		self._temporary = None
+		self._owner = None
+
+	def store(self, cache, key, value):
+		''' track a value just set in a cache, it might be demoted when other values are stored '''
+		size = memsize(value)
+		if size < self.threshold:
+			return
+		with self.lock:
+			self.entries['hot'][id(cache), key] = (cache, key, size)
+			self.sizes['hot'] += size
+			self.balance()
+
+	def retreive(self, cache, key, stored):
+		''' live value of a cached value, promoting it to the hot tier '''
+		ident = id(cache), key
+		with self.lock:
+			# an other thread may have demoted it meanwhile
+			stored = cache.scope.get(key, stored)
+			if isinstance(stored, Compressed):
+				tier = 'warm'
+			elif isinstance(stored, Spilled):
+				tier = 'cold'
+			else:
+				if ident in self.entries['hot']:
+					self.entries['hot'].move_to_end(ident)
+				self.hits['hot'] += 1
+				return stored
+
+			value = stored.load()
+			self.entries[tier].pop(ident)
+			self.sizes[tier] -= stored.size
+			if tier == 'cold':
+				stored.remove()
+			self.hits[tier] += 1
+			self.promotions += 1
+			cache.scope[key] = value
+			self.entries['hot'][ident] = (cache, key, stored.original)
+			self.sizes['hot'] += stored.original
+			self.balance()
+			return value
+
+	def forget(self, cache, key, stored):
+		''' stop tracking a value removed from its cache '''
+		ident = id(cache), key
+		with self.lock:
+			for tier, entries in self.entries.items():
+				entry = entries.pop(ident, None)
+				if entry:
+					self.sizes[tier] -= entry[2]
+					break
+		if isinstance(stored, Spilled):
+			stored.remove()
+
+	def balance(self):
+		''' demote the least recently used values until each tier fits its budget, the lock must be held '''
+		hot, warm, cold = self.entries.values()
+		# the most recent value stays hot, even if it exceeds the budget alone
+		while self.sizes['hot'] > self.budgets['hot'] and len(hot) > 1:
+			ident, (cache, key, size) = hot.popitem(last=False)
+			self.sizes['hot'] -= size
+			try:
+				stored = self.compress(cache.scope[key], size)
+			# pickling can fail with about any exception from user types
+			except Exception:
+				self.pinned += 1
+				continue
+			cache.scope[key] = stored
+			warm[ident] = (cache, key, stored.size)
+			self.sizes['warm'] += stored.size
+			self.demotions += 1
+
+		while self.sizes['warm'] > self.budgets['warm'] and warm:
+			ident, entry = warm.popitem(last=False)
+			cache, key, size = entry
+			try:
+				stored = self.spill(cache.scope[key])
+			except OSError:
+				# no space left, the value stays warm
+				warm[ident] = entry
+				warm.move_to_end(ident, last=False)
+				break
+			self.sizes['warm'] -= size
+			cache.scope[key] = stored
+			cold[ident] = (cache, key, stored.size)
+			self.sizes['cold'] += stored.size
+			self.demotions += 1
+
+	def compress(self, value, size:int) -> Compressed:
+		''' warm version of a live value '''
+		compress = compressions[self.compression][0]
+		parts = [compress(part)  for part in serialize(value)]
+		return Compressed(self.compression, parts, sum(len(part)  for part in parts), size)
+
+	def spill(self, stored:Compressed) -> Spilled:
+		''' cold version of a warm value '''
+		import tempfile
+		decompress = compressions[stored.compression][1]
+		parts = [memoryview(decompress(part))  for part in stored.parts]
+		descriptor, path = tempfile.mkstemp(suffix='.pickle', dir=self._directory())
+		with open(descriptor, 'wb') as file:
+			size = write(file, parts)
+		return Spilled(path, size, stored.original)
+
+	def _directory(self) -> str:
+		''' directory of the spilled files, created on first use '''
+		if self.directory:
+			return self.directory
+		# forked processes have their own directory, so they do not remove the files of their parent
+		if self._owner != os.getpid():
+			import tempfile
+			self._owner = os.getpid()
+			self._temporary = tempfile.mkdtemp(prefix='uimadcad-')
+			weakref.finalize(self, _cleanup, self._temporary, self._owner)
+		return self._temporary
+
+	def statistics(self) -> dict:
+		''' storage counters since the tiers creation '''
+		return dict(
+			**{tier: dict(
+					entries = len(self.entries[tier]),
+					bytes = self.sizes[tier],
+					hits = self.hits[tier],
+					)
+				for tier in self.tiers},
+			promotions = self.promotions,
+			demotions = self.demotions,
+			pinned = self.pinned,
+			)
+
+
+class Unaddressable(Exception):
+	''' raised when a value cannot be identified by its content '''
+
+# name of the module executing the scripts, its functions and types are defined by the scripts
+script_module = '__madcad__'
+
+def digest(value) -> str:
+	''' content address of a value: a digest identical in every process for equal values, or None if the value cannot be identified by its content
+
+		Unlike `hash`, the digest does not depend on the process (strings hashes are randomized). Functions are identified by their code, default values, closure, and the global variables they use when defined in a script. Functions of other modules are identified by their code and the version of their library, or the modification date of their module file when the library has no version. Other objects are identified by their pickle.
+		
+		The digest of a call only tells its inputs, so the results of impure calls (reading files, depending on the time, or calling helpers of other local modules that changed) must not be addressed with it.
+	'''
+	import hashlib
+	hasher = hashlib.blake2b(digest_size=20)
+	try:
+		_feed(hasher, value, {})
+	except Unaddressable:
+		return None
+	return hasher.hexdigest()
+
+def _feed(hasher, value, memo:dict):
+	''' feed the content of a value to a hasher, see `digest` '''
+	def feed(data:bytes):
+		hasher.update(struct.pack('<Q', len(data)))
+		hasher.update(data)
+	def name(value):
+		module = getattr(value, '__module__', None)
+		if module == script_module:
+			raise Unaddressable('defined in the script')
+		feed('{}:{}'.format(module, getattr(value, '__qualname__', None)).encode())
+		# library functions are identified by name, so the library version is part of their content
+		library = sys.modules.get((module or '').partition('.')[0])
+		version = getattr(library, '__version__', None)
+		feed(str(version).encode())
+		# local modules usually have no version, but their file changes along with them
+		if version is None:
+			try:
+				stat = os.stat(sys.modules[module].__file__)
+			except (KeyError, AttributeError, TypeError, OSError):
+				pass
+			else:
+				feed(struct.pack('<dQ', stat.st_mtime, stat.st_size))
+
+	kind = type(value)
+	feed(kind.__qualname__.encode())
+	if value is None or kind in (bool, int, float, complex):
+		feed(repr(value).encode())
+	elif kind is str:
+		feed(value.encode('utf-8', 'surrogatepass'))
+	elif kind is bytes:
+		feed(value)
+	elif kind in (tuple, list):
+		feed(struct.pack('<Q', len(value)))
+		for item in value:
+			_feed(hasher, item, memo)
+	elif kind is dict:
+		feed(struct.pack('<Q', len(value)))
+		for key, item in value.items():
+			_feed(hasher, key, memo)
+			_feed(hasher, item, memo)
+	elif kind in (set, frozenset):
+		# the items have no order, so they are fed sorted by digest
+		items = [digest(item)  for item in value]
+		if None in items:
+			raise Unaddressable('set item cannot be addressed')
+		feed(struct.pack('<Q', len(items)))
+		for item in sorted(items):
+			feed(item.encode())
+	elif kind is types.ModuleType:
+		feed(value.__name__.encode())
+	elif kind is types.FunctionType:
+		# recursive functions
+		if id(value) in memo:
+			feed(struct.pack('<Q', memo[id(value)]))
+			return
+		memo[id(value)] = len(memo)
+		if value.__module__ != script_module:
+			name(value)
+			_feed(hasher, value.__code__, memo)
+			return
+		_feed(hasher, value.__code__, memo)
+		_feed(hasher, value.__defaults__, memo)
+		_feed(hasher, value.__kwdefaults__, memo)
+		_feed(hasher, [cell.cell_contents  for cell in value.__closure__ or ()], memo)
+		# global variables used by the function
+		for used in sorted(_names(value.__code__)):
+			if used in value.__globals__:
+				feed(used.encode())
+				_feed(hasher, value.__globals__[used], memo)
+	elif kind is types.CodeType:
+		feed(value.co_code)
+		feed(' '.join(value.co_names + value.co_varnames).encode())
+		_feed(hasher, value.co_consts, memo)
+	elif kind is types.MethodType:
+		_feed(hasher, value.__func__, memo)
+		_feed(hasher, value.__self__, memo)
+	elif kind in (types.BuiltinFunctionType, type) or isinstance(value, type):
+		name(value)
+	else:
+		if kind.__module__ == script_module:
+			raise Unaddressable('instance of a type defined in the script')
+		buffers = []
+		try:
+			feed(pickle.dumps(value, protocol=5, buffer_callback=buffers.append))
+		# pickling can fail with about any exception from user types
+		except Exception:
+			raise Unaddressable('cannot be pickled')
+		for buffer in buffers:
+			feed(buffer.raw())
+
+def _names(code:types.CodeType) -> set[str]:
+	''' global names possibly used by a code and its nested codes '''
+	names = set(code.co_names)
+	for const in code.co_consts:
+		if isinstance(const, types.CodeType):
+			names |= _names(const)
+	return names
+
+
+class SharedStore:
+	''' content-addressed store of values, shared between the processes of a same user through a directory
+
+		Values are written in one file per content digest (see `digest`), and memory-mapped when read. Since the store persists across restarts, it must only hold results of pure computations: a call reading a file or a local module that changed since would get its former result back. The values recently loaded or saved are also kept in memory, so the documents of a same process share them immediately. A store that is not `persistent` only shares them in memory, between the documents of the process. Writes are atomic (a file is written aside, then renamed), so readers never see partial files. Removing the least recently used files when the store exceeds its size holds an exclusive lock on the directory, while reads and writes hold a shared lock.
+
+		Attributes:
+			directory:  directory of the files, or None if the store is not persistent
+			size:       maximum bytes of the files, the least recently used are removed beyond
+			threshold:  minimum computation time (seconds) of the values worth sharing
+			memory:     number of values recently loaded or saved kept in memory
+	'''
+	def __init__(self, directory:str=None, size:int=4<<30, threshold:float=0.1, memory:int=32, persistent:bool=True):
+		if not persistent:
+			directory = None
+		elif directory is None:
+			from . import version
+			directory = os.path.join(
+				os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+				'uimadcad', 'shared', 
+				# serialized values may not be compatible between versions
+				'{}-py{}.{}'.format(version, *sys.version_info[:2]),
+				)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		self.directory = directory
+		self.size = size
+		self.threshold = threshold
+		self.memory = memory
+		self.recent = OrderedDict()
+		# stores may be shared by interpreters executing in different threads
+		self.lock = RLock()
+		self.hits = 0     # number of values loaded
+		self.misses = 0   # number of values not in the store
+		self.writes = 0   # number of values saved
+		self._written = 0
+
+	digest = staticmethod(digest)
+
+	def path(self, digest:str) -> str:
+		return os.path.join(self.directory, digest[:2], digest+'.pickle')
+
+	def load(self, digest:str):
+		''' value stored with the given digest, or None '''
+		with self.lock:
+			if digest in self.recent:
+				self.recent.move_to_end(digest)
+				self.hits += 1
+				return self.recent[digest]
+		if not self.directory:
+			self.misses += 1
+			return None
+		path = self.path(digest)
+		try:
+			with self._lock():
+				parts = read(path)
+			value = deserialize(parts)
+		except FileNotFoundError:
+			self.misses += 1
+			return None
+		# the file may be corrupted or written by an incompatible library version
+		except Exception:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self._remember(digest, value)
+		# the modification time is used to find the least recently used files
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		return value
+	
+	def _remember(self, digest:str, value):
+		with self.lock:
+			self.recent[digest] = value
+			self.recent.move_to_end(digest)
+			while len(self.recent) > self.memory:
+				self.recent.popitem(last=False)
+
+	def save(self, digest:str, value):
+		''' store a value with the given digest, silently giving up if it cannot be serialized or written
+		
+			the value is kept in memory and given to other documents, so it must not be referenced by a script anymore
+		'''
+		self._remember(digest, value)
+		if not self.directory:
+			return
+		try:
+			parts = serialize(value)
+		# pickling can fail with about any exception from user types
+		except Exception:
+			return
+		import tempfile
+		path = self.path(digest)
+		try:
+			with self._lock():
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+				descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+				try:
+					with open(descriptor, 'wb') as file:
+						size = write(file, parts)
+					os.replace(temporary, path)
+				except BaseException:
+					os.unlink(temporary)
+					raise
+		except OSError:
+			return
+		self.writes += 1
+		self._written += size
+		if self._written > self.size // 16:
+			self.trim()
+
+	def trim(self, stale:float=3600):
+		''' remove the least recently used files until the store fits its size, and the temporary files older than `stale` seconds '''
+		self._written = 0
+		with self._lock(exclusive=True):
+			files = []
+			for entry in os.scandir(self.directory):
+				if entry.is_dir():
+					for file in os.scandir(entry.path):
+						try:
+							files.append((file.stat().st_mtime, file.stat().st_size, file.path))
+						except OSError:
+							pass
+			now = time()
+			total = sum(size  for _, size, path in files  if path.endswith('.pickle'))
+			for mtime, size, path in sorted(files):
+				if path.endswith('.pickle') and total <= self.size or path.endswith('.tmp') and now - mtime < stale:
+					continue
+				try:
+					os.unlink(path)
+				except OSError:
+					continue
+				if path.endswith('.pickle'):
+					total -= size
+
+	@contextmanager
+	def _lock(self, exclusive=False):
+		''' lock the store directory, shared or exclusive. Without file locks on the system, nothing is locked '''
+		if fcntl is None:
+			yield
+			return
+		with open(os.path.join(self.directory, 'lock'), 'a') as file:
+			fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+			try:
+				yield
+			finally:
+				fcntl.flock(file, fcntl.LOCK_UN)
+
+	def statistics(self) -> dict:
+		''' store counters since its creation in this process '''
+		return dict(
+			hits = self.hits,
+			misses = self.misses,
+			writes = self.writes,
+			)
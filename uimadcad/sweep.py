@@ -0,0 +1,191 @@
+''' parameter sweeps: execute variants of a madcad script with overriden parameters
+
+	Variants are executed from an interpreter that already executed the original script, so the results of statements that do not depend on the overriden parameters are reused from its cache. When processes can be forked, the worker processes inherit this interpreter and its cache after the common execution.
+
+	usage:
+
+		python -m uimadcad --batch script.py --sweep table.csv -e part -j 4
+
+	the table is a csv file with a column per parameter, and optionally a `name` column naming the variants
+'''
+import sys, os
+import csv
+import multiprocessing
+from dataclasses import dataclass
+from time import perf_counter
+
+from . import ast
+from .interpreter import Interpreter
+from .batch import export, script_directory
+
+
+@dataclass
+class Variant:
+	''' result of a variant execution '''
+	name: str
+	parameters: dict
+	time: float = 0.
+	''' execution time in seconds '''
+	hits: int = 0
+	''' number of statements reused from the cache '''
+	misses: int = 0
+	''' number of statements computed '''
+	error: str = None
+	''' error message if the execution or the export failed '''
+	exported: list = None
+	''' files written '''
+
+	@property
+	def shared(self) -> float:
+		''' fraction of the cached statements reused from previous executions '''
+		total = self.hits + self.misses
+		return self.hits / total if total else 0.
+
+
+def override(source:str, parameters:dict) -> str:
+	''' replace in the given source the values assigned to the given top-level variables
+
+		each parameter must be assigned in the module scope, only its first assignment is replaced
+	'''
+	substitutions = []
+	remaining = set(parameters)
+	for node in ast.parse(source).body:
+		if (isinstance(node, ast.Assign) and len(node.targets) == 1
+		and isinstance(node.targets[0], ast.Name) and node.targets[0].id in remaining):
+			name = node.targets[0].id
+			remaining.discard(name)
+			substitutions.append((
+				ast.textpos(source, (node.value.lineno, node.value.col_offset)),
+				ast.textpos(source, (node.value.end_lineno, node.value.end_col_offset)),
+				repr(parameters[name]),
+				))
+	if remaining:
+		raise ValueError('parameters not assigned in the script: {}'.format(', '.join(sorted(remaining))))
+	for start, stop, text in sorted(substitutions, reverse=True):
+		source = source[:start] + text + source[stop:]
+	return source
+
+def load_table(file:str) -> list[tuple[str, dict]]:
+	''' read a csv table of parameters, one variant per row
+
+		values are evaluated as python literals when possible, else kept as strings
+	'''
+	variants = []
+	with open(file, newline='') as stream:
+		for i, row in enumerate(csv.DictReader(stream)):
+			name = row.pop('name', None) or str(i)
+			parameters = {}
+			for key, value in row.items():
+				try:
+					parameters[key] = ast.literal_eval(value)
+				except (ValueError, SyntaxError):
+					parameters[key] = value
+			variants.append((name, parameters))
+	return variants
+
+def cache_counters(interpreter:Interpreter) -> tuple[int, int]:
+	''' total number of cache hits and misses of the given interpreter '''
+	hits = misses = 0
+	for versions in interpreter.cache.values():
+		for cache in versions.values():
+			hits += cache.hits
+			misses += cache.misses
+	return hits, misses
+
+def execute_variant(interpreter:Interpreter, source:str, name:str, parameters:dict, exports:dict[str, str]) -> Variant:
+	''' execute a variant of the given source, reusing the interpreter cache, and export its results
+
+		`exports` file names are formatted with the variant name (`{variant}`)
+	'''
+	variant = Variant(name, parameters, exported=[])
+	try:
+		code = override(source, parameters)
+	except (ValueError, SyntaxError) as err:
+		variant.error = str(err)
+		return variant
+
+	hits, misses = cache_counters(interpreter)
+	start = perf_counter()
+	with script_directory(interpreter.filename):
+		interpreter.execute(code, lambda *args: None)
+	variant.time = perf_counter() - start
+	variant.hits, variant.misses = cache_counters(interpreter)
+	variant.hits -= hits
+	variant.misses -= misses
+
+	if interpreter.exception:
+		variant.error = '{}: {}'.format(type(interpreter.exception).__name__, interpreter.exception)
+		# exceptions are not sent to the parent process
+		interpreter.release()
+		return variant
+
+	scope = interpreter.scopes.get(interpreter.filename, {})
+	for key, destination in exports.items():
+		destination = destination.format(variant=name)
+		try:
+			export(scope[key], destination)
+		except Exception as err:
+			variant.error = 'unable to export {} to {}: {}'.format(repr(key), destination, err)
+			break
+		variant.exported.append(destination)
+	return variant
+
+
+# interpreter and source inherited by forked worker processes
+_base = None
+
+def _worker(task):
+	global _base
+	if _base is None:
+		# the process has not been forked, there is nothing to share
+		_base = Interpreter(task[0]), task[1]
+	interpreter, source = _base
+	return execute_variant(interpreter, source, *task[2:])
+
+def sweep(script:str, variants:list[tuple[str, dict]], exports:dict[str, str], jobs:int=None) -> tuple[Variant, list[Variant]]:
+	''' execute the given variants of the script, sharing the results of statements that do not depend on the variants parameters
+
+		Args:
+			script:    path to the script
+			variants:  list of `(name, parameters)`
+			exports:   destination file for each variable to export, formatted with the variant name (`{variant}`)
+			jobs:      number of worker processes, default to the number of cpus
+
+		Returns:
+			the execution of the original script, and the execution of each variant
+	'''
+	global _base
+	source = open(script, 'r').read()
+	interpreter = Interpreter(script, keep_frames=False)
+	# common execution, its cache is inherited by workers
+	base = execute_variant(interpreter, source, 'base', {}, {})
+	if base.error:
+		return base, []
+
+	tasks = [(script, source, name, parameters, exports)  for name, parameters in variants]
+	if 'fork' in multiprocessing.get_all_start_methods():
+		context = multiprocessing.get_context('fork')
+	else:
+		context = multiprocessing.get_context()
+	_base = interpreter, source
+	try:
+		with context.Pool(jobs) as pool:
+			results = pool.map(_worker, tasks, chunksize=1)
+	finally:
+		_base = None
+	return base, results
+
+def report(base:Variant, variants:list[Variant], file=sys.stdout):
+	''' print the execution time and shared fraction of each variant '''
+	print('{:>10.3f}s  {:>4}/{:<4} shared  {}'.format(base.time, 0, base.misses, 'original script'), file=file)
+	for variant in variants:
+		print('{:>10.3f}s  {:>4}/{:<4} shared  {}  {}'.format(
+			variant.time, variant.hits, variant.hits + variant.misses, variant.name,
+			'error: '+variant.error if variant.error else ' '.join(variant.exported),
+			), file=file)
+	total = sum(variant.hits + variant.misses  for variant in variants)
+	hits = sum(variant.hits  for variant in variants)
+	print('{:>10.3f}s  {:>4}/{:<4} shared  total ({:.0%})'.format(
+		base.time + sum(variant.time  for variant in variants),
+		hits, total, hits/total if total else 0.,
+		), file=file)
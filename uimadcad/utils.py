@@ -2,14 +2,14 @@ import sys
 import traceback
 import locale
 import signal
-from threading import Thread, Lock
+from threading import Thread, Lock, current_thread, main_thread
 from functools import partial
 from collections import deque
 from types import MethodType
 from time import perf_counter
 
 from madcad.qt import (
-	Qt, QTimer, Signal, QSize, QMargins, QStyle,
+	Qt, QObject, QTimer, Signal, QSize, QMargins, QStyle,
 	QIcon, QKeySequence, QColor, QTextCharFormat, QTextCursor,
 	QWidget, QBoxLayout, QLayoutItem, QVBoxLayout, QHBoxLayout, QSizePolicy, QSplitter,
 	QPushButton, QDockWidget, QToolBar, QActionGroup, QButtonGroup,
@@ -99,46 +99,78 @@ class catchtime(object):
 		return '<chrono {}>'.format(self())
 
 
-qttasks = deque()
-qttasks_timer = None
+class QtDispatcher(QObject):
+	''' execute in the Qt thread the tasks scheduled from any thread
+	
+		The Qt loop is woken by a queued signal only when tasks are pending, so there is no latency and no wakeup when idle. A burst of tasks scheduled before the Qt loop has processed them is executed at once
+	'''
+	wake = Signal()
+	
+	def __init__(self):
+		super().__init__()
+		self.tasks = deque()
+		self.lock = Lock()
+		self.pending = False
+		self.wake.connect(self.process, Qt.QueuedConnection)
+	
+	def schedule(self, callback):
+		''' put a task for the Qt thread to execute as soon as possible '''
+		with self.lock:
+			self.tasks.append(callback)
+			if self.pending:
+				return
+			self.pending = True
+		self.wake.emit()
+	
+	def process(self):
+		''' execute all pending tasks, this is called in the Qt thread '''
+		with self.lock:
+			self.pending = False
+		while self.tasks:
+			task = self.tasks.popleft()
+			# an exception escaping a Qt slot would abort the application
+			try:	task()
+			except Exception:
+				traceback.print_exc()
+
+# the dispatcher must belong to the Qt thread, which is the one importing this module
+qtdispatcher = QtDispatcher()
+
 def qtmain(app=None):
 	''' create and run the QApplication and the Qt main loop '''
-	global qttasks_timer, qtstopped
+	global qtstopped
 	
 	if not app:	
 		app = QApplication(sys.argv)
 	
 	locale.setlocale(locale.LC_ALL, 'C')
 	
-	def process_tasks():
-		while qttasks:
-			qttasks.popleft() ()
-			
-	qttasks_timer = QTimer()
-	qttasks_timer.setInterval(50)
-	qttasks_timer.timeout.connect(process_tasks)
-	qttasks_timer.start()
-	
 	qtstopped = False
 	app.exec()
 
 def qtschedule(callback):
 	''' put a task for the Qt thread to execute as soon as possible '''
-	qttasks.append(callback)
+	qtdispatcher.schedule(callback)
 
-def qtinvoke(callback):
-	''' same as qtschedule but wait for the task end '''
+def qtinvoke(callback, timeout:float=None):
+	''' same as qtschedule but wait for the task end and return its result
+	
+		if `timeout` is given and the task did not end in time, a `TimeoutError` is raised (the task will still be executed)
+	'''
+	if current_thread() is main_thread():
+		return callback()
 	lock = Lock()
 	lock.acquire()
 	result = [None, None]
 	def wrapper():
 		try:	result[0] = callback()
 		except Exception as err:
-			print_exc()
+			traceback.print_exc()
 			result[1] = err
 		lock.release()
 	qtschedule(wrapper)
-	lock.acquire()
+	if not lock.acquire(timeout=-1 if timeout is None else timeout):
+		raise TimeoutError('task not executed by Qt in time')
 	if result[1]:	raise result[1]
 	return result[0]
 	